@@ -0,0 +1,179 @@
+"""
+Архив обращений по месяцам.
+
+В журнале (tickets.db) остаются только обращения незакрытых месяцев.
+Закрытый месяц запечатывается: обращения пишутся в сжатый сегмент
+JSONL и в Excel-файл этого месяца, сегмент заносится в manifest.json
+и только после этого удаляется из журнала. Запечатанные сегменты
+больше не меняются, поэтому их Excel отдаётся без пересборки.
+"""
+
+import gzip
+import hashlib
+import json
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from reports import write_excel
+from storage import (
+    TICKET_FIELDS, TicketStore, atomic_output, atomic_write_text, period_bounds,
+)
+
+_PERIOD_RE = re.compile(r"^\d{4}-\d{2}$")
+
+
+class TicketArchive:
+    """Каталог запечатанных месяцев и их манифест."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.manifest_path = self.directory / "manifest.json"
+        self._segments: dict[str, dict] = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        segments, mtime = {}, None
+        if self.manifest_path.exists():
+            mtime = self.manifest_path.stat().st_mtime_ns
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                segments = {s["period"]: s for s in json.load(f)["segments"]}
+        with self._lock:
+            self._segments = segments
+            self._mtime = mtime
+
+    def _refresh(self):
+        """Перечитать манифест, если месяц запечатал другой процесс."""
+        try:
+            mtime = self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    def segments(self) -> list[dict]:
+        """Записи манифеста, от старых месяцев к новым."""
+        self._refresh()
+        with self._lock:
+            return [self._segments[p] for p in sorted(self._segments)]
+
+    def segment(self, period: str) -> dict | None:
+        self._refresh()
+        return self._segments.get(period)
+
+    def jsonl_path(self, period: str) -> Path:
+        return self.directory / f"tickets-{period}.jsonl.gz"
+
+    def xlsx_path(self, period: str) -> Path:
+        return self.directory / f"crm_support_{period}.xlsx"
+
+    def iter_records(self, period: str | None = None):
+        """Обращения сегмента (по умолчанию всех по порядку) кортежами
+        (id, *TICKET_FIELDS), потоково."""
+        if period is None:
+            for period in sorted(self._segments):
+                yield from self.iter_records(period)
+            return
+        if period not in self._segments:
+            return
+        with gzip.open(self.jsonl_path(period), "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                yield (record["id"], *(record[field] for field in TICKET_FIELDS))
+
+    def iter_filtered(self, since: str, until: str, filters: dict[str, str] | None = None):
+        """Обращения архива за [since, until), подходящие под filters:
+        кортежи (id, *TICKET_FIELDS) — месяц за месяцем, внутри месяца
+        в порядке номеров (обращение, записанное задним числом, может
+        оказаться после более поздних).
+
+        Читаются только сегменты, чей месяц пересекается с периодом, так
+        что неделя из многолетнего архива стоит чтения одного-двух месяцев.
+        """
+        columns = [(TICKET_FIELDS.index(f) + 1, v) for f, v in (filters or {}).items()]
+        at = TICKET_FIELDS.index("created_at") + 1
+        for segment in self.segments():
+            lo, hi = period_bounds(segment["period"])
+            if not segment["rows"] or hi <= since or lo >= until:
+                continue
+            for record in self.iter_records(segment["period"]):
+                if since <= record[at] < until and all(record[i] == v for i, v in columns):
+                    yield record
+
+    @staticmethod
+    def closed_periods(store: TicketStore, now: datetime | None = None) -> list[str]:
+        """Месяцы в журнале, которые уже закончились и подлежат архивации."""
+        current = (now or datetime.now()).strftime("%Y-%m")
+        return [p for p in store.periods() if _PERIOD_RE.match(p) and p < current]
+
+    def seal(self, store: TicketStore, period: str) -> dict:
+        """Записать месяц из журнала в архив и обновить манифест.
+
+        Журнал здесь только читается; удаление строк делает вызывающий
+        через store.archive_period(period, entry["last_id"]). Если месяц
+        уже был в архиве (повтор после сбоя или опоздавшие обращения),
+        новые строки дописываются к прежнему сегменту.
+        """
+        previous = self.segment(period)
+        known_last_id = previous["last_id"] if previous else 0
+        jsonl_path = self.jsonl_path(period)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        rows = 0
+        first = last = None
+        first_at = last_at = None
+        with atomic_output(str(jsonl_path)) as tmp_path:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as out:
+                sources = [store.iter_records(period, after_id=known_last_id)]
+                if previous:
+                    sources.insert(0, self.iter_records(period))
+                for source in sources:
+                    for record in source:
+                        out.write(json.dumps(
+                            {"id": record[0], **dict(zip(TICKET_FIELDS, record[1:]))},
+                            ensure_ascii=False,
+                        ) + "\n")
+                        rows += 1
+                        first = first or record
+                        last = record
+                        # Номера идут по порядку, время — нет: строки бывают задним числом
+                        first_at = min(first_at or record[1], record[1])
+                        last_at = max(last_at or record[1], record[1])
+
+        entry = {
+            "period": period,
+            "rows": rows,
+            "first_id": first[0] if first else 0,
+            "last_id": max(last[0] if last else 0, known_last_id),
+            "first_at": first_at,
+            "last_at": last_at,
+            "jsonl": jsonl_path.name,
+            "xlsx": self.xlsx_path(period).name,
+            "sha256": _sha256(jsonl_path),
+            "sealed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self._lock:
+            self._segments[period] = entry
+        write_excel(self.iter_records(period), str(self.xlsx_path(period)), store)
+        self._save_manifest()
+        return entry
+
+    def _save_manifest(self):
+        with self._lock:
+            segments = [self._segments[p] for p in sorted(self._segments)]
+        atomic_write_text(
+            str(self.manifest_path),
+            json.dumps({"segments": segments}, ensure_ascii=False, indent=2),
+        )
+        with self._lock:
+            self._mtime = self.manifest_path.stat().st_mtime_ns
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
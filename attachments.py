@@ -0,0 +1,128 @@
+"""
+Хранилище вложений: скриншоты и файлы, приложенные к обращениям.
+
+Файл лежит на диске под именем, равным SHA-256 его содержимого, так что
+одинаковый скриншот от десяти сотрудников хранится один раз. Скачивание
+идёт потоком по кусочкам: хэш считается на лету, целиком файл в памяти
+не бывает. Уменьшенная копия картинки для просмотра (превью) строится
+в отдельном пуле потоков, не задерживая event loop.
+
+Что это за файл и к каким обращениям он приложен, хранит журнал
+обращений (TicketStore.add_blob, attach_files).
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+from PIL import Image, ImageOps
+
+from storage import atomic_output
+
+
+def _make_preview(source: Path, target: Path, size: int) -> bool:
+    """Уменьшить картинку до size точек по большей стороне, сохранить в JPEG.
+
+    Выполняется в пуле потоков: Pillow отпускает GIL на разборе и
+    масштабировании. False — файл не картинка или битый.
+    """
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            with atomic_output(str(target)) as tmp_path:
+                image.save(tmp_path, "JPEG", quality=85)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+    return True
+
+
+class BlobStore:
+    """Каталог файлов, адресуемых хэшем содержимого."""
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, directory: str, preview_size: int = 1280, workers: int = 2):
+        self.directory = Path(directory)
+        self.preview_size = preview_size
+        self._workers = workers
+        self._client: httpx.AsyncClient | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    def path(self, sha256: str) -> Path:
+        return self.directory / "blobs" / sha256[:2] / sha256
+
+    def preview_path(self, sha256: str) -> Path:
+        return self.directory / "previews" / sha256[:2] / f"{sha256}.jpg"
+
+    def exists(self, sha256: str) -> bool:
+        return self.path(sha256).exists()
+
+    async def start(self):
+        (self.directory / "tmp").mkdir(parents=True, exist_ok=True)
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(30, connect=10))
+        self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix="preview")
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def download(self, source: str) -> tuple[str, int]:
+        """Скачать файл по ссылке Bot API в хранилище; вернуть (sha256, размер).
+
+        source — file_path из getFile: ссылка на api.telegram.org или,
+        у локального сервера Bot API, путь к файлу на диске.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory / "tmp", suffix=".part")
+        digest, size = hashlib.sha256(), 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                if source.startswith(("http://", "https://")):
+                    async with self._client.stream("GET", source) as response:
+                        response.raise_for_status()
+                        async for chunk in response.aiter_bytes(self.CHUNK_SIZE):
+                            digest.update(chunk)
+                            out.write(chunk)
+                            size += len(chunk)
+                else:
+                    size = await asyncio.to_thread(self._copy, Path(source), out, digest)
+            sha256 = digest.hexdigest()
+            target = self.path(sha256)
+            if target.exists():
+                os.unlink(tmp_path)  # такой файл уже есть
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return sha256, size
+
+    def _copy(self, source: Path, out, digest) -> int:
+        size = 0
+        with open(source, "rb") as f:
+            while chunk := f.read(self.CHUNK_SIZE):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        return size
+
+    async def make_preview(self, sha256: str) -> bool:
+        """Построить превью картинки в пуле потоков (если его ещё нет)."""
+        target = self.preview_path(sha256)
+        if target.exists():
+            return True
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, _make_preview, self.path(sha256), target, self.preview_size,
+        )
@@ -0,0 +1,301 @@
+"""
+Нагрузочный бенчмарк CRM-Помощника.
+
+Поднимает настоящий Application из bot.py с подменённым HTTP-клиентом
+Bot API (ответы генерируются локально, в сеть ничего не уходит) и прогоняет
+через ConversationHandler полный сценарий для N пользователей:
+/start → ФИО → модуль → «Сообщить об ошибке» → категория → описание.
+
+Перед прогоном во временный каталог данных заливаются уже существующие
+пользователи и обращения. Печатает p50/p95/p99 задержки по каждому шагу,
+пропускную способность и прирост файлов данных.
+
+    python benchmark.py --users 200 --existing-users 10000 --existing-tickets 100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+import bot
+import metrics
+
+BENCH_TOKEN = "123456:BENCHMARK"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "CRM", "username": "crm_bench_bot"}
+ADMIN_ID = 1
+FIRST_USER_ID = 10_000_000
+
+WORDS = (
+    "не открывается карточка клиента ошибка при сохранении звонок не проходит "
+    "телефония воронка зависает отчёт формируется долго почта не отправляется "
+    "интерес дублируется после обновления пропала кнопка"
+).split()
+
+
+class FakeBotApi(BaseRequest):
+    """Заглушка Bot API: отвечает на вызовы без сети и считает их."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls: Counter[str] = Counter()
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        params = request_data.parameters if request_data is not None else {}
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": params.get("message_id", self._message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# ── Генерация входящих обновлений ──────────────────────────────────────
+
+class UpdateFactory:
+    def __init__(self, app):
+        self.app = app
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        data = {
+            "message_id": self._next_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return Update.de_json({"update_id": self._update_id, "message": data}, self.app.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = self._next_id()
+        return Update.de_json(
+            {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": str(update_id),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": {
+                        "message_id": update_id,
+                        "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"},
+                        "from": BOT_USER,
+                        "text": "…",
+                    },
+                },
+            },
+            self.app.bot,
+        )
+
+
+# ── Подготовка данных ──────────────────────────────────────────────────
+
+def seed(existing_users: int, existing_tickets: int):
+    """Залить в хранилище уже существующих пользователей и обращения."""
+    rng = random.Random(42)
+    modules = bot._ui.modules
+    categories = bot._ui.error_categories
+    bot.users.set_many(
+        (1_000 + i, f"Сотрудник {i:06d}", rng.choice(modules))
+        for i in range(existing_users)
+    )
+
+    batch = []
+    for i in range(existing_tickets):
+        is_error = rng.random() < 0.8
+        batch.append({
+            "created_at": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00",
+            "user_id": 1_000 + rng.randrange(max(existing_users, 1)),
+            "fio": f"Сотрудник {i % max(existing_users, 1):06d}",
+            "module": rng.choice(modules),
+            "kind": "Ошибка" if is_error else "Предложение",
+            "category": rng.choice(categories) if is_error else "—",
+            "description": " ".join(rng.choices(WORDS, k=12)),
+        })
+        if len(batch) == 5000:
+            bot.tickets.append_many(batch)
+            batch = []
+    if batch:
+        bot.tickets.append_many(batch)
+
+
+def data_sizes(data_dir: Path) -> dict[str, int]:
+    return {
+        p.name: p.stat().st_size
+        for p in sorted(data_dir.iterdir())
+        if p.is_file() and not p.name.startswith(".")
+    }
+
+
+# ── Прогон ─────────────────────────────────────────────────────────────
+
+async def run_user(app, factory: UpdateFactory, user_id: int, latencies: dict):
+    rng = random.Random(user_id)
+    steps = [
+        ("cmd_start", factory.message(user_id, "/start")),
+        ("reg_fio", factory.message(user_id, f"Нагрузочный Тест {user_id}")),
+        ("reg_module", factory.callback(user_id, f"module:{rng.choice(bot._ui.modules)}")),
+        ("menu_handler", factory.callback(user_id, "report_error")),
+        ("error_category_handler", factory.callback(
+            user_id, f"errcat:{rng.choice(bot._ui.error_categories)}",
+        )),
+        ("error_description_handler", factory.message(
+            user_id, " ".join(rng.choices(WORDS, k=15)),
+        )),
+    ]
+    for name, update in steps:
+        start = time.perf_counter()
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies[name].append(time.perf_counter() - start)
+
+
+async def run_admin(app, factory: UpdateFactory, latencies: dict):
+    for name, data in (("admin:stats", "admin:stats"), ("admin:export", "admin:export"),
+                       ("admin:export:hot", "admin:export:hot"),
+                       ("admin:export:hot (кэш)", "admin:export:hot"),
+                       ("admin:export:all", "admin:export:all"), ("admin:users", "admin:users")):
+        update = factory.callback(ADMIN_ID, data)
+        start = time.perf_counter()
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies[name].append(time.perf_counter() - start)
+
+
+def percentile(values: list[float], q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def report(latencies: dict, elapsed: float, api: FakeBotApi, before: dict, after: dict):
+    print(f"\n{'Шаг':32} {'n':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    total = 0
+    for name, values in latencies.items():
+        total += len(values)
+        ms = [v * 1000 for v in values]
+        print(
+            f"{name:32} {len(ms):6d} {percentile(ms, 50):9.2f} "
+            f"{percentile(ms, 95):9.2f} {percentile(ms, 99):9.2f} {max(ms):9.2f}"
+        )
+    print(f"\nОбновлений: {total}, время: {elapsed:.2f} с, "
+          f"пропускная способность: {total / elapsed:.0f} обн./с")
+    print("Вызовы Bot API: " + ", ".join(f"{k}={v}" for k, v in sorted(api.calls.items())))
+    print("\n" + re.sub(r"</?\w+>", "", metrics.summary_text(limit=12)))
+    print("\nФайлы данных (байт):")
+    for name in sorted(set(before) | set(after)):
+        b, a = before.get(name, 0), after.get(name, 0)
+        print(f"  {name:32} {b:>12} → {a:>12} (+{a - b})")
+
+
+async def bench(args):
+    api = FakeBotApi(delay=args.api_delay / 1000)
+    bot.open_storage()
+    seed(args.existing_users, args.existing_tickets)
+    bot._ui = bot._compile_ui(bot._ui.modules, bot._ui.error_categories, [ADMIN_ID])
+    bot.metrics_server = None  # не занимаем порт метрик рабочего бота
+    if args.api_rate:
+        bot.api_limiter = bot.TokenBucketRateLimiter(args.api_rate, bot.API_CHAT_RATE, bot.API_CHAT_BURST)
+    else:
+        bot.api_limiter = None  # замеряем сам бот, а не лимиты Telegram
+    data_dir = Path(bot.TICKETS_DB_FILE).parent
+    before = data_sizes(data_dir)
+
+    app = bot.build_application(BENCH_TOKEN, request=api)
+    await app.initialize()
+    await bot.post_init(app)
+    await app.start()
+    factory = UpdateFactory(app)
+    latencies: dict[str, list[float]] = defaultdict(list)
+    try:
+        user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+        start = time.perf_counter()
+        for i in range(0, len(user_ids), args.concurrency):
+            wave = user_ids[i:i + args.concurrency]
+            await asyncio.gather(*(run_user(app, factory, uid, latencies) for uid in wave))
+        elapsed = time.perf_counter() - start
+        if not args.no_admin:
+            await run_admin(app, factory, latencies)
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await bot.post_shutdown(app)
+
+    report(latencies, elapsed, api, before, data_sizes(data_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк CRM-Помощника")
+    parser.add_argument("--users", type=int, default=100, help="сколько пользователей проходят сценарий")
+    parser.add_argument("--concurrency", type=int, default=50, help="сколько из них одновременно")
+    parser.add_argument("--existing-users", type=int, default=1_000)
+    parser.add_argument("--existing-tickets", type=int, default=1_000)
+    parser.add_argument("--api-delay", type=float, default=0.0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--api-rate", type=float, default=0,
+                        help="ограничить исходящие вызовы, в секунду (по умолчанию без ограничения)")
+    parser.add_argument("--no-admin", action="store_true", help="не замерять админские кнопки")
+    parser.add_argument("--data-dir", help="каталог данных (по умолчанию временный)")
+    args = parser.parse_args()
+
+    workdir = args.data_dir or tempfile.mkdtemp(prefix="crm-bench-")
+    os.chdir(workdir)
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} каталог данных: {workdir}")
+    print(f"Пользователей: {args.users} (по {args.concurrency} одновременно), "
+          f"существующих пользователей: {args.existing_users}, "
+          f"обращений: {args.existing_tickets}")
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,37 @@
 """
 CRM-Помощник — Telegram-бот поддержки отдела 1С CRM.
-Сбор ошибок и предложений с записью в Excel.
+Сбор ошибок и предложений: журнал в SQLite, выгрузка в Excel.
 """
 
+import argparse
+import asyncio
+import html
+import itertools
 import json
+import logging
 import os
-from datetime import datetime
+import runpy
+import signal
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import NamedTuple
 
-from openpyxl import Workbook, load_workbook
 from telegram import (
     BotCommand,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputMediaPhoto,
     KeyboardButton,
     ReplyKeyboardMarkup,
     Update,
 )
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
@@ -26,15 +39,74 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.request import BaseRequest, HTTPXRequest
 
 from config import (
     ADMIN_IDS,
+    API_CHAT_BURST,
+    API_CHAT_RATE,
+    API_OVERALL_RATE,
+    ARCHIVE_DIR,
+    ATTACHMENT_MAX_SIZE,
+    ATTACHMENTS_DIR,
     BOT_TOKEN,
+    CONCURRENT_UPDATES,
+    CONFIG_WATCH_INTERVAL,
+    DIGEST_INTERVAL,
+    DUPLICATE_THRESHOLD,
+    DUPLICATE_WINDOW_MINUTES,
     ERROR_CATEGORIES,
     EXCEL_FILE,
+    FLOOD_BURST,
+    FLOOD_RATE,
+    INBOX_DB_FILE,
+    LEGACY_EXCEL_FILE,
+    METRICS_LISTEN,
+    METRICS_PORT,
     MODULES,
+    PRIORITY_CATEGORIES,
+    PREVIEW_SIZE,
+    PREVIEW_WORKERS,
+    PRIORITY_COOLDOWN,
+    PROFILE_MAX_SECONDS,
+    REPORTS_DIR,
+    ROLLUP_INTERVAL,
+    STALL_HISTORY,
+    STALL_THRESHOLD,
+    STATE_DB_FILE,
+    STATE_FLUSH_INTERVAL,
+    TICKETS_DB_FILE,
+    UPDATE_MODE,
     USERS_DB_FILE,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WORKER_POLL_INTERVAL,
+    WORKERS,
 )
+import metrics
+import search
+import stalls
+from archive import TicketArchive
+from attachments import BlobStore
+from incidents import IncidentDetector
+from notifications import AdminDigest, DigestItem, render
+from metrics import MeteredRequest, MetricsServer
+from persistence import SqlitePersistence
+from profiling import ProfileSession, summary_text
+from ratelimit import FloodControl, TokenBucketRateLimiter
+from stalls import LoopWatchdog
+from migrate import CHUNK_SIZE, MigrationError, migrate_tickets, migrate_users
+from reports import export_excel, write_excel
+from storage import (
+    EXPORT_FILTERS, Receipt, StorageWriter, TicketStore, UpdateInbox, UserRegistry,
+    period_bounds,
+)
+from trends import TrendReports
+
+logger = logging.getLogger(__name__)
 
 # ── Состояния ConversationHandler ──────────────────────────────────────
 (
@@ -64,121 +136,175 @@ ERROR_EMOJI = {
     "Другое": "🔧",
 }
 
-# ── Вспомогательные функции для хранения пользователей ─────────────────
+# ── Хранение пользователей ─────────────────────────────────────────────
+
+users = UserRegistry(TICKETS_DB_FILE)
+
 
 def _ensure_data_dir():
     Path(USERS_DB_FILE).parent.mkdir(parents=True, exist_ok=True)
     Path(EXCEL_FILE).parent.mkdir(parents=True, exist_ok=True)
 
 
-def _load_users() -> dict:
-    _ensure_data_dir()
-    if os.path.exists(USERS_DB_FILE):
-        with open(USERS_DB_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-
-def _save_users(users: dict):
-    _ensure_data_dir()
-    with open(USERS_DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
-
-
 def _get_user(user_id: int) -> dict | None:
-    users = _load_users()
-    return users.get(str(user_id))
+    return users.get(user_id)
 
 
-def _save_user(user_id: int, fio: str, module: str):
-    users = _load_users()
-    users[str(user_id)] = {
-        "fio": fio,
-        "module": module,
-        "registered_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-    }
-    _save_users(users)
+# ── Обращения ──────────────────────────────────────────────────────────
 
+tickets = TicketStore(TICKETS_DB_FILE)
 
-# ── Excel ──────────────────────────────────────────────────────────────
-
-EXCEL_HEADERS = [
-    "Дата и время",
-    "Telegram ID",
-    "ФИО",
-    "Модуль",
-    "Тип обращения",
-    "Категория ошибки",
-    "Описание",
-]
+# Закрытые месяцы переезжают из журнала в архив
+archive = TicketArchive(ARCHIVE_DIR)
+blobs = BlobStore(ATTACHMENTS_DIR, PREVIEW_SIZE, PREVIEW_WORKERS)
+trend_reports = TrendReports(REPORTS_DIR)
 
+# Похожие ошибки, присланные подряд, склеиваются в инциденты
+incidents = (
+    IncidentDetector(DUPLICATE_THRESHOLD, timedelta(minutes=DUPLICATE_WINDOW_MINUTES))
+    if DUPLICATE_WINDOW_MINUTES else None
+)
 
-def _ensure_excel():
-    _ensure_data_dir()
-    if not os.path.exists(EXCEL_FILE):
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Обращения"
-        ws.append(EXCEL_HEADERS)
-        widths = [20, 14, 25, 22, 20, 30, 60]
-        for i, w in enumerate(widths, 1):
-            ws.column_dimensions[chr(64 + i)].width = w
-        wb.save(EXCEL_FILE)
+# Все записи на диск идут через одного фонового писателя
+writer = StorageWriter(tickets, incidents=incidents)
 
 
-def _append_to_excel(row: list):
-    _ensure_excel()
-    wb = load_workbook(EXCEL_FILE)
-    ws = wb.active
-    ws.append(row)
-    wb.save(EXCEL_FILE)
+# Новые обращения ждут очередной сводки для администраторов
+digest = AdminDigest(PRIORITY_COOLDOWN)
 
 
-# ── Клавиатуры ─────────────────────────────────────────────────────────
+async def _save_ticket(
+    context: ContextTypes.DEFAULT_TYPE,
+    user_id: int, user: dict, kind: str, category: str, description: str,
+    attachments=(),
+) -> Receipt:
+    receipt = await writer.append_ticket({
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "user_id": user_id,
+        "fio": user["fio"],
+        "module": user["module"],
+        "kind": kind,
+        "category": category,
+        "description": description,
+        "attachments": attachments,
+    })
+    if DIGEST_INTERVAL:
+        item = DigestItem(
+            receipt.ticket_id, kind, category, user["module"], user["fio"],
+            description, receipt.reports,
+        )
+        await _queue_digest(context, item, category in _ui.priority_categories)
+    return receipt
 
-def _main_menu_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
-        [InlineKeyboardButton("🐞 Сообщить об ошибке", callback_data="report_error")],
-        [InlineKeyboardButton("💡 Предложить улучшение", callback_data="suggest")],
-    ]
-    return InlineKeyboardMarkup(buttons)
 
+# ── Клавиатуры ─────────────────────────────────────────────────────────
 
-def _modules_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
+class Ui(NamedTuple):
+    """Списки из config.py и собранные по ним клавиатуры.
+
+    Собирается один раз при старте и при перечитывании config.py;
+    хендлеры берут готовые объекты, ничего не строя заново.
+    """
+
+    modules: tuple[str, ...]
+    error_categories: tuple[str, ...]
+    admin_ids: frozenset[int]
+    priority_categories: frozenset[str]
+    modules_keyboard: InlineKeyboardMarkup
+    error_categories_keyboard: InlineKeyboardMarkup
+    users_modules_keyboard: InlineKeyboardMarkup
+
+
+def _compile_ui(modules, error_categories, admin_ids, priority_categories=()) -> Ui:
+    """Проверить списки из config.py и собрать по ним клавиатуры."""
+    modules = tuple(modules)
+    error_categories = tuple(error_categories)
+    if not modules or not error_categories:
+        raise ValueError("MODULES и ERROR_CATEGORIES не должны быть пустыми")
+    for prefix, items in (("module:", modules), ("errcat:", error_categories)):
+        for item in items:
+            if not isinstance(item, str) or len((prefix + item).encode()) > 64:
+                raise ValueError(f"Слишком длинное или некорректное название: {item!r}")
+
+    modules_keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton(
             f"{MODULE_EMOJI.get(m, '📁')} {m}",
             callback_data=f"module:{m}",
         )]
-        for m in MODULES
-    ]
-    return InlineKeyboardMarkup(buttons)
+        for m in modules
+    ])
+    error_categories_keyboard = InlineKeyboardMarkup([
+        *(
+            [InlineKeyboardButton(
+                f"{ERROR_EMOJI.get(c, '❓')} {c}",
+                callback_data=f"errcat:{c}",
+            )]
+            for c in error_categories
+        ),
+        [InlineKeyboardButton("« Назад", callback_data="back_menu")],
+    ])
+    users_modules_keyboard = InlineKeyboardMarkup([
+        *(
+            [InlineKeyboardButton(
+                f"{MODULE_EMOJI.get(m, '📁')} {m}",
+                callback_data=f"admin:users:m{i}",
+            )]
+            for i, m in enumerate(modules)
+        ),
+        [InlineKeyboardButton("« К списку", callback_data="admin:users")],
+    ])
+    return Ui(
+        modules=modules,
+        error_categories=error_categories,
+        admin_ids=frozenset(admin_ids),
+        priority_categories=frozenset(priority_categories),
+        modules_keyboard=modules_keyboard,
+        error_categories_keyboard=error_categories_keyboard,
+        users_modules_keyboard=users_modules_keyboard,
+    )
 
 
-def _error_categories_keyboard() -> InlineKeyboardMarkup:
-    buttons = [
-        [InlineKeyboardButton(
-            f"{ERROR_EMOJI.get(c, '❓')} {c}",
-            callback_data=f"errcat:{c}",
-        )]
-        for c in ERROR_CATEGORIES
-    ]
-    buttons.append(
-        [InlineKeyboardButton("« Назад", callback_data="back_menu")]
-    )
-    return InlineKeyboardMarkup(buttons)
+# Текущая сборка; заменяется целиком при перечитывании config.py
+_ui = _compile_ui(MODULES, ERROR_CATEGORIES, ADMIN_IDS, PRIORITY_CATEGORIES)
 
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🐞 Сообщить об ошибке", callback_data="report_error")],
+    [InlineKeyboardButton("💡 Предложить улучшение", callback_data="suggest")],
+])
 
-def _cancel_keyboard() -> InlineKeyboardMarkup:
-    """Кнопка отмены на этапах ввода текста."""
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("✕ Отмена", callback_data="back_menu")]]
-    )
+# Кнопка отмены на этапах ввода текста
+CANCEL_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("✕ Отмена", callback_data="back_menu")]]
+)
 
+BACK_TO_MENU_KEYBOARD = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("« В главное меню", callback_data="back_menu")]]
+)
+
+ADMIN_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📥 Выгрузить Excel", callback_data="admin:export")],
+    [InlineKeyboardButton("📊 Статистика", callback_data="admin:stats")],
+    [InlineKeyboardButton("📈 Динамика за неделю и месяц", callback_data="admin:trends:week")],
+    [InlineKeyboardButton("🧩 Инциденты", callback_data="admin:incidents")],
+    [InlineKeyboardButton("👥 Список пользователей", callback_data="admin:users")],
+    [InlineKeyboardButton("⏱ Производительность", callback_data="admin:perf")],
+    [InlineKeyboardButton("🔬 Профиль за 30 с", callback_data="admin:profile:30")],
+    [InlineKeyboardButton("🐢 Зависания", callback_data="admin:stalls")],
+    [InlineKeyboardButton("🚦 Ограничение частоты", callback_data="admin:limits")],
+])
+
+MAIN_MENU_TEXT = (
+    "Здравствуйте, <b>{fio}</b>!\n"
+    "{emoji} Модуль: {module}\n\n"
+    "Выберите действие:"
+)
 
-def _back_to_menu_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [[InlineKeyboardButton("« В главное меню", callback_data="back_menu")]]
+
+def _main_menu_text(user: dict) -> str:
+    return MAIN_MENU_TEXT.format(
+        fio=user["fio"],
+        emoji=MODULE_EMOJI.get(user["module"], "📁"),
+        module=user["module"],
     )
 
 
@@ -222,7 +348,7 @@ async def reg_fio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(
         f"Отлично, <b>{fio}</b>!\n\n"
         "Выберите модуль 1С CRM, с которым вы работаете:",
-        reply_markup=_modules_keyboard(),
+        reply_markup=_ui.modules_keyboard,
         parse_mode="HTML",
     )
     return REG_MODULE
@@ -237,9 +363,7 @@ async def reg_module(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     fio = context.user_data.pop("reg_fio")
     user_id = update.effective_user.id
 
-    _save_user(user_id, fio, module)
-
-    user = _get_user(user_id)
+    user = await writer.call(users.set, user_id, fio, module, operation="save_user")
     return await _show_main_menu_from_callback(query, context, user)
 
 
@@ -249,12 +373,9 @@ async def _show_main_menu(
     user: dict,
 ) -> int:
     """Главное меню (из обычного сообщения)."""
-    emoji = MODULE_EMOJI.get(user["module"], "📁")
     await update.message.reply_text(
-        f"Здравствуйте, <b>{user['fio']}</b>!\n"
-        f"{emoji} Модуль: {user['module']}\n\n"
-        "Выберите действие:",
-        reply_markup=_main_menu_keyboard(),
+        _main_menu_text(user),
+        reply_markup=MAIN_MENU_KEYBOARD,
         parse_mode="HTML",
     )
     return MAIN_MENU
@@ -262,12 +383,9 @@ async def _show_main_menu(
 
 async def _show_main_menu_from_callback(query, context, user: dict) -> int:
     """Главное меню (из callback-кнопки)."""
-    emoji = MODULE_EMOJI.get(user["module"], "📁")
     await query.edit_message_text(
-        f"Здравствуйте, <b>{user['fio']}</b>!\n"
-        f"{emoji} Модуль: {user['module']}\n\n"
-        "Выберите действие:",
-        reply_markup=_main_menu_keyboard(),
+        _main_menu_text(user),
+        reply_markup=MAIN_MENU_KEYBOARD,
         parse_mode="HTML",
     )
     return MAIN_MENU
@@ -282,7 +400,7 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         await query.edit_message_text(
             "🐞 <b>Сообщить об ошибке</b>\n\n"
             "Выберите категорию проблемы:",
-            reply_markup=_error_categories_keyboard(),
+            reply_markup=_ui.error_categories_keyboard,
             parse_mode="HTML",
         )
         return ERROR_CATEGORY
@@ -292,7 +410,7 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             "💡 <b>Предложить улучшение</b>\n\n"
             "Опишите, что можно улучшить в системе.\n"
             "Любая деталь может быть полезной.",
-            reply_markup=_cancel_keyboard(),
+            reply_markup=CANCEL_KEYBOARD,
             parse_mode="HTML",
         )
         return SUGGESTION_TEXT
@@ -313,6 +431,7 @@ async def error_category_handler(
 
     category = query.data.removeprefix("errcat:")
     context.user_data["error_category"] = category
+    context.user_data.pop("attachments", None)
 
     cat_emoji = ERROR_EMOJI.get(category, "🔧")
 
@@ -322,7 +441,7 @@ async def error_category_handler(
             "Расскажите подробнее, с какой проблемой вы столкнулись.\n"
             "Опишите шаги, которые привели к ошибке — "
             "это поможет нам разобраться быстрее.",
-            reply_markup=_cancel_keyboard(),
+            reply_markup=CANCEL_KEYBOARD,
             parse_mode="HTML",
         )
         return ERROR_DESCRIPTION
@@ -332,8 +451,8 @@ async def error_category_handler(
         "Опишите проблему:\n"
         "• Что произошло?\n"
         "• При каких действиях?\n"
-        "• Есть ли скриншот?",
-        reply_markup=_cancel_keyboard(),
+        "• Есть ли скриншот? Пришлите его сюда же.",
+        reply_markup=CANCEL_KEYBOARD,
         parse_mode="HTML",
     )
     return ERROR_DESCRIPTION
@@ -343,27 +462,129 @@ async def error_description_handler(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> int:
     """Получаем описание ошибки, сохраняем в Excel."""
+    return await _save_error(update, context, update.message.text.strip())
+
+
+# Скриншоты и файлы: фото (Telegram сжимает) или документ (как есть)
+ATTACHMENT_FILTER = filters.PHOTO | filters.Document.ALL
+
+
+async def _store_attachment(context: ContextTypes.DEFAULT_TYPE, message) -> tuple[str, str] | None:
+    """Сохранить фото или документ из сообщения; (sha256, имя файла) или None, если велик.
+
+    Файл, который уже скачивался (тот же file_unique_id), заново
+    не скачивается.
+    """
+    if message.photo:
+        media = message.photo[-1]  # самый крупный из размеров
+        file_name, mime = f"screenshot_{message.message_id}.jpg", "image/jpeg"
+    else:
+        media = message.document
+        file_name = media.file_name or f"file_{message.message_id}"
+        mime = media.mime_type or "application/octet-stream"
+    if media.file_size and media.file_size > ATTACHMENT_MAX_SIZE:
+        return None
+
+    sha256 = tickets.blob_for_source(media.file_unique_id)
+    if sha256 is None or not blobs.exists(sha256):
+        tg_file = await context.bot.get_file(media.file_id)
+        sha256, size = await blobs.download(tg_file.file_path)
+        preview = mime.startswith("image/") and await blobs.make_preview(sha256)
+        await writer.call(
+            tickets.add_blob, sha256, size, mime, preview, media.file_unique_id,
+            operation="save_blob",
+        )
+    return sha256, file_name
+
+
+async def error_attachment_handler(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> int:
+    """Скриншот или файл к описанию ошибки.
+
+    С подписью — подпись и есть описание, обращение сохраняется сразу.
+    Без подписи — файл ждёт текста; альбом из нескольких файлов
+    получает одно подтверждение.
+    """
+    message = update.message
+    attachment = await _store_attachment(context, message)
+    if attachment is None:
+        await message.reply_text(
+            "Файл больше 20 МБ — такой бот принять не может. "
+            "Пришлите скриншот или файл поменьше.",
+            reply_markup=CANCEL_KEYBOARD,
+        )
+        return ERROR_DESCRIPTION
+
+    pending = context.user_data.setdefault("attachments", [])
+    pending.append(list(attachment))
+    if message.caption:
+        return await _save_error(update, context, message.caption.strip())
+
+    group = message.media_group_id
+    if group is None or group != context.user_data.get("media_group"):
+        context.user_data["media_group"] = group
+        await message.reply_text(
+            "📎 Файл прикреплён. Теперь опишите проблему текстом "
+            "или пришлите ещё скриншоты.",
+            reply_markup=CANCEL_KEYBOARD,
+        )
+    return ERROR_DESCRIPTION
+
+
+async def album_tail_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Остальные файлы альбома, пришедшие после сохранения обращения.
+
+    Подпись у альбома только на первом файле: он сохраняет обращение,
+    а следующие файлы того же альбома приходят уже в главном меню и
+    прикладываются к этому обращению.
+    """
+    message = update.message
+    album = context.user_data.get("album")
+    if not album or message.media_group_id != album[0]:
+        return None
+    attachment = await _store_attachment(context, message)
+    if attachment is not None:
+        await writer.call(
+            tickets.attach_files, [(album[1], *attachment)], operation="attach_files",
+        )
+    return None
+
+
+async def _save_error(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, description: str
+) -> int:
     user_id = update.effective_user.id
     user = _get_user(user_id)
     category = context.user_data.pop("error_category", "—")
-    description = update.message.text.strip()
-
-    _append_to_excel([
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        user_id,
-        user["fio"],
-        user["module"],
-        "Ошибка",
-        category,
-        description,
-    ])
+    attachments = [tuple(a) for a in context.user_data.pop("attachments", [])]
+    context.user_data.pop("media_group", None)
 
+    receipt = await _save_ticket(
+        context, user_id, user, "Ошибка", category, description, attachments,
+    )
+    if update.message.media_group_id:
+        context.user_data["album"] = [update.message.media_group_id, receipt.ticket_id]
+    else:
+        context.user_data.pop("album", None)
+
+    if receipt.reports > 1:
+        text = (
+            "✅ <b>Принято в работу!</b>\n\n"
+            "Похоже, об этой проблеме уже сообщили коллеги — ваше сообщение "
+            f"добавлено к обращению #{receipt.ticket_id} "
+            f"(сообщений о ней: {receipt.reports}). Мы уже разбираемся."
+        )
+    else:
+        text = (
+            "✅ <b>Принято в работу!</b>\n\n"
+            "Спасибо, что сообщили — мы разберёмся "
+            "и постараемся исправить."
+        )
+    if attachments:
+        text += f"\n\n📎 Приложено файлов: {len(attachments)}"
     await update.message.reply_text(
-        "✅ <b>Принято в работу!</b>\n\n"
-        "Спасибо, что сообщили — мы разберёмся "
-        "и постараемся исправить.",
-        reply_markup=_back_to_menu_keyboard(),
-        parse_mode="HTML",
+        text, reply_markup=BACK_TO_MENU_KEYBOARD, parse_mode="HTML",
     )
     return MAIN_MENU
 
@@ -376,20 +597,12 @@ async def suggestion_text_handler(
     user = _get_user(user_id)
     description = update.message.text.strip()
 
-    _append_to_excel([
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        user_id,
-        user["fio"],
-        user["module"],
-        "Предложение",
-        "—",
-        description,
-    ])
+    await _save_ticket(context, user_id, user, "Предложение", "—", description)
 
     await update.message.reply_text(
         "✅ <b>Предложение принято!</b>\n\n"
         "Спасибо за идею — мы обязательно рассмотрим.",
-        reply_markup=_back_to_menu_keyboard(),
+        reply_markup=BACK_TO_MENU_KEYBOARD,
         parse_mode="HTML",
     )
     return MAIN_MENU
@@ -399,6 +612,7 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     """Возврат в главное меню из callback."""
     query = update.callback_query
     await query.answer()
+    context.user_data.pop("attachments", None)
     user = _get_user(update.effective_user.id)
     if user:
         return await _show_main_menu_from_callback(query, context, user)
@@ -411,78 +625,1094 @@ async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 async def cmd_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать админ-панель."""
     user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
+    if user_id not in _ui.admin_ids:
         await update.message.reply_text("У вас нет доступа к этой команде.")
         return
 
-    buttons = [
-        [InlineKeyboardButton("📥 Выгрузить Excel", callback_data="admin:export")],
-        [InlineKeyboardButton("📊 Статистика", callback_data="admin:stats")],
-        [InlineKeyboardButton("👥 Список пользователей", callback_data="admin:users")],
-    ]
     await update.message.reply_text(
-        "⚙️ <b>Панель администратора</b>",
-        reply_markup=InlineKeyboardMarkup(buttons),
+        "⚙️ <b>Панель администратора</b>\n\n"
+        "Поиск обращений по описанию: /find телефония звонок не проходит",
+        reply_markup=ADMIN_KEYBOARD,
         parse_mode="HTML",
     )
 
 
+EXPORT_ALL_FILE = str(Path(EXCEL_FILE).with_name("crm_support_all.xlsx"))
+
+
+def _export_keyboard() -> InlineKeyboardMarkup:
+    """Выбор периода выгрузки: журнал, всё целиком или закрытый месяц."""
+    buttons = [
+        [InlineKeyboardButton("📥 Текущие месяцы", callback_data="admin:export:hot")],
+        [InlineKeyboardButton("📚 Весь период", callback_data="admin:export:all")],
+        [InlineKeyboardButton("🔎 С фильтром", callback_data="admin:xf")],
+    ]
+    months = [
+        InlineKeyboardButton(f"🗄 {s['period']}", callback_data=f"admin:export:{s['period']}")
+        for s in reversed(archive.segments()[-12:])
+    ]
+    buttons += [months[i:i + 3] for i in range(0, len(months), 3)]
+    return InlineKeyboardMarkup(buttons)
+
+
+# ── Выгрузка с фильтром ────────────────────────────────────────────────
+
+# Готовые периоды: метка -> (подпись, функция today -> (since, until))
+EXPORT_RANGES = {
+    "7d": ("7 дней", lambda d: (d - timedelta(days=6), d + timedelta(days=1))),
+    "30d": ("30 дней", lambda d: (d - timedelta(days=29), d + timedelta(days=1))),
+    "month": ("Этот месяц", lambda d: (d.replace(day=1), d + timedelta(days=1))),
+    "prev": ("Прошлый месяц", lambda d: (
+        (d.replace(day=1) - timedelta(days=1)).replace(day=1), d.replace(day=1),
+    )),
+}
+
+EXPORT_KINDS = {"e": "Ошибка", "s": "Предложение"}
+
+
+def _export_filter(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """Фильтр выгрузки администратора: since/until ("ГГГГ-ММ-ДД",
+    until не включается), range — метка готового периода, и значения
+    полей из EXPORT_FILTERS (нет ключа — все)."""
+    f = context.user_data.get("export_filter")
+    if f is None:
+        f = context.user_data["export_filter"] = {}
+        _set_export_range(f, "7d")
+    return f
+
+
+def _set_export_range(f: dict, label: str):
+    since, until = EXPORT_RANGES[label][1](datetime.now().date())
+    f.update(range=label, since=since.isoformat(), until=until.isoformat())
+
+
+def _export_filter_view(f: dict) -> tuple[str, InlineKeyboardMarkup]:
+    last_day = datetime.strptime(f["until"], "%Y-%m-%d") - timedelta(days=1)
+    since = datetime.strptime(f["since"], "%Y-%m-%d")
+    text = (
+        "🔎 <b>Выгрузка с фильтром</b>\n\n"
+        f"Период: {since:%d.%m.%Y} – {last_day:%d.%m.%Y}\n"
+        f"Модуль: {html.escape(f.get('module', 'все'))}\n"
+        f"Категория: {html.escape(f.get('category', 'все'))}\n"
+        f"Тип: {html.escape(f.get('kind', 'все'))}\n\n"
+        "Другой период: /export ГГГГ-ММ-ДД ГГГГ-ММ-ДД"
+    )
+
+    def mark(selected: bool, label: str) -> str:
+        return f"• {label}" if selected else label
+
+    kind = f.get("kind")
+    rows = [
+        [
+            InlineKeyboardButton(mark(f["range"] == key, label), callback_data=f"admin:xf:r:{key}")
+            for key, (label, _) in list(EXPORT_RANGES.items())[:2]
+        ],
+        [
+            InlineKeyboardButton(mark(f["range"] == key, label), callback_data=f"admin:xf:r:{key}")
+            for key, (label, _) in list(EXPORT_RANGES.items())[2:]
+        ],
+        [InlineKeyboardButton(f"Модуль: {f.get('module', 'все')}", callback_data="admin:xf:mods")],
+        [InlineKeyboardButton(f"Категория: {f.get('category', 'все')}", callback_data="admin:xf:cats")],
+        [
+            InlineKeyboardButton(mark(kind is None, "Все типы"), callback_data="admin:xf:k:-"),
+            *(
+                InlineKeyboardButton(mark(kind == value, value), callback_data=f"admin:xf:k:{key}")
+                for key, value in EXPORT_KINDS.items()
+            ),
+        ],
+        [InlineKeyboardButton("📥 Выгрузить", callback_data="admin:xf:go")],
+        [InlineKeyboardButton("« Назад", callback_data="admin:export")],
+    ]
+    return text, InlineKeyboardMarkup(rows)
+
+
+def _export_choice_keyboard(field: str, values) -> InlineKeyboardMarkup:
+    """Выбор одного значения поля: m — модуль, c — категория (по номеру в списке)."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Все", callback_data=f"admin:xf:{field}:-")],
+        *(
+            [InlineKeyboardButton(value, callback_data=f"admin:xf:{field}:{i}")]
+            for i, value in enumerate(values)
+        ),
+        [InlineKeyboardButton("« К фильтру", callback_data="admin:xf")],
+    ])
+
+
+def _write_filtered_export(f: dict, path: str) -> int:
+    """Записать в Excel обращения архива и журнала под фильтр; вернуть их число."""
+    filters = {field: f[field] for field in EXPORT_FILTERS if field in f}
+    count = 0
+
+    def records():
+        nonlocal count
+        for record in itertools.chain(
+            archive.iter_filtered(f["since"], f["until"], filters),
+            tickets.iter_filtered(f["since"], f["until"], filters),
+        ):
+            count += 1
+            yield record
+
+    write_excel(records(), path, tickets)
+    return count
+
+
+async def _export_filter_action(query, context: ContextTypes.DEFAULT_TYPE, action: str):
+    """Кнопки выгрузки с фильтром: admin:xf[:что:значение]."""
+    f = _export_filter(context)
+    parts = action.split(":")[1:]
+    what, value = (parts + ["", ""])[:2]
+
+    if what == "mods":
+        await query.edit_message_text(
+            "Модуль для выгрузки:", reply_markup=_export_choice_keyboard("m", _ui.modules),
+        )
+        return
+    if what == "cats":
+        await query.edit_message_text(
+            "Категория ошибки для выгрузки:",
+            reply_markup=_export_choice_keyboard("c", _ui.error_categories),
+        )
+        return
+    if what == "go":
+        await _send_filtered_export(query, f)
+        return
+
+    if what == "r" and value in EXPORT_RANGES:
+        _set_export_range(f, value)
+    elif what in ("m", "c"):
+        field, values = ("module", _ui.modules) if what == "m" else ("category", _ui.error_categories)
+        if value.isdigit() and int(value) < len(values):
+            f[field] = values[int(value)]
+        else:
+            f.pop(field, None)
+    elif what == "k":
+        if value in EXPORT_KINDS:
+            f["kind"] = EXPORT_KINDS[value]
+        else:
+            f.pop("kind", None)
+    text, markup = _export_filter_view(f)
+    await query.edit_message_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+async def _send_filtered_export(query, f: dict):
+    fd, path = tempfile.mkstemp(dir=Path(EXCEL_FILE).parent, prefix=".export_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        count = await asyncio.to_thread(_write_filtered_export, f, path)
+        if not count:
+            await query.message.reply_text("Под фильтр не попало ни одного обращения.")
+            return
+        parts = [f"{f['since']} – {f['until']} (не включая)"]
+        parts += [f[field] for field in EXPORT_FILTERS if field in f]
+        await _send_excel(
+            query, path, f"crm_support_{f['since']}_{f['until']}.xlsx",
+            f"Обращений: {count} · " + " · ".join(parts),
+        )
+    finally:
+        os.unlink(path)
+
+
+async def cmd_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка за произвольный период: /export 2026-10-01 2026-10-07."""
+    if update.effective_user.id not in _ui.admin_ids:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+    try:
+        since, last = (datetime.strptime(a, "%Y-%m-%d").date() for a in context.args)
+    except ValueError:
+        await update.message.reply_text(
+            "Укажите первый и последний день: /export 2026-10-01 2026-10-07"
+        )
+        return
+    if last < since:
+        since, last = last, since
+    f = _export_filter(context)
+    f.update(range="custom", since=since.isoformat(), until=(last + timedelta(days=1)).isoformat())
+    text, markup = _export_filter_view(f)
+    await update.message.reply_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+async def _send_excel(query, path, filename: str, caption: str):
+    with open(path, "rb") as f:
+        await query.message.reply_document(document=f, filename=filename, caption=caption)
+
+
+def _stats_text() -> str:
+    """Текст экрана статистики — только чтение готовых счётчиков."""
+    by_kind = tickets.counters("kind")
+    by_category = tickets.counters("category")
+    by_module = tickets.counters("module")
+    week_ago = (datetime.now() - timedelta(days=6)).strftime("%Y-%m-%d")
+    by_day = tickets.counters("day", since=week_ago)
+
+    lines = [
+        "📊 <b>Статистика</b>\n",
+        f"Всего обращений: <b>{tickets.count()}</b>",
+        f"Ошибок: <b>{by_kind.get('Ошибка', 0)}</b>",
+        f"Предложений: <b>{by_kind.get('Предложение', 0)}</b>",
+        f"Повторных сообщений (в инцидентах): <b>{tickets.duplicates()}</b>",
+        f"Пользователей: <b>{len(users)}</b>",
+        "\n<b>Ошибки по категориям:</b>",
+    ]
+    for c in _ui.error_categories:
+        lines.append(f"{ERROR_EMOJI.get(c, '❓')} {c}: {by_category.get(c, 0)}")
+    lines.append("\n<b>Обращения по модулям:</b>")
+    for m in _ui.modules:
+        lines.append(f"{MODULE_EMOJI.get(m, '📁')} {m}: {by_module.get(m, 0)}")
+    lines.append("\n<b>За последние 7 дней:</b>")
+    for day, n in by_day.items():
+        lines.append(f"{day}: {n}")
+    if not by_day:
+        lines.append("обращений не было")
+    return "\n".join(lines)
+
+
+def _incidents_text() -> str:
+    """Самые массовые инциденты за последнюю неделю."""
+    week_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+    lines = ["🧩 <b>Инциденты за 7 дней</b>"]
+    for inc in tickets.incidents(since=week_ago, limit=10):
+        description = inc.description if len(inc.description) <= 150 else inc.description[:150] + "…"
+        lines.append(
+            f"\n<b>#{inc.ticket_id}</b> {MODULE_EMOJI.get(inc.module, '📁')} "
+            f"{html.escape(inc.module)} · {ERROR_EMOJI.get(inc.category, '❓')} "
+            f"{html.escape(inc.category)}\n"
+            f"Сообщений: <b>{inc.reports}</b> от {inc.reporters} сотрудников, "
+            f"{inc.created_at[5:16]} – {inc.last_at[5:16]}\n"
+            f"{html.escape(description)}"
+        )
+    if len(lines) == 1:
+        lines.append("\nПовторных сообщений не было.")
+    return "\n".join(lines)
+
+
+def _limits_text() -> str:
+    """Счётчики ограничителей частоты с момента запуска."""
+    lines = ["🚦 <b>Ограничение частоты</b>", "\n<b>Входящие</b>"]
+    if flood_control is None:
+        lines.append("выключено")
+    else:
+        lines += [
+            f"Пропущено: {flood_control.allowed}",
+            f"Отброшено: {flood_control.dropped}",
+            f"Склеено повторных нажатий: {flood_control.coalesced}",
+            f"Сотрудников под наблюдением: {flood_control.tracked()}",
+        ]
+        top = flood_control.dropped_by_user.most_common(5)
+        if top:
+            lines.append("Чаще всего упирались в лимит:")
+            for uid, n in top:
+                user = users.get(uid)
+                name = html.escape(user["fio"]) if user else f"ID {uid}"
+                lines.append(f"  {name} (<code>{uid}</code>): {n}")
+    lines.append("\n<b>Исходящие в Telegram</b>")
+    if api_limiter is None:
+        lines.append("выключено")
+    else:
+        avg = api_limiter.waited / api_limiter.delayed if api_limiter.delayed else 0
+        lines += [
+            f"Запросов: {api_limiter.requests}",
+            f"Пришлось ждать: {api_limiter.delayed} "
+            f"(в среднем {avg * 1000:.0f} мс, максимум {api_limiter.max_wait * 1000:.0f} мс)",
+            f"Ответов 429 от Telegram: {api_limiter.retry_after}",
+        ]
+    return "\n".join(lines)
+
+
+USERS_PAGE_SIZE = 20
+
+
+def _users_page(
+    view: str, direction: str, cursor: str, context: ContextTypes.DEFAULT_TYPE
+) -> tuple[str, InlineKeyboardMarkup]:
+    """Страница списка пользователей с кнопками листания.
+
+    view: "fio" — все по ФИО, "mod" — все по модулю, "m<N>" — только
+    модуль MODULES[N], "q" — поиск по началу ФИО из /users.
+    """
+    query_text = context.user_data.get("users_query", "") if view == "q" else ""
+    module = None
+    modules = _ui.modules
+    if view.startswith("m") and view[1:].isdigit() and int(view[1:]) < len(modules):
+        module = modules[int(view[1:])]
+    page = users.page(
+        "module" if view == "mod" else "fio",
+        module=module,
+        prefix=query_text or None,
+        after=cursor if direction == "n" else None,
+        before=cursor if direction == "p" else None,
+        limit=USERS_PAGE_SIZE,
+    )
+
+    if module is not None:
+        title = f"👥 <b>Пользователи: {MODULE_EMOJI.get(module, '📁')} {module}</b>"
+    elif query_text:
+        title = f"👥 <b>Поиск: «{html.escape(query_text)}»</b>"
+    else:
+        title = "👥 <b>Пользователи</b>"
+
+    if not page.items:
+        text = f"{title}\n\nНикого не найдено."
+    else:
+        lines = [
+            f"{html.escape(info['fio'])} — {MODULE_EMOJI.get(info['module'], '📁')} "
+            f"{info['module']} (ID: <code>{uid}</code>)"
+            for uid, info in page.items
+        ]
+        text = f"{title}\n\n" + "\n".join(lines)
+
+    nav = []
+    if page.has_prev:
+        nav.append(InlineKeyboardButton(
+            "« Назад", callback_data=f"admin:users:{view}:p:{page.items[0][0]}",
+        ))
+    if page.has_next:
+        nav.append(InlineKeyboardButton(
+            "Вперёд »", callback_data=f"admin:users:{view}:n:{page.items[-1][0]}",
+        ))
+    buttons = [nav] if nav else []
+    buttons.append([
+        InlineKeyboardButton("🔤 По ФИО", callback_data="admin:users:fio"),
+        InlineKeyboardButton("📁 По модулю", callback_data="admin:users:mod"),
+        InlineKeyboardButton("🔎 Модуль…", callback_data="admin:users_modules"),
+    ])
+    return text, InlineKeyboardMarkup(buttons)
+
+
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка админских кнопок."""
     query = update.callback_query
     await query.answer()
 
     user_id = update.effective_user.id
-    if user_id not in ADMIN_IDS:
+    if user_id not in _ui.admin_ids:
         await query.edit_message_text("У вас нет доступа.")
         return
 
     action = query.data.removeprefix("admin:")
 
     if action == "export":
-        _ensure_excel()
-        if os.path.exists(EXCEL_FILE):
-            await query.message.reply_document(
-                document=open(EXCEL_FILE, "rb"),
-                filename=f"crm_support_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                caption="Выгрузка обращений",
+        await query.edit_message_text(
+            "📥 <b>Выгрузка обращений</b>\n\n"
+            "Текущие месяцы лежат в рабочем журнале, закрытые — в архиве.",
+            reply_markup=_export_keyboard(),
+            parse_mode="HTML",
+        )
+
+    elif action == "xf" or action.startswith("xf:"):
+        await _export_filter_action(query, context, action)
+
+    elif action.startswith("export:"):
+        period = action.removeprefix("export:")
+        stamp = datetime.now().strftime("%Y%m%d_%H%M")
+        if period == "hot":
+            path = await asyncio.to_thread(export_excel, tickets, EXCEL_FILE)
+            await _send_excel(query, path, f"crm_support_{stamp}.xlsx", "Обращения за текущие месяцы")
+        elif period == "all":
+            path = await asyncio.to_thread(
+                export_excel, tickets, EXPORT_ALL_FILE,
+                lambda: itertools.chain(archive.iter_records(), tickets.iter_records()),
             )
-        else:
-            await query.edit_message_text("Файл обращений пока пуст.")
-
-    elif action == "stats":
-        _ensure_excel()
-        if os.path.exists(EXCEL_FILE):
-            wb = load_workbook(EXCEL_FILE)
-            ws = wb.active
-            total = ws.max_row - 1
-            errors = sum(1 for row in ws.iter_rows(min_row=2) if row[4].value == "Ошибка")
-            suggestions = sum(1 for row in ws.iter_rows(min_row=2) if row[4].value == "Предложение")
-            users = _load_users()
-            text = (
-                "📊 <b>Статистика</b>\n\n"
-                f"Всего обращений: <b>{total}</b>\n"
-                f"Ошибок: <b>{errors}</b>\n"
-                f"Предложений: <b>{suggestions}</b>\n"
-                f"Пользователей: <b>{len(users)}</b>"
+            await _send_excel(query, path, f"crm_support_all_{stamp}.xlsx", "Все обращения")
+        elif archive.segment(period):
+            await _send_excel(
+                query, archive.xlsx_path(period), f"crm_support_{period}.xlsx",
+                f"Обращения за {period} (архив)",
             )
         else:
-            text = "Данных пока нет."
-        await query.edit_message_text(text, parse_mode="HTML")
+            await query.edit_message_text("За этот месяц данных нет.")
+
+    elif action in ("stats", "stats_rebuild"):
+        if action == "stats_rebuild":
+            await writer.rebuild_counters()
+        text = await asyncio.to_thread(_stats_text)
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "🔄 Пересчитать", callback_data="admin:stats_rebuild",
+            )]]),
+            parse_mode="HTML",
+        )
 
-    elif action == "users":
-        users = _load_users()
-        if not users:
-            await query.edit_message_text("Зарегистрированных пользователей нет.")
+    elif action.startswith("trends:") or action.startswith("trends_xlsx:"):
+        kind = action.split(":")[1]
+        if kind not in ("week", "month"):
+            return
+        report = trend_reports.latest(kind)
+        if report is None:
+            await update_trend_reports(context)
+            report = trend_reports.latest(kind)
+        other = "month" if kind == "week" else "week"
+        switch = [InlineKeyboardButton(
+            "За месяц" if other == "month" else "За неделю",
+            callback_data=f"admin:trends:{other}",
+        )]
+        if report is None:
+            # Журнал пуст или закрытой недели (месяца) с начала сводок ещё не было
+            await query.edit_message_text(
+                "📈 За прошедшую неделю данных ещё нет." if kind == "week"
+                else "📈 За прошедший месяц данных ещё нет.",
+                reply_markup=InlineKeyboardMarkup([switch]),
+            )
+            return
+        text, xlsx_path = report
+        if action.startswith("trends_xlsx:"):
+            await _send_excel(query, xlsx_path, xlsx_path.name, "Отчёт о динамике")
             return
-        lines = []
-        for uid, info in users.items():
-            m_emoji = MODULE_EMOJI.get(info["module"], "📁")
-            lines.append(f"{info['fio']} — {m_emoji} {info['module']} (ID: <code>{uid}</code>)")
-        text = "👥 <b>Пользователи</b>\n\n" + "\n".join(lines)
-        if len(text) > 4000:
-            text = text[:4000] + "\n\n... (список обрезан)"
-        await query.edit_message_text(text, parse_mode="HTML")
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📥 Excel", callback_data=f"admin:trends_xlsx:{kind}")],
+                switch,
+            ]),
+            parse_mode="HTML",
+        )
+
+    elif action == "incidents":
+        text = await asyncio.to_thread(_incidents_text)
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "🔄 Обновить", callback_data="admin:incidents",
+            )]]),
+            parse_mode="HTML",
+        )
+
+    elif action == "limits":
+        await query.edit_message_text(
+            _limits_text(),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "🔄 Обновить", callback_data="admin:limits",
+            )]]),
+            parse_mode="HTML",
+        )
+
+    elif action == "perf":
+        await query.edit_message_text(
+            metrics.summary_text(),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                "🔄 Обновить", callback_data="admin:perf",
+            )]]),
+            parse_mode="HTML",
+        )
+
+    elif action == "stalls":
+        if loop_watchdog is None:
+            await query.edit_message_text("Сторож event loop выключен (STALL_THRESHOLD = 0).")
+            return
+        await query.edit_message_text(
+            stalls.summary_text(loop_watchdog),
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📄 Стеки", callback_data="admin:stalls_file")],
+                [InlineKeyboardButton("🔄 Обновить", callback_data="admin:stalls")],
+            ]),
+            parse_mode="HTML",
+        )
+
+    elif action == "stalls_file":
+        if loop_watchdog is None or not loop_watchdog.stalls:
+            await query.message.reply_text("Зависаний пока не было.")
+            return
+        await query.message.reply_document(
+            document=stalls.stacks_text(loop_watchdog).encode(),
+            filename=f"stalls_{WORKER}_{datetime.now():%Y%m%d_%H%M}.txt",
+        )
+
+    elif action.startswith("profile:"):
+        seconds = action.removeprefix("profile:")
+        if seconds.isdigit():
+            await query.message.reply_text(
+                _start_profile(context, query.message.chat_id, int(seconds)), parse_mode="HTML",
+            )
+
+    elif action == "users_modules":
+        await query.edit_message_text(
+            "👥 <b>Пользователи модуля:</b>",
+            reply_markup=_ui.users_modules_keyboard,
+            parse_mode="HTML",
+        )
+
+    elif action.startswith("find:"):
+        query_text = context.user_data.get("find_query")
+        offset = action.removeprefix("find:")
+        if not query_text or not offset.isdigit():
+            await query.edit_message_text("Повторите поиск командой /find.")
+            return
+        text, markup = await asyncio.to_thread(_find_page, query_text, int(offset))
+        await query.edit_message_text(text, reply_markup=markup, parse_mode="HTML")
+
+    elif action == "users" or action.startswith("users:"):
+        view, direction, cursor = (action.split(":")[1:] + ["fio", "", ""])[:3]
+        text, markup = _users_page(view, direction, cursor, context)
+        await query.edit_message_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+async def cmd_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск пользователей по началу ФИО: /users Иван."""
+    if update.effective_user.id not in _ui.admin_ids:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
+    context.user_data["users_query"] = " ".join(context.args)
+    view = "q" if context.args else "fio"
+    text, markup = _users_page(view, "", "", context)
+    await update.message.reply_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+FIND_PAGE_SIZE = 10
+
+
+def _find_page(query_text: str, offset: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Страница результатов /find с кнопками листания."""
+    page = tickets.search(query_text, limit=FIND_PAGE_SIZE, offset=offset)
+    title = f"🔎 <b>Поиск: «{html.escape(query_text)}»</b>"
+    if not page.hits:
+        return f"{title}\n\nНичего не найдено.", None
+
+    lines = [
+        f"<b>#{ticket_id}</b> {created_at[:16]} · {html.escape(fio)} · "
+        f"{MODULE_EMOJI.get(module, '📁')} {html.escape(module)} · {html.escape(kind)}\n"
+        f"{search.highlight(description, query_text)}"
+        for ticket_id, created_at, fio, module, kind, description in page.hits
+    ]
+    header = f"{page.offset + 1}–{page.offset + len(page.hits)} из {page.total}"
+    if page.any_term:
+        header += " (совпадают не все слова)"
+    text = f"{title}\n{header}\n\n" + "\n\n".join(lines)
+
+    nav = []
+    if page.offset > 0:
+        nav.append(InlineKeyboardButton(
+            "« Назад", callback_data=f"admin:find:{max(page.offset - FIND_PAGE_SIZE, 0)}",
+        ))
+    if page.offset + len(page.hits) < page.total:
+        nav.append(InlineKeyboardButton(
+            "Вперёд »", callback_data=f"admin:find:{page.offset + FIND_PAGE_SIZE}",
+        ))
+    return text, InlineKeyboardMarkup([nav]) if nav else None
+
+
+async def cmd_find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск обращений по описанию: /find телефония звонок не проходит."""
+    if update.effective_user.id not in _ui.admin_ids:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+    if not context.args:
+        await update.message.reply_text(
+            "Укажите, что искать: /find телефония звонок не проходит"
+        )
+        return
+
+    context.user_data["find_query"] = " ".join(context.args)
+    text, markup = await asyncio.to_thread(_find_page, context.user_data["find_query"], 0)
+    await update.message.reply_text(text, reply_markup=markup, parse_mode="HTML")
+
+
+async def cmd_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Файлы, приложенные к обращению: /files 1234."""
+    if update.effective_user.id not in _ui.admin_ids:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+    if len(context.args) != 1 or not context.args[0].lstrip("#").isdigit():
+        await update.message.reply_text("Укажите номер обращения: /files 1234")
+        return
+
+    ticket_id = int(context.args[0].lstrip("#"))
+    files = await asyncio.to_thread(tickets.attachments, ticket_id)
+    if not files:
+        await update.message.reply_text(f"К обращению #{ticket_id} файлов не приложено.")
+        return
+
+    chat_id = update.effective_chat.id
+    previews = [f for f in files if f.preview]
+    # Картинки — альбомами по 10 (больше Telegram в один альбом не берёт).
+    # Файлы читаются в отдельном потоке, чтобы не держать event loop
+    for i in range(0, len(previews), 10):
+        group = previews[i:i + 10]
+        photos = await asyncio.to_thread(
+            lambda: [blobs.preview_path(f.sha256).read_bytes() for f in group]
+        )
+        await context.bot.send_media_group(chat_id, [
+            InputMediaPhoto(photo, caption=f.file_name) for photo, f in zip(photos, group)
+        ])
+    for f in files:
+        if not f.preview:
+            document = await asyncio.to_thread(blobs.path(f.sha256).read_bytes)
+            await context.bot.send_document(chat_id, document, filename=f.file_name)
+    lines = [
+        f"{html.escape(f.file_name)} · <code>{f.sha256[:12]}</code>" for f in files
+    ]
+    await update.message.reply_text(
+        f"📎 Обращение #{ticket_id}: файлов {len(files)}, "
+        f"{sum(f.size for f in files) / 1024 / 1024:.1f} МБ. "
+        "Картинки показаны уменьшенными.\n\n" + "\n".join(lines),
+        parse_mode="HTML",
+    )
+
+
+# ── Сводки для администраторов ─────────────────────────────────────────
+
+async def send_digest(context: ContextTypes.DEFAULT_TYPE):
+    """Отправить накопившиеся обращения одной сводкой каждому администратору.
+
+    Запускается только в процессе 0 — по расписанию раз в DIGEST_INTERVAL
+    секунд и сразу после обращения приоритетной категории. Сообщений за
+    раз — не больше, чем администраторов, сколько бы обращений ни пришло
+    и сколько бы процессов их ни приняли.
+    """
+    await _collect_forwarded_digest()
+    items = digest.drain()
+    if not items:
+        return
+    text = render(items, _ui.priority_categories, MODULE_EMOJI)
+    for admin_id in _ui.admin_ids:
+        try:
+            await context.bot.send_message(admin_id, text, parse_mode="HTML")
+        except TelegramError as exc:
+            logger.warning("Сводка не доставлена администратору %s: %s", admin_id, exc)
+
+
+async def _queue_digest(context: ContextTypes.DEFAULT_TYPE, item: DigestItem, priority: bool):
+    """Поставить обращение в сводку.
+
+    Сводки отправляет только процесс 0: обработчики передают ему
+    обращения через общую очередь, иначе каждый администратор получал бы
+    по сводке от каждого процесса.
+    """
+    if inbox is not None and WORKER != 0:
+        await writer.call(
+            inbox.push, DIGEST_SHARD, json.dumps([*item, priority], ensure_ascii=False),
+            operation="forward_digest",
+        )
+    elif digest.add(item, priority=priority):
+        context.job_queue.run_once(send_digest, 0, name="admin_digest_now")
+
+
+async def _collect_forwarded_digest() -> bool:
+    """Процесс 0: забрать в сводку обращения от обработчиков; True — среди
+    них приоритетное и сводку пора отправить."""
+    if inbox is None:
+        return False
+    urgent = False
+    for payload in await asyncio.to_thread(inbox.claim, DIGEST_SHARD):
+        *fields, priority = json.loads(payload)
+        urgent |= digest.add(DigestItem(*fields), priority=priority)
+    return urgent
+
+
+async def collect_digest(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача процесса 0: обращения от обработчиков —
+    в сводку, приоритетные — сразу."""
+    if await _collect_forwarded_digest():
+        await send_digest(context)
+
+
+# ── Архивация закрытых месяцев ─────────────────────────────────────────
+
+_sealing = asyncio.Lock()
+
+
+async def seal_closed_months(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: перенести закончившиеся месяцы из журнала в архив.
+
+    Сегмент пишется в отдельном потоке (журнал при этом только читается),
+    удаление из журнала идёт через фонового писателя.
+    """
+    async with _sealing:
+        periods = await asyncio.to_thread(archive.closed_periods, tickets)
+        for period in periods:
+            entry = await asyncio.to_thread(archive.seal, tickets, period)
+            await writer.call(
+                tickets.archive_period, period, entry["last_id"],
+                operation="archive_period",
+            )
+            logger.info("Месяц %s перенесён в архив: %d обращений", period, entry["rows"])
+        if periods:
+            await writer.call(tickets.vacuum, operation="vacuum")
+
+
+async def update_trend_reports(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: досчитать дневные сводки за сегодня и собрать
+    отчёты о динамике, если закончилась неделя или месяц."""
+    await writer.call(tickets.update_rollups, operation="update_rollups")
+    built = await asyncio.to_thread(trend_reports.refresh, tickets, None, MODULE_EMOJI)
+    for key in built:
+        logger.info("Собран отчёт о динамике %s", key)
+
+
+# ── Перечитывание config.py на лету ────────────────────────────────────
+
+CONFIG_PATH = Path(__file__).with_name("config.py")
+
+_config_mtime = CONFIG_PATH.stat().st_mtime if CONFIG_PATH.exists() else 0.0
+
+
+def _reload_config() -> Ui:
+    """Перечитать MODULES, ERROR_CATEGORIES, ADMIN_IDS и PRIORITY_CATEGORIES.
+
+    Новая сборка клавиатур подменяет старую одним присваиванием;
+    если файл с ошибкой, остаётся прежняя и бросается исключение.
+    Токен, пути к файлам и режим работы меняются только перезапуском.
+    """
+    global _ui, _config_mtime
+    mtime = CONFIG_PATH.stat().st_mtime
+    values = runpy.run_path(str(CONFIG_PATH))
+    ui = _compile_ui(
+        values["MODULES"], values["ERROR_CATEGORIES"], values["ADMIN_IDS"],
+        values.get("PRIORITY_CATEGORIES", ()),
+    )
+    _ui, _config_mtime = ui, mtime
+    return ui
+
+
+async def watch_config(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: перечитать config.py, если файл изменился."""
+    try:
+        if CONFIG_PATH.stat().st_mtime == _config_mtime:
+            return
+        ui = await asyncio.to_thread(_reload_config)
+    except Exception as exc:
+        logger.warning("config.py не перечитан: %s", exc)
+        return
+    logger.info(
+        "config.py перечитан: модулей %d, категорий %d",
+        len(ui.modules), len(ui.error_categories),
+    )
+
+
+async def cmd_reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перечитать config.py по команде администратора."""
+    if update.effective_user.id not in _ui.admin_ids:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+
+    try:
+        ui = await asyncio.to_thread(_reload_config)
+    except Exception as exc:
+        await update.message.reply_text(
+            f"⚠️ config.py не перечитан, работаем по-старому:\n<code>{html.escape(str(exc))}</code>",
+            parse_mode="HTML",
+        )
+        return
+    await update.message.reply_text(
+        "🔄 <b>Настройки обновлены</b>\n\n"
+        f"Модулей: {len(ui.modules)}\n"
+        f"Категорий ошибок: {len(ui.error_categories)}\n"
+        f"Администраторов: {len(ui.admin_ids)}",
+        parse_mode="HTML",
+    )
+
+
+# ── Параллельная обработка обновлений ──────────────────────────────────
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления параллельно, но по одному на пользователя.
+
+    Разные сотрудники обслуживаются одновременно, а нажатия и сообщения
+    одного сотрудника выполняются строго в порядке поступления — иначе
+    ConversationHandler мог бы увидеть их вперемешку.
+
+    Слот из max_concurrent_updates обновление занимает, только когда до
+    него дошла очередь пользователя: ожидающие своей очереди обновления
+    (например, фотографии альбома) слотов не держат и не задерживают
+    остальных сотрудников.
+    """
+
+    def __init__(
+        self,
+        max_concurrent_updates: int,
+        flood: FloodControl | None = None,
+        forward=None,
+    ):
+        super().__init__(max_concurrent_updates)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._waiters: Counter[int] = Counter()
+        self._flood = flood
+        # forward(update, user_id) -> True, если обновление передано другому процессу
+        self._forward = forward
+
+    def in_progress(self) -> int:
+        """Сколько обновлений сейчас обрабатывается или ждёт своей очереди."""
+        return sum(self._waiters.values())
+
+    async def process_update(self, update: object, coroutine) -> None:
+        # Без семафора BaseUpdateProcessor: слот берётся в do_process_update
+        # уже после очереди пользователя
+        await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._slots:
+                await coroutine
+            return
+        if self._forward is not None and await self._forward(update, user.id):
+            coroutine.close()
+            return
+
+        # Лишнее отбрасываем до очереди пользователя: повтор нажатия, которое
+        # ещё обрабатывается, и всё сверх его ведра токенов. Фотографии
+        # альбома приходят пачкой и в ведро не считаются; об отброшенном
+        # сообщении сотрудник узнаёт, чтобы отправить его ещё раз
+        query = update.callback_query
+        message = update.message
+        flood = self._flood
+        if flood is not None:
+            if query is not None and not flood.begin(user.id, query.data):
+                coroutine.close()
+                await _answer_quietly(query)
+                return
+            album = message is not None and message.media_group_id is not None
+            if not album and not flood.allow(user.id):
+                coroutine.close()
+                if query is not None:
+                    flood.end(user.id, query.data)
+                    await _answer_quietly(query, "Слишком часто — подождите пару секунд")
+                elif message is not None and flood.warn_once(user.id):
+                    await _reply_quietly(
+                        message,
+                        "Слишком много сообщений подряд — последнее не принято. "
+                        "Подождите пару секунд и отправьте его ещё раз.",
+                    )
+                return
+
+        lock = self._locks.setdefault(user.id, asyncio.Lock())
+        self._waiters[user.id] += 1
+        try:
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            self._waiters[user.id] -= 1
+            if not self._waiters[user.id]:
+                del self._waiters[user.id]
+                del self._locks[user.id]
+            if flood is not None and query is not None:
+                flood.end(user.id, query.data)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+async def _answer_quietly(query, text: str | None = None):
+    """Снять «часики» с отброшенного нажатия; ошибки здесь не важны."""
+    try:
+        await query.answer(text)
+    except TelegramError:
+        pass
+
+
+async def _reply_quietly(message, text: str):
+    """Предупредить об отброшенном сообщении; ошибки здесь не важны."""
+    try:
+        await message.reply_text(text)
+    except TelegramError:
+        pass
+
+
+flood_control = FloodControl(FLOOD_RATE, FLOOD_BURST) if FLOOD_RATE else None
+
+# Общий лимит Telegram делится между процессами поровну
+api_limiter = (
+    TokenBucketRateLimiter(
+        API_OVERALL_RATE / WORKERS, API_CHAT_RATE or API_OVERALL_RATE, API_CHAT_BURST,
+    )
+    if API_OVERALL_RATE else None
+)
+
+
+# ── Несколько процессов-обработчиков ───────────────────────────────────
+
+# Номер этого процесса: 0 — принимает обновления от Telegram
+WORKER = 0
+
+# Очередь обновлений для остальных процессов (при WORKERS > 1)
+inbox = UpdateInbox(INBOX_DB_FILE) if WORKERS > 1 else None
+
+# Под этим номером в той же очереди обработчики передают процессу 0
+# обращения для сводки; как часто он их забирает, секунд
+DIGEST_SHARD = -1
+DIGEST_COLLECT_INTERVAL = 2
+
+
+def _shard(user_id: int) -> int:
+    return user_id % WORKERS
+
+
+async def forward_update(update: Update, user_id: int) -> bool:
+    """Передать обновление процессу, который обслуживает этого сотрудника."""
+    shard = _shard(user_id)
+    if shard == WORKER:
+        return False
+    await writer.call(inbox.push, shard, update.to_json(), operation="forward_update")
+    return True
+
+
+async def run_worker(shard: int):
+    """Процесс-обработчик: забирает из очереди обновления своих сотрудников.
+
+    С Telegram он не соединяется за обновлениями — их принимает процесс 0.
+    Останавливается по SIGTERM/SIGINT, дописав очередь записи.
+    """
+    app = build_application()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    await post_init(app)
+    await app.start()
+    try:
+        while not stop.is_set():
+            payloads = await asyncio.to_thread(inbox.claim, shard)
+            for payload in payloads:
+                await app.update_queue.put(Update.de_json(json.loads(payload), app.bot))
+            if not payloads:
+                try:
+                    await asyncio.wait_for(stop.wait(), WORKER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        await app.stop()
+        await app.shutdown()
+        await post_shutdown(app)
+
+
+# Обновления, на которые есть хендлеры; остальные Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+
+# ── Метрики ────────────────────────────────────────────────────────────
+
+STATE_NAMES = {
+    REG_FIO: "REG_FIO",
+    REG_MODULE: "REG_MODULE",
+    MAIN_MENU: "MAIN_MENU",
+    ERROR_CATEGORY: "ERROR_CATEGORY",
+    ERROR_DESCRIPTION: "ERROR_DESCRIPTION",
+    SUGGESTION_TEXT: "SUGGESTION_TEXT",
+}
+
+metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT) if METRICS_PORT else None
+profiler = ProfileSession()
+loop_watchdog = LoopWatchdog(STALL_THRESHOLD, history=STALL_HISTORY) if STALL_THRESHOLD else None
+
+
+def _instrument_handlers(app: Application):
+    """Обернуть замером времени callback каждого зарегистрированного хендлера."""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            if not isinstance(handler, ConversationHandler):
+                handler.callback = metrics.instrument_handler(handler.callback, "—")
+                continue
+            for h in handler.entry_points:
+                h.callback = metrics.instrument_handler(h.callback, "entry")
+            for state, state_handlers in handler.states.items():
+                for h in state_handlers:
+                    h.callback = metrics.instrument_handler(
+                        h.callback, STATE_NAMES.get(state, str(state))
+                    )
+            for h in handler.fallbacks:
+                h.callback = metrics.instrument_handler(h.callback, "fallback")
+
+
+def _register_gauges(app: Application):
+    metrics.registry.gauge(
+        "crm_writer_queue_depth", "Заявок в очереди фонового писателя", writer.qsize,
+    )
+    metrics.registry.gauge(
+        "crm_update_queue_depth", "Обновлений, ещё не взятых в обработку",
+        app.update_queue.qsize,
+    )
+    metrics.registry.gauge(
+        "crm_updates_in_progress", "Обновлений в обработке или в очереди пользователя",
+        app.update_processor.in_progress,
+    )
+    if flood_control is not None:
+        metrics.registry.counter(
+            "crm_flood_dropped_total", "Входящих обновлений отброшено ограничителем",
+            lambda: flood_control.dropped,
+        )
+        metrics.registry.counter(
+            "crm_flood_coalesced_total", "Повторных нажатий склеено с первым",
+            lambda: flood_control.coalesced,
+        )
+    if api_limiter is not None:
+        metrics.registry.counter(
+            "crm_api_delayed_total", "Исходящих вызовов, задержанных ограничителем",
+            lambda: api_limiter.delayed,
+        )
+        metrics.registry.counter(
+            "crm_api_retry_after_total", "Ответов 429 (RetryAfter) от Telegram",
+            lambda: api_limiter.retry_after,
+        )
+    if loop_watchdog is not None:
+        metrics.registry.counter(
+            "crm_event_loop_stalls_total", f"Зависаний event loop дольше {STALL_THRESHOLD} с",
+            lambda: loop_watchdog.total,
+        )
+    metrics.registry.gauge(
+        "crm_digest_pending", "Обращений, ждущих сводки для администраторов", digest.__len__,
+    )
+    if incidents is not None:
+        metrics.registry.gauge(
+            "crm_incident_window", "Обращений в окне поиска повторов", incidents.__len__,
+        )
+    if inbox is not None and WORKER == 0:
+        metrics.registry.gauge(
+            "crm_inbox_pending", "Обновлений, переданных обработчикам и ещё не взятых",
+            inbox.pending,
+        )
+
+
+def _start_profile(context: ContextTypes.DEFAULT_TYPE, chat_id: int, seconds: int) -> str:
+    """Включить профилировщик и поставить задачу, которая его выключит."""
+    if profiler.active:
+        return f"Профиль уже снимается, осталось {profiler.remaining():.0f} с."
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    profiler.start(seconds)
+    context.job_queue.run_once(finish_profile, seconds, chat_id=chat_id, name="profile")
+    return f"🔬 Снимаю профиль процесса {WORKER} в течение {seconds} с…"
+
+
+async def finish_profile(context: ContextTypes.DEFAULT_TYPE):
+    """Выключить профилировщик и прислать сводку и файл статистики."""
+    stats, elapsed = profiler.stop()
+    chat_id = context.job.chat_id
+    title = f", процесс {WORKER}" if WORKERS > 1 else ""
+    await context.bot.send_message(
+        chat_id, summary_text(stats, elapsed, title), parse_mode="HTML",
+    )
+    fd, path = tempfile.mkstemp(dir=Path(EXCEL_FILE).parent, prefix=".profile_", suffix=".prof")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(stats.dump_stats, path)
+        with open(path, "rb") as f:
+            await context.bot.send_document(
+                chat_id, document=f,
+                filename=f"profile_{WORKER}_{datetime.now():%Y%m%d_%H%M}.prof",
+                caption="Открыть: python -m pstats файл или snakeviz файл",
+            )
+    finally:
+        os.unlink(path)
+
+
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Снять профиль работающего бота: /profile 60 (секунд, по умолчанию 30)."""
+    if update.effective_user.id not in _ui.admin_ids:
+        await update.message.reply_text("У вас нет доступа к этой команде.")
+        return
+    if context.args and not context.args[0].isdigit():
+        await update.message.reply_text(
+            f"Укажите длительность в секундах, до {PROFILE_MAX_SECONDS}: /profile 60"
+        )
+        return
+    seconds = int(context.args[0]) if context.args else 30
+    await update.message.reply_text(_start_profile(context, update.effective_chat.id, seconds))
 
 
 # ── Настройка команд бота (кнопка «Меню» в Telegram) ──────────────────
@@ -493,14 +1723,87 @@ async def post_init(application):
         BotCommand("start", "Главное меню"),
         BotCommand("admin", "Панель администратора"),
     ])
+    await writer.start()
+    await blobs.start()
+    if loop_watchdog is not None:
+        await loop_watchdog.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+
+
+async def post_shutdown(application):
+    """Дописываем очередь записи на диск и закрываем журнал."""
+    if metrics_server is not None:
+        await metrics_server.stop()
+    if profiler.active:
+        profiler.stop()
+    if loop_watchdog is not None:
+        await loop_watchdog.stop()
+    await blobs.stop()
+    await writer.stop()
+    tickets.close()
+    users.close()
+    if inbox is not None:
+        inbox.close()
 
 
 # ── Запуск ─────────────────────────────────────────────────────────────
 
-def main():
+def open_storage():
+    """Открыть хранилища; перенести users.json и старый Excel-лог, если
+    это ещё не сделано (или продолжить прерванный перенос)."""
     _ensure_data_dir()
-
-    app = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+    users.load()
+    tickets.open()
+    if inbox is not None:
+        inbox.open()
+    archive.load()
+    moved = migrate_users(users, USERS_DB_FILE)
+    if moved:
+        print(f"Перенесено пользователей из users.json: {moved}")
+    imported = migrate_tickets(tickets, LEGACY_EXCEL_FILE)
+    if imported:
+        print(f"Перенесено обращений из Excel: {imported}")
+    if tickets.search_index_stale():
+        tickets.rebuild_search(itertools.chain(
+            *(archive.iter_records(s["period"]) for s in archive.segments()),
+            tickets.iter_records(),
+        ))
+        print("Поисковый индекс обращений собран заново")
+    segments = archive.segments()
+    if tickets.rollups_start() is None and segments:
+        tickets.backfill_rollups(
+            itertools.chain(*(archive.iter_records(s["period"]) for s in segments)),
+            period_bounds(segments[-1]["period"])[1],
+        )
+        print("Дневные сводки по архиву построены")
+    if incidents is not None:
+        incidents.load(tickets.recent_errors(incidents.cutoff()), tickets.last_id())
+
+
+def build_application(token: str = BOT_TOKEN, request: BaseRequest | None = None) -> Application:
+    """Собрать Application со всеми хендлерами.
+
+    request позволяет подменить HTTP-клиент Bot API (нужно бенчмарку).
+    """
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(SqlitePersistence(STATE_DB_FILE, writer, STATE_FLUSH_INTERVAL))
+        .concurrent_updates(PerUserUpdateProcessor(
+            CONCURRENT_UPDATES, flood_control,
+            forward_update if inbox is not None and WORKER == 0 else None,
+        ))
+    )
+    if api_limiter is not None:
+        builder = builder.rate_limiter(api_limiter)
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    else:
+        request = HTTPXRequest(connection_pool_size=256)
+    app = builder.request(MeteredRequest(request)).build()
 
     # Обработка текстовой кнопки «▶️ Старт»
     async def text_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -522,6 +1825,7 @@ def main():
             MAIN_MENU: [
                 CallbackQueryHandler(menu_handler, pattern=r"^(report_error|suggest)$"),
                 CallbackQueryHandler(back_to_menu, pattern=r"^back_menu$"),
+                MessageHandler(ATTACHMENT_FILTER, album_tail_handler),
             ],
             ERROR_CATEGORY: [
                 CallbackQueryHandler(error_category_handler, pattern=r"^errcat:"),
@@ -530,6 +1834,7 @@ def main():
             ERROR_DESCRIPTION: [
                 CallbackQueryHandler(back_to_menu, pattern=r"^back_menu$"),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, error_description_handler),
+                MessageHandler(ATTACHMENT_FILTER, error_attachment_handler),
             ],
             SUGGESTION_TEXT: [
                 CallbackQueryHandler(back_to_menu, pattern=r"^back_menu$"),
@@ -540,16 +1845,132 @@ def main():
             CommandHandler("start", cmd_start),
             MessageHandler(filters.Regex(r"^▶️ Старт$"), text_start),
         ],
+        name="main",
+        persistent=True,
     )
 
     app.add_handler(conv)
 
     # Админка (вне ConversationHandler, чтобы работала всегда)
     app.add_handler(CommandHandler("admin", cmd_admin))
+    app.add_handler(CommandHandler("users", cmd_users))
+    app.add_handler(CommandHandler("find", cmd_find))
+    app.add_handler(CommandHandler("files", cmd_files))
+    app.add_handler(CommandHandler("export", cmd_export))
+    app.add_handler(CommandHandler("profile", cmd_profile))
+    app.add_handler(CommandHandler("reload", cmd_reload))
     app.add_handler(CallbackQueryHandler(admin_callback, pattern=r"^admin:"))
 
-    print("CRM-Помощник запущен...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    _instrument_handlers(app)
+    _register_gauges(app)
+
+    if WORKER == 0:
+        if DIGEST_INTERVAL:
+            app.job_queue.run_repeating(
+                send_digest, interval=DIGEST_INTERVAL, first=DIGEST_INTERVAL,
+                name="admin_digest",
+            )
+            if inbox is not None:
+                app.job_queue.run_repeating(
+                    collect_digest, interval=DIGEST_COLLECT_INTERVAL, name="collect_digest"
+                )
+        app.job_queue.run_repeating(
+            seal_closed_months, interval=3600, first=10, name="seal_closed_months"
+        )
+        if ROLLUP_INTERVAL:
+            app.job_queue.run_repeating(
+                update_trend_reports, interval=ROLLUP_INTERVAL, first=30,
+                name="update_trend_reports",
+            )
+    if CONFIG_WATCH_INTERVAL:
+        app.job_queue.run_repeating(
+            watch_config, interval=CONFIG_WATCH_INTERVAL, name="watch_config"
+        )
+
+    return app
+
+
+def run_migration(args):
+    """python bot.py migrate: перенести users.json и Excel-лог в базу.
+
+    Переносит пачками с отметками о прогрессе: прерванный перенос
+    (Ctrl+C, падение) продолжается тем же вызовом. Бот при этом может
+    быть остановлен или работать — записи идут отдельными транзакциями.
+    """
+    _ensure_data_dir()
+    users.load()
+    tickets.open()
+    try:
+        moved = migrate_users(users, args.users, args.chunk_size, args.force)
+        print(f"Пользователи ({args.users}): "
+              + ("нечего переносить" if moved is None else f"добавлено {moved}"))
+        imported = migrate_tickets(tickets, args.excel, args.chunk_size, args.force)
+        print(f"Обращения ({args.excel}): "
+              + ("нечего переносить" if imported is None else f"перенесено {imported}"))
+    except MigrationError as exc:
+        sys.exit(f"Перенос остановлен: {exc}")
+    except KeyboardInterrupt:
+        sys.exit("Перенос прерван; повторный запуск продолжит с последней отметки.")
+    finally:
+        users.close()
+        tickets.close()
+
+
+def main():
+    global WORKER, metrics_server
+    parser = argparse.ArgumentParser(description="CRM-Помощник")
+    parser.add_argument(
+        "--worker", type=int, default=0,
+        help="номер процесса-обработчика 1..WORKERS-1 (без ключа — основной процесс)",
+    )
+    commands = parser.add_subparsers(dest="command")
+    migrate = commands.add_parser(
+        "migrate", help="перенести users.json и Excel-лог старой установки в базу",
+    )
+    migrate.add_argument("--users", default=USERS_DB_FILE, help="реестр пользователей (users.json)")
+    migrate.add_argument("--excel", default=LEGACY_EXCEL_FILE, help="Excel-лог обращений")
+    migrate.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="записей в одной транзакции")
+    migrate.add_argument(
+        "--force", action="store_true",
+        help="переносить обращения в непустой журнал / продолжить после изменения файла",
+    )
+    args = parser.parse_args()
+    if args.command == "migrate":
+        run_migration(args)
+        return
+    if not 0 <= args.worker < WORKERS:
+        parser.error(f"--worker должен быть от 1 до {WORKERS - 1} (WORKERS = {WORKERS})")
+
+    logging.basicConfig(
+        format=f"%(asctime)s %(levelname)s [{args.worker}] %(name)s: %(message)s",
+        level=logging.INFO,
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    WORKER = args.worker
+    if metrics_server is not None and WORKER:
+        metrics_server = MetricsServer(METRICS_LISTEN, METRICS_PORT + WORKER)
+    open_storage()
+    if WORKER:
+        print(f"CRM-Помощник: обработчик {WORKER} из {WORKERS} запущен...")
+        asyncio.run(run_worker(WORKER))
+        return
+
+    app = build_application()
+
+    if UPDATE_MODE == "webhook":
+        print(f"CRM-Помощник запущен (webhook, {WEBHOOK_LISTEN}:{WEBHOOK_PORT})...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        print("CRM-Помощник запущен...")
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
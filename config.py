@@ -8,7 +8,8 @@ ADMIN_IDS = [
 ]
 
 # ===== Модули 1С CRM =====
-# Можно добавлять/удалять/менять в любой момент
+# Можно добавлять/удалять/менять в любой момент: бот перечитает
+# MODULES, ERROR_CATEGORIES и ADMIN_IDS сам (или по команде /reload)
 MODULES = [
     "Воронка продаж",
     "Карточка клиента",
@@ -27,6 +28,98 @@ ERROR_CATEGORIES = [
     "Другое",
 ]
 
+# ===== Уведомления администраторов =====
+# Новые обращения приходят админам сводкой раз в DIGEST_INTERVAL секунд
+# (0 — не присылать)
+DIGEST_INTERVAL = 300
+# Обращение этих категорий отправляет сводку сразу, но не чаще
+# раза в PRIORITY_COOLDOWN секунд (список перечитывается на лету)
+PRIORITY_CATEGORIES = [
+    # "Воронка продаж",
+]
+PRIORITY_COOLDOWN = 60
+
 # ===== Пути к файлам данных =====
-USERS_DB_FILE = "data/users.json"
-EXCEL_FILE = "data/crm_support_log.xlsx"
+USERS_DB_FILE = "data/users.json"  # старый реестр: переносится в базу при первом запуске
+LEGACY_EXCEL_FILE = "data/crm_support_log.xlsx"  # старый Excel-лог: переносится так же
+EXCEL_FILE = "data/crm_support_export.xlsx"  # выгрузка, собирается из журнала
+TICKETS_DB_FILE = "data/tickets.db"  # общая база: обращения и пользователи
+ARCHIVE_DIR = "data/archive"  # закрытые месяцы: сжатый JSONL + Excel + manifest.json
+ATTACHMENTS_DIR = "data/attachments"  # скриншоты и файлы к обращениям
+REPORTS_DIR = "data/reports"  # отчёты о динамике за прошедшие недели и месяцы
+STATE_DB_FILE = "data/state.db"  # незавершённые диалоги, переживают перезапуск
+
+# Как часто (в секундах) изменения диалогов сохраняются в STATE_DB_FILE
+STATE_FLUSH_INTERVAL = 5
+
+# Как часто (в секундах) досчитывать дневные сводки для отчётов о динамике
+ROLLUP_INTERVAL = 3600
+
+# ===== Вложения =====
+# Bot API отдаёт боту файлы не больше 20 МБ
+ATTACHMENT_MAX_SIZE = 20 * 1024 * 1024
+# Превью картинок для просмотра в /files: размер по большей стороне
+# и сколько потоков их строят
+PREVIEW_SIZE = 1280
+PREVIEW_WORKERS = 2
+
+# ===== Повторные сообщения об одной проблеме =====
+# Ошибка, похожая на обращение того же модуля и категории за последние
+# DUPLICATE_WINDOW_MINUTES минут, прибавляется к его инциденту, а не
+# записывается отдельно (0 — выключить)
+DUPLICATE_WINDOW_MINUTES = 120
+# Насколько похожими должны быть описания: 0..1, чем больше, тем строже
+DUPLICATE_THRESHOLD = 0.6
+
+# ===== Получение обновлений от Telegram =====
+# "polling" — бот сам опрашивает Telegram (проще, подходит для начала)
+# "webhook" — Telegram присылает обновления на встроенный HTTP-сервер
+UPDATE_MODE = "polling"
+
+# Для webhook: бот слушает локальный адрес, снаружи его публикует
+# nginx (или другой прокси) по https-адресу WEBHOOK_URL
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "telegram"
+WEBHOOK_URL = ""  # например "https://bot.example.com/telegram"
+WEBHOOK_SECRET = ""  # любая случайная строка, проверяется в каждом запросе
+
+# Сколько обновлений обрабатывать одновременно
+# (обновления одного пользователя всё равно идут строго по очереди)
+CONCURRENT_UPDATES = 32
+
+# ===== Ограничение частоты =====
+# Входящие: сколько нажатий/сообщений в секунду от одного сотрудника
+# обрабатывается в среднем и сколько подряд допускается разом (0 — без ограничения)
+# Фотографии одного альбома не считаются; о непринятом сообщении бот
+# предупреждает сотрудника, лишние нажатия отбрасывает молча
+FLOOD_RATE = 1.0
+FLOOD_BURST = 8
+
+# Исходящие вызовы Bot API: всего в секунду и в один чат в секунду
+# (лимиты Telegram — около 30 и 1; 0 — без ограничения)
+API_OVERALL_RATE = 30
+API_CHAT_RATE = 1
+API_CHAT_BURST = 3
+
+# Сколько процессов обрабатывают обновления. Процесс 0 (python bot.py)
+# получает обновления и передаёт часть из них через INBOX_DB_FILE
+# процессам 1..WORKERS-1 (python bot.py --worker N); обновления одного
+# сотрудника всегда обрабатывает один и тот же процесс
+WORKERS = 1
+INBOX_DB_FILE = "data/inbox.db"
+WORKER_POLL_INTERVAL = 0.05  # как часто обработчик заглядывает в очередь, секунд
+
+# Как часто (в секундах) проверять, не изменился ли config.py (0 — не следить)
+CONFIG_WATCH_INTERVAL = 10
+
+# ===== Метрики производительности =====
+# Prometheus-метрики на http://METRICS_LISTEN:METRICS_PORT/metrics (0 — выключить)
+METRICS_LISTEN = "127.0.0.1"
+METRICS_PORT = 9108
+# Самый долгий профиль, который можно снять командой /profile, секунд
+PROFILE_MAX_SECONDS = 300
+# Event loop, занятый одним вызовом дольше стольких секунд, считается
+# зависанием: стек сохраняется для админки и пишется в лог (0 — не следить)
+STALL_THRESHOLD = 0.5
+STALL_HISTORY = 50  # сколько последних зависаний помнить
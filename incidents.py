@@ -0,0 +1,185 @@
+"""
+Склейка повторных сообщений об одной и той же проблеме.
+
+Когда CRM падает, десятки сотрудников почти одинаково описывают одну
+ошибку. Каждое новое сообщение об ошибке сравнивается с недавними
+обращениями того же модуля и категории по MinHash-подписи описания;
+похожее не становится новым обращением, а прибавляется к инциденту
+первого из них.
+
+Детектор живёт в потоке фонового писателя (StorageWriter) и вызывается
+только оттуда, поэтому своей блокировки у него нет. Обращения, которые
+записали другие процессы, он подтягивает из базы перед каждой пачкой:
+основную часть до транзакции записи, остаток — внутри неё. Подтягиваются
+только обращения из окна; более старые лишь сдвигают last_id.
+"""
+
+import hashlib
+import random
+from datetime import datetime, timedelta
+
+from search import terms
+
+_MERSENNE = (1 << 61) - 1
+
+
+def shingles(text: str) -> set[str]:
+    """Основы слов и пары соседних основ — единицы сравнения текстов."""
+    words = terms(text)
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+class IncidentDetector:
+    """Поиск похожих недавних обращений по MinHash и LSH.
+
+    Подпись — num_perm минимальных значений хэшей шинглов; совпадающие
+    полосы подписи (bands) дают кандидатов, окончательное решение — по
+    оценке коэффициента Жаккара не ниже threshold. Учитываются только
+    обращения, первое или последнее сообщение по которым пришло
+    не раньше, чем window назад.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.6,
+        window: timedelta = timedelta(hours=2),
+        num_perm: int = 64,
+        bands: int = 16,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.threshold = threshold
+        self.window = window
+        self.bands = bands
+        self._rows = num_perm // bands
+        # Фиксированное зерно: подписи одинаковы от запуска к запуску
+        rng = random.Random(20240601)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE), rng.randrange(_MERSENNE))
+            for _ in range(num_perm)
+        ]
+        # root -> (ключ, подпись, первое обращение, время последнего сообщения)
+        self._roots: dict = {}
+        self._buckets: dict[tuple, set] = {}
+        self._pruned_at = ""
+        # Номер последнего обращения, которое детектор уже видел
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return len(self._roots)
+
+    def cutoff(self, now: datetime | None = None) -> str:
+        return ((now or datetime.now()) - self.window).strftime("%Y-%m-%d %H:%M:%S")
+
+    def signature(self, text: str) -> tuple[int, ...] | None:
+        hashes = [
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+            for s in shingles(text)
+        ]
+        if not hashes:
+            return None
+        return tuple(
+            min((a * h + b) % _MERSENNE for h in hashes) for a, b in self._perms
+        )
+
+    @staticmethod
+    def _key(ticket: dict) -> tuple[str, str]:
+        return ticket["module"], ticket["category"]
+
+    def _bands(self, key, signature) -> list[tuple]:
+        r = self._rows
+        return [(key, i, signature[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    def match(self, ticket: dict, signature: tuple[int, ...] | None):
+        """Корень инцидента, к которому относится обращение, или None."""
+        if signature is None:
+            return None
+        self._prune(ticket["created_at"])
+        key = self._key(ticket)
+        candidates = set()
+        for band in self._bands(key, signature):
+            candidates |= self._buckets.get(band, set())
+
+        best, best_score = None, self.threshold
+        for root in candidates:
+            other = self._roots[root][1]
+            score = sum(x == y for x, y in zip(signature, other)) / len(signature)
+            if score >= best_score:
+                best, best_score = root, score
+        return best
+
+    def add(self, root, ticket: dict, signature: tuple[int, ...] | None):
+        """Запомнить новое обращение как возможный корень инцидента."""
+        if signature is None:
+            return
+        key = self._key(ticket)
+        first = {f: ticket[f] for f in ("created_at", "module", "category", "description")}
+        self._roots[root] = (key, signature, first, ticket["created_at"])
+        for band in self._bands(key, signature):
+            self._buckets.setdefault(band, set()).add(root)
+
+    def first(self, root) -> dict:
+        """Первое обращение инцидента (created_at, module, category, description)."""
+        return self._roots[root][2]
+
+    def touch(self, root, created_at: str) -> str:
+        """Новое сообщение по инциденту продлевает его жизнь в окне.
+
+        Возвращает прежнее время — чтобы вернуть его, если запись не удалась.
+        """
+        key, signature, first, previous = self._roots[root]
+        self._roots[root] = (key, signature, first, created_at)
+        return previous
+
+    def rename(self, old, new):
+        """Заменить временный ключ корня на номер обращения после записи."""
+        if old not in self._roots:
+            return
+        entry = self._roots.pop(old)
+        self._roots[new] = entry
+        self.last_id = max(self.last_id, new)
+        for band in self._bands(entry[0], entry[1]):
+            bucket = self._buckets[band]
+            bucket.discard(old)
+            bucket.add(new)
+
+    def load(self, records, last_id: int):
+        """Заполнить окно: записи (id, ticket, время последнего сообщения).
+
+        last_id — номер последнего обращения в журнале на момент выборки
+        records; дальше читается только то, что появилось после него,
+        даже если самих обращений до него в records не было (старше окна).
+        """
+        self.sync(records)
+        self.last_id = max(self.last_id, last_id)
+
+    def sync(self, records):
+        """Добавить в окно обращения, которых детектор ещё не видел."""
+        for ticket_id, ticket, last_at in records:
+            self.last_id = max(self.last_id, ticket_id)
+            if ticket_id in self._roots:
+                continue
+            self.add(ticket_id, ticket, self.signature(ticket["description"]))
+            if ticket_id in self._roots:
+                self.touch(ticket_id, last_at)
+
+    def _prune(self, now: str):
+        """Раз в минуту выбрасывать корни, выпавшие из окна."""
+        if now[:16] == self._pruned_at:
+            return
+        self._pruned_at = now[:16]
+        cutoff = self.cutoff(datetime.strptime(now, "%Y-%m-%d %H:%M:%S"))
+        for root in [r for r, entry in self._roots.items() if entry[3] < cutoff]:
+            self.forget(root)
+
+    def forget(self, root):
+        """Убрать корень из окна (истёк или не удалось записать)."""
+        entry = self._roots.pop(root, None)
+        if entry is None:
+            return
+        for band in self._bands(entry[0], entry[1]):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(root)
+                if not bucket:
+                    del self._buckets[band]
@@ -0,0 +1,289 @@
+"""
+Метрики производительности CRM-Помощника.
+
+Гистограммы задержек хендлеров, операций хранилища и вызовов Bot API,
+значения очередей. Отдаются в текстовом формате Prometheus по HTTP
+на локальном порту и сводкой в админ-панели.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, в секундах
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Сколько последних замеров хранить для точных перцентилей в сводке
+RECENT_SAMPLES = 1024
+
+
+class Histogram:
+    """Гистограмма в стиле Prometheus плюс окно последних замеров."""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: deque[float] = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def copy(self) -> "Histogram":
+        h = Histogram()
+        h.buckets = list(self.buckets)
+        h.count = self.count
+        h.sum = self.sum
+        h.recent = deque(self.recent, maxlen=RECENT_SAMPLES)
+        return h
+
+    def percentile(self, q: float) -> float:
+        """Перцентиль (0..100) по последним замерам."""
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+class MetricsRegistry:
+    """Все метрики процесса: гистограммы по имени и меткам, gauge- и
+    counter-функции.
+
+    Замеры приходят и из event loop, и из потока писателя, поэтому
+    запись и чтение гистограмм идут под общей блокировкой.
+    """
+
+    def __init__(self):
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+        self._help: dict[str, str] = {}
+        self._gauges: dict[str, tuple[str, Callable[[], float], str]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, help_text: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help_text)
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def gauge(self, name: str, help_text: str, fn):
+        """Зарегистрировать значение, которое вычисляется в момент чтения."""
+        self._gauges[name] = (help_text, fn, "gauge")
+
+    def counter(self, name: str, help_text: str, fn):
+        """То же для счётчика, который только растёт (имя на _total)."""
+        self._gauges[name] = (help_text, fn, "counter")
+
+    def series(self, name: str) -> dict[tuple, Histogram]:
+        """Снимок всех рядов одной метрики."""
+        with self._lock:
+            return {k: h.copy() for k, h in self._histograms.get(name, {}).items()}
+
+    def gauges(self) -> dict[str, float]:
+        values = {}
+        for name, (_, fn, _) in self._gauges.items():
+            try:
+                values[name] = fn()
+            except Exception:
+                logger.exception("Не удалось вычислить метрику %s", name)
+        return values
+
+    @contextmanager
+    def timer(self, name: str, help_text: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, help_text, time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for name in list(self._histograms):
+            series = self.series(name)
+            lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, h in series.items():
+                labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+                sep = "," if labels else ""
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.buckets):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {h.count}')
+                suffix = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {h.sum:.6f}")
+                lines.append(f"{name}_count{suffix} {h.count}")
+        values = self.gauges()
+        for name, (help_text, _, kind) in self._gauges.items():
+            if name in values:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {values[name]}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+# ── Готовые замеры ─────────────────────────────────────────────────────
+
+HANDLER_SECONDS = "crm_handler_seconds"
+STORAGE_SECONDS = "crm_storage_seconds"
+TELEGRAM_API_SECONDS = "crm_telegram_api_seconds"
+
+
+def storage_timer(operation: str):
+    """Замер операции хранилища: with storage_timer("append_tickets"): ..."""
+    return registry.timer(
+        STORAGE_SECONDS, "Длительность операций хранилища", operation=operation
+    )
+
+
+def timed_storage(operation: str):
+    """Декоратор для синхронных функций хранилища."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with storage_timer(operation):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_handler(callback, state: str):
+    """Обернуть callback хендлера замером времени с метками handler и state."""
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        with registry.timer(
+            HANDLER_SECONDS, "Длительность обработки обновления хендлером",
+            handler=name, state=state,
+        ):
+            return await callback(update, context)
+
+    return wrapper
+
+
+class MeteredRequest(BaseRequest):
+    """HTTP-клиент Bot API, замеряющий каждый исходящий вызов по методу."""
+
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+
+    @property
+    def read_timeout(self):
+        return self._inner.read_timeout
+
+    async def initialize(self) -> None:
+        await self._inner.initialize()
+
+    async def shutdown(self) -> None:
+        await self._inner.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data=None, **timeouts):
+        with registry.timer(
+            TELEGRAM_API_SECONDS, "Длительность вызовов Telegram Bot API",
+            method=url.rsplit("/", 1)[-1],
+        ):
+            return await self._inner.do_request(url, method, request_data, **timeouts)
+
+
+# ── HTTP-эндпоинт /metrics ─────────────────────────────────────────────
+
+class MetricsServer:
+    """Минимальный HTTP-сервер на asyncio: GET /metrics."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Метрики доступны на http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# ── Сводка для админ-панели ────────────────────────────────────────────
+
+def _label(key: tuple, name: str) -> str:
+    return dict(key).get(name, "")
+
+
+def summary_text(limit: int = 8) -> str:
+    """Короткая сводка: самые медленные хендлеры, хранилище, Bot API, очереди."""
+    def section(title: str, metric: str, label_fn) -> list[str]:
+        series = registry.series(metric)
+        rows = sorted(series.items(), key=lambda kv: kv[1].percentile(95), reverse=True)
+        lines = [f"\n<b>{title}</b> (p50 / p95, мс · вызовов)"]
+        for key, h in rows[:limit]:
+            lines.append(
+                f"{label_fn(key)}: {h.percentile(50) * 1000:.1f} / "
+                f"{h.percentile(95) * 1000:.1f} · {h.count}"
+            )
+        if not rows:
+            lines.append("замеров пока нет")
+        return lines
+
+    lines = ["⏱ <b>Производительность</b>"]
+    lines += section(
+        "Хендлеры", HANDLER_SECONDS,
+        lambda k: f"{_label(k, 'handler')} [{_label(k, 'state')}]",
+    )
+    lines += section("Хранилище", STORAGE_SECONDS, lambda k: _label(k, "operation"))
+    lines += section("Bot API", TELEGRAM_API_SECONDS, lambda k: _label(k, "method"))
+    gauges = registry.gauges()
+    if gauges:
+        lines.append("\n<b>Очереди</b>")
+        lines += [f"{name}: {value}" for name, value in gauges.items()]
+    return "\n".join(lines)
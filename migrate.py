@@ -0,0 +1,293 @@
+"""
+Перенос данных старых установок в общую базу: реестр пользователей
+из users.json и обращения из Excel-лога crm_support_log.xlsx.
+
+Оба файла читаются потоково — Excel в режиме read-only, users.json
+разбором по одной записи, — так что память не зависит от их размера.
+Записи пишутся пачками; пачка и отметка о том, докуда дошёл перенос,
+фиксируются одной транзакцией. Прерванный перенос при следующем запуске
+продолжается с отметки, без дублей и пропусков.
+
+Запуск вручную: python bot.py migrate (см. DEPLOY.md); при старте бота
+то же самое делается автоматически, если база ещё пуста.
+"""
+
+import io
+import json
+import os
+import time
+from typing import Callable, Iterator
+
+from openpyxl import load_workbook
+
+from storage import TICKET_FIELDS, TicketStore, UserRegistry
+
+CHUNK_SIZE = 5000
+
+
+class MigrationError(Exception):
+    """Перенос нельзя начать или продолжить без вмешательства."""
+
+
+def fingerprint(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+class Progress:
+    """Сообщения о ходе переноса не чаще раза в interval секунд."""
+
+    def __init__(
+        self, label: str, report: Callable[[str], None] | None,
+        start: int = 0, interval: float = 2.0,
+    ):
+        self.label = label
+        self.report = report
+        self.start = start  # уже перенесено до этого запуска
+        self.interval = interval
+        self.started = self._shown = time.monotonic()
+
+    def update(self, done: int, fraction: float | None = None, final: bool = False):
+        now = time.monotonic()
+        if self.report is None or not (final or now - self._shown >= self.interval):
+            return
+        self._shown = now
+        elapsed = max(now - self.started, 1e-9)
+        share = f" ({fraction:.0%})" if fraction is not None and not final else ""
+        self.report(
+            f"{self.label}: {done}{share} · "
+            f"{(done - self.start) / elapsed:.0f} в секунду · {elapsed:.0f} с"
+            + (" — готово" if final else "")
+        )
+
+
+# ── Потоковое чтение источников ────────────────────────────────────────
+
+def iter_json_object(
+    f, chunk_size: int = 1 << 16, name: str = "JSON"
+) -> Iterator[tuple[str, object]]:
+    """Пары (ключ, значение) JSON-объекта верхнего уровня по одной.
+
+    В памяти — только текущий кусок файла и одна запись, а не весь
+    документ, как у json.load. Ошибка разбора — MigrationError с именем
+    файла name и номером символа.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+    offset = 0  # сколько символов файла уже выброшено из buf
+
+    def fill():
+        nonlocal buf, pos, eof, offset
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        offset += pos
+        buf, pos = buf[pos:] + chunk, 0
+
+    def fail(message: str, at: int):
+        raise MigrationError(f"{name}: ошибка разбора JSON на символе {offset + at + 1}: {message}")
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def token(expected: str):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] not in expected:
+            fail("ожидалось " + " или ".join(f"«{c}»" for c in expected), pos)
+        pos += 1
+        return buf[pos - 1]
+
+    def value():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as exc:
+                if eof:
+                    fail(exc.msg, exc.pos)
+                fill()
+                continue
+            if end == len(buf) and not eof:
+                fill()  # число могло оборваться на границе куска
+                continue
+            pos = end
+            return obj
+
+    token("{")
+    skip_ws()
+    if buf[pos:pos + 1] == "}":
+        return
+    while True:
+        key = value()
+        token(":")
+        yield key, value()
+        if token(",}") == "}":
+            return
+
+
+# Первый заголовок выгрузки из журнала: в ней перед полями обращения
+# идёт его номер (в старом Excel-логе номера нет)
+_EXPORT_ID_HEADER = "№"
+
+
+def _user_record(key: str, user) -> tuple[int, str, str, str]:
+    """Запись users.json в (user_id, fio, module, registered_at)."""
+    if not isinstance(user.get("fio"), str) or not isinstance(user.get("module"), str):
+        raise ValueError("нет ФИО или модуля")
+    return int(key), user["fio"], user["module"], str(user.get("registered_at", ""))
+
+
+def _excel_ticket(values, skip: int = 0) -> dict:
+    """Строка старого Excel-лога в обращение; пустые ячейки — прочерк.
+
+    skip — сколько колонок перед полями обращения (номер в выгрузке).
+    """
+    values = list(values[skip: skip + len(TICKET_FIELDS)])
+    values += [None] * (len(TICKET_FIELDS) - len(values))
+    ticket = dict(zip(TICKET_FIELDS, values))
+    for field in TICKET_FIELDS:
+        if ticket[field] is None:
+            ticket[field] = "—" if field != "user_id" else 0
+    ticket["created_at"] = str(ticket["created_at"])
+    return ticket
+
+
+# ── Перенос ────────────────────────────────────────────────────────────
+
+def _resume(store, source: str, path: str, force: bool, empty: bool):
+    """Откуда продолжать перенос: (позиция, отпечаток файла, позиция в
+    отметке или None, если отметки нет); None — переносить нечего."""
+    checkpoint = store.checkpoint(source)
+    if checkpoint is not None and checkpoint.finished:
+        return None
+    fp = fingerprint(path)
+    if checkpoint is None:
+        if not empty and not force:
+            return None
+        return 0, fp, None
+    if checkpoint.fingerprint != fp and not force:
+        raise MigrationError(
+            f"{path} изменился после начала переноса (перенесено записей: "
+            f"{checkpoint.position}). Верните прежний файл или запустите перенос "
+            "с ключом --force, чтобы продолжить с той же позиции."
+        )
+    return checkpoint.position, fp, checkpoint.position
+
+
+def _commit(store, source: str, expected: int | None, position: int, fp: str, write, finished=False):
+    """Пачка и отметка — одной транзакцией; отметка сверяется внутри неё,
+    так что два процесса не перенесут одно и то же дважды."""
+    with store.transaction():
+        checkpoint = store.checkpoint(source)
+        if (checkpoint.position if checkpoint else None) != expected:
+            raise MigrationError(f"{source}: перенос уже идёт в другом процессе")
+        result = write()
+        store.save_checkpoint(source, position, fp, finished)
+    return result
+
+
+def migrate_users(
+    registry: UserRegistry, path: str, chunk_size: int = CHUNK_SIZE,
+    force: bool = False, report: Callable[[str], None] | None = print,
+) -> int | None:
+    """Перенести users.json в реестр; вернуть число новых пользователей.
+
+    None — переносить нечего: файла нет или он уже перенесён. Уже
+    зарегистрированные в боте пользователи не перезаписываются, поэтому
+    перенос можно запускать и в работающую базу.
+    """
+    if not os.path.exists(path):
+        return None
+    source = f"users:{os.path.abspath(path)}"
+    start = _resume(registry, source, path, force, empty=True)
+    if start is None:
+        return None
+    position, fp, expected = start
+    size = os.path.getsize(path) or 1
+    progress = Progress("Пользователи", report, position)
+    added, chunk, seen = 0, [], 0
+
+    def flush(finished=False):
+        nonlocal added, chunk, expected
+        records = chunk
+        added += _commit(registry, source, expected, seen, fp,
+                         lambda: registry.add_many(records), finished)
+        chunk, expected = [], seen
+
+    with open(path, "rb") as raw:
+        f = io.TextIOWrapper(raw, encoding="utf-8")
+        for key, user in iter_json_object(f, name=path):
+            seen += 1
+            if seen <= position:
+                continue
+            try:
+                chunk.append(_user_record(key, user))
+            except (AttributeError, ValueError) as exc:
+                raise MigrationError(
+                    f"{path}: пользователь {key!r} (запись {seen}) не разобран: {exc}"
+                ) from exc
+            if len(chunk) >= chunk_size:
+                flush()
+                progress.update(seen, raw.tell() / size)
+        flush(finished=True)
+    progress.update(seen, final=True)
+    return added
+
+
+def migrate_tickets(
+    store: TicketStore, path: str, chunk_size: int = CHUNK_SIZE,
+    force: bool = False, report: Callable[[str], None] | None = print,
+) -> int | None:
+    """Перенести обращения из Excel-лога в журнал; вернуть число строк.
+
+    None — переносить нечего: файла нет, он уже перенесён или журнал
+    не пуст (тогда это, скорее всего, выгрузка из самого журнала;
+    --force переносит всё равно).
+    """
+    if not os.path.exists(path):
+        return None
+    source = f"excel:{os.path.abspath(path)}"
+    start = _resume(store, source, path, force, empty=not store.count())
+    if start is None:
+        return None
+    position, fp, expected = start
+    progress = Progress("Обращения", report, position)
+    imported, chunk = 0, []
+
+    try:
+        wb = load_workbook(path, read_only=True)
+    except Exception as exc:  # openpyxl падает на битом файле разными исключениями
+        raise MigrationError(f"{path}: не удалось открыть как Excel-файл: {exc}") from exc
+    try:
+        ws = wb.active
+        total = ws.max_row - 1 if ws.max_row else None  # из заголовка файла, может не быть
+        header = next(ws.iter_rows(max_row=1, values_only=True), ())
+        skip = 1 if header and header[0] == _EXPORT_ID_HEADER else 0
+        row = position
+        for values in ws.iter_rows(min_row=2 + position, values_only=True):
+            row += 1
+            if any(values):
+                try:
+                    chunk.append(_excel_ticket(values, skip))
+                except (TypeError, ValueError) as exc:
+                    raise MigrationError(f"{path}, строка {row + 1}: {exc}") from exc
+            if len(chunk) >= chunk_size:
+                batch = chunk
+                _commit(store, source, expected, row, fp, lambda: store.append_many(batch))
+                imported += len(batch)
+                chunk, expected = [], row
+                progress.update(row, row / total if total else None)
+        _commit(store, source, expected, row, fp,
+                lambda: store.append_many(chunk) if chunk else [], finished=True)
+        imported += len(chunk)
+    finally:
+        wb.close()
+    progress.update(row, final=True)
+    return imported
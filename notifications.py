@@ -0,0 +1,110 @@
+"""
+Сводки новых обращений для администраторов.
+
+Обращения не рассылаются по одному: они копятся и раз в DIGEST_INTERVAL
+секунд уходят одним сообщением каждому администратору, сгруппированные
+по категории и модулю. Обращение приоритетной категории отправляет
+сводку сразу, но не чаще раза в PRIORITY_COOLDOWN секунд — так число
+сообщений не зависит от того, сколько обращений пришло.
+"""
+
+import html
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+# Telegram не принимает сообщения длиннее 4096 символов
+MESSAGE_LIMIT = 4000
+
+
+class DigestItem(NamedTuple):
+    ticket_id: int
+    kind: str
+    category: str
+    module: str
+    fio: str
+    description: str
+    reports: int  # больше 1 — повтор, прибавленный к инциденту ticket_id
+
+
+class AdminDigest:
+    """Очередь обращений для следующей сводки. Живёт в event loop."""
+
+    def __init__(self, priority_cooldown: float = 60):
+        self.priority_cooldown = priority_cooldown
+        self._pending: list[DigestItem] = []
+        self._urgent_at = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, item: DigestItem, priority: bool = False) -> bool:
+        """Поставить обращение в сводку; True — пора отправить её немедленно."""
+        self._pending.append(item)
+        now = time.monotonic()
+        if priority and now - self._urgent_at >= self.priority_cooldown:
+            self._urgent_at = now
+            return True
+        return False
+
+    def drain(self) -> list[DigestItem]:
+        items, self._pending = self._pending, []
+        return items
+
+
+def render(items: list[DigestItem], priority_categories=frozenset(), emoji=None) -> str:
+    """Текст сводки: группы «категория · модуль», самые крупные первыми.
+
+    Повторы по инцидентам не перечисляются, а показываются счётчиком
+    у своего обращения. Длина ограничена одним сообщением Telegram.
+    """
+    emoji = emoji or {}
+    new = [i for i in items if i.reports == 1]
+    repeats: dict[int, int] = defaultdict(int)
+    for item in items:
+        if item.reports > 1:
+            repeats[item.ticket_id] = max(repeats[item.ticket_id], item.reports)
+
+    groups: dict[tuple[str, str, str], list[DigestItem]] = defaultdict(list)
+    for item in new:
+        groups[(item.kind, item.category, item.module)].append(item)
+
+    def order(entry):
+        (kind, category, _), group = entry
+        return (category not in priority_categories, kind != "Ошибка", -len(group))
+
+    head = f"🔔 <b>Новые обращения: {len(new)}</b>"
+    if repeats:
+        head += f"\nПовторных сообщений по инцидентам: {sum(1 for i in items if i.reports > 1)}"
+    lines = [head]
+    shown = set()
+    for (kind, category, module), group in sorted(groups.items(), key=order):
+        mark = "🚨 " if category in priority_categories else ""
+        title = category if kind == "Ошибка" else kind
+        lines.append(
+            f"\n{mark}<b>{html.escape(title)}</b> · {emoji.get(module, '📁')} "
+            f"{html.escape(module)}: {len(group)}"
+        )
+        for item in group[:3]:
+            text = item.description if len(item.description) <= 80 else item.description[:80] + "…"
+            extra = f" (×{repeats[item.ticket_id]})" if item.ticket_id in repeats else ""
+            shown.add(item.ticket_id)
+            lines.append(f"#{item.ticket_id}{extra} {html.escape(item.fio)}: {html.escape(text)}")
+        if len(group) > 3:
+            lines.append(f"…и ещё {len(group) - 3}")
+
+    older = [(tid, n) for tid, n in repeats.items() if tid not in shown]
+    if older:
+        lines.append("\n<b>Продолжают сообщать:</b>")
+        lines += [
+            f"#{tid}: всего сообщений {n}"
+            for tid, n in sorted(older, key=lambda x: -x[1])[:5]
+        ]
+
+    text = ""
+    for i, line in enumerate(lines):
+        if len(text) + len(line) + 40 > MESSAGE_LIMIT:
+            text += "\n\n…сводка сокращена. Все обращения — в выгрузке Excel и через /find."
+            break
+        text += ("\n" if i else "") + line
+    return text
@@ -0,0 +1,159 @@
+"""
+Сохранение состояния диалогов между перезапусками бота.
+Состояния ConversationHandler и context.user_data хранятся в SQLite.
+"""
+
+import json
+import sqlite3
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import StorageWriter, connect, write_transaction
+
+
+class SqlitePersistence(BasePersistence):
+    """Persistence для ConversationHandler на SQLite.
+
+    В базу пишутся только изменившиеся записи: новое состояние одного
+    диалога или user_data одного пользователя — это одна строка, а не
+    перезапись всего хранилища. Записи идут через StorageWriter, чтение
+    происходит один раз при старте.
+    """
+
+    def __init__(self, path: str, writer: StorageWriter, update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._writer = writer
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.RLock()
+        # Последняя записанная версия user_data — чтобы не писать одно и то же
+        self._saved_user_data: dict[int, str] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = connect(self.path)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name  TEXT NOT NULL,
+                    key   TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    PRIMARY KEY (name, key)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data    TEXT NOT NULL
+                )
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple):
+        with self._lock:
+            with write_transaction(self._connect(), self._lock) as conn:
+                conn.execute(sql, params)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    # ── Чтение при старте ──────────────────────────────────────────────
+
+    async def get_user_data(self) -> dict[int, dict]:
+        rows = self._query("SELECT user_id, data FROM user_data")
+        self._saved_user_data = {user_id: data for user_id, data in rows}
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = self._query(
+            "SELECT key, state FROM conversations WHERE name = ?", (name,)
+        )
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    # ── Запись изменений ───────────────────────────────────────────────
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None):
+        key_json = json.dumps(list(key))
+        if new_state is None:
+            await self._writer.call(
+                self._execute,
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                (name, key_json),
+                operation="save_state",
+            )
+        else:
+            await self._writer.call(
+                self._execute,
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                (name, key_json, json.dumps(new_state)),
+                operation="save_state",
+            )
+
+    async def update_user_data(self, user_id: int, data: dict):
+        data_json = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        if self._saved_user_data.get(user_id) == data_json:
+            return
+        self._saved_user_data[user_id] = data_json
+        await self._writer.call(
+            self._execute,
+            "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+            (user_id, data_json),
+            operation="save_state",
+        )
+
+    async def drop_user_data(self, user_id: int):
+        self._saved_user_data.pop(user_id, None)
+        await self._writer.call(
+            self._execute,
+            "DELETE FROM user_data WHERE user_id = ?",
+            (user_id,),
+            operation="save_state",
+        )
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data: object):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
+
+    async def flush(self):
+        """Все изменения уже записаны в update_*; остаётся закрыть базу."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,95 @@
+"""
+Профилирование работающего бота по команде администратора (/profile).
+
+На заданное число секунд в потоке event loop, где выполняются все
+хендлеры и задачи JobQueue, включается cProfile; по истечении времени
+он выключается сам, а администратор получает сводку самых затратных
+функций и файл статистики (python -m pstats, snakeviz). Пока профиль
+не снимается, профилировщик не установлен и ничего не стоит.
+
+Время корутины считается только пока она занимает event loop: ожидание
+сети и базы в него не входит. Поток фонового писателя и asyncio.to_thread
+в профиль не попадают — их время видно в метриках хранилища.
+"""
+
+import cProfile
+import html
+import os
+import pstats
+import time
+
+# Сам event loop: через него проходит всё, в сводке он только мешает;
+# ожидание в select — простой, а не работа
+_LOOP_FILES = (f"{os.sep}asyncio{os.sep}", f"{os.sep}selectors.py")
+_LOOP_BUILTINS = ("of 'select.", "of '_contextvars.Context'")
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class ProfileSession:
+    """Один профиль за раз на процесс; start и stop — из потока event loop."""
+
+    def __init__(self):
+        self._profile: cProfile.Profile | None = None
+        self._started = 0.0
+        self.seconds = 0
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def remaining(self) -> float:
+        return max(0.0, self._started + self.seconds - time.monotonic())
+
+    def start(self, seconds: int):
+        if self._profile is not None:
+            raise RuntimeError("Профиль уже снимается")
+        profile = cProfile.Profile()
+        profile.enable()
+        self._profile, self._started, self.seconds = profile, time.monotonic(), seconds
+
+    def stop(self) -> tuple[pstats.Stats, float]:
+        """Выключить профилировщик; вернуть статистику и длительность в секундах."""
+        profile, self._profile = self._profile, None
+        if profile is None:
+            raise RuntimeError("Профиль не снимается")
+        profile.disable()
+        return pstats.Stats(profile), time.monotonic() - self._started
+
+
+def _label(filename: str, line: int, name: str) -> str:
+    if filename == "~":  # встроенная функция
+        return name
+    if filename.startswith(_PROJECT_DIR + os.sep):
+        short = os.path.relpath(filename, _PROJECT_DIR)
+    elif "site-packages" + os.sep in filename:
+        short = filename.rsplit("site-packages" + os.sep, 1)[1]
+    else:
+        short = os.path.basename(filename)
+    return f"{name} ({short}:{line})"
+
+
+def top_functions(stats: pstats.Stats, limit: int = 20) -> list[tuple[float, float, int, str]]:
+    """Самые затратные функции по суммарному времени: (сумм., собств., вызовов, имя)."""
+    rows = [
+        (cumtime, tottime, calls, _label(*func))
+        for func, (_, calls, tottime, cumtime, _) in stats.stats.items()
+        if not any(part in func[0] for part in _LOOP_FILES)
+        and not (func[0] == "~" and any(part in func[2] for part in _LOOP_BUILTINS))
+    ]
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+
+def summary_text(stats: pstats.Stats, elapsed: float, title: str = "", limit: int = 20) -> str:
+    """Сводка профиля для админки (HTML, укладывается в одно сообщение)."""
+    lines = [f"{'сумм.':>7} {'собств.':>7} {'вызовов':>8}  функция"]
+    for cumtime, tottime, calls, label in top_functions(stats, limit):
+        if len(label) > 70:
+            label = label[:69] + "…"
+        lines.append(f"{cumtime:7.3f} {tottime:7.3f} {calls:8d}  {label}")
+    return (
+        f"🔬 <b>Профиль за {elapsed:.0f} с</b>{html.escape(title)}\n"
+        "Время в секундах — сколько функция занимала event loop.\n\n"
+        f"<pre>{html.escape(chr(10).join(lines), quote=False)}</pre>"
+    )
@@ -0,0 +1,226 @@
+"""
+Ограничение частоты: входящие обновления от сотрудников и исходящие
+вызовы Bot API.
+
+Входящие — ведро токенов на пользователя: короткая серия нажатий
+проходит, долгий поток лишних нажатий отбрасывается до обработки.
+Повторное нажатие той же кнопки, пока первое ещё обрабатывается,
+склеивается с первым. Сообщение сверх ведра тоже не обрабатывается,
+но об этом сотруднику говорят (один раз на серию), чтобы он отправил
+его ещё раз.
+
+Исходящие — общее ведро на бота и ведро на чат, чтобы не упираться
+в лимиты Telegram и не ловить 429. Если Telegram всё же ответил
+RetryAfter, все исходящие вызовы ждут указанное время, а запрос
+повторяется.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity сразу."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        """Взять токен, если он есть."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, now: float) -> float:
+        """Занять токен в долг; вернуть, сколько секунд ждать до его появления."""
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+# ── Входящие обновления ────────────────────────────────────────────────
+
+class FloodControl:
+    """Ведро токенов на каждого пользователя и склейка повторных нажатий.
+
+    Всё вызывается из event loop, поэтому без блокировок.
+    """
+
+    # Как часто выбрасывать вёдра пользователей, которые давно молчат
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[int, TokenBucket] = {}
+        self._in_flight: set[tuple[int, str]] = set()
+        self._warned: set[int] = set()
+        self._pruned_at = time.monotonic()
+        self.allowed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.dropped_by_user: Counter[int] = Counter()
+
+    def allow(self, user_id: int) -> bool:
+        now = time.monotonic()
+        if now - self._pruned_at > self.PRUNE_INTERVAL:
+            self._prune(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst, now)
+        if bucket.take(now):
+            self.allowed += 1
+            self._warned.discard(user_id)
+            return True
+        self.dropped += 1
+        self.dropped_by_user[user_id] += 1
+        return False
+
+    def warn_once(self, user_id: int) -> bool:
+        """True, если о текущей серии отброшенных сообщений ещё не предупреждали."""
+        if user_id in self._warned:
+            return False
+        self._warned.add(user_id)
+        return True
+
+    def begin(self, user_id: int, data: str) -> bool:
+        """Отметить нажатие кнопки; False — такое же нажатие ещё обрабатывается."""
+        key = (user_id, data)
+        if key in self._in_flight:
+            self.coalesced += 1
+            return False
+        self._in_flight.add(key)
+        return True
+
+    def end(self, user_id: int, data: str):
+        self._in_flight.discard((user_id, data))
+
+    def _prune(self, now: float):
+        self._pruned_at = now
+        for user_id in [u for u, b in self._buckets.items() if b.full(now)]:
+            del self._buckets[user_id]
+            self._warned.discard(user_id)
+
+    def tracked(self) -> int:
+        return len(self._buckets)
+
+
+# ── Исходящие вызовы Bot API ───────────────────────────────────────────
+
+class TokenBucketRateLimiter(BaseRateLimiter[None]):
+    """Ограничитель исходящих запросов для Application.
+
+    Каждый запрос занимает токен в общем ведре и, если в нём есть
+    chat_id, в ведре этого чата (для групп — свой, более строгий лимит).
+    Запрос ждёт, пока оба токена появятся; очередь получается честной —
+    в порядке обращения.
+    """
+
+    # Вёдра чатов, которые давно не использовались, выбрасываются
+    PRUNE_INTERVAL = 60
+
+    def __init__(
+        self,
+        overall_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: int = 3,
+        group_rate: float = 20 / 60,
+        max_retries: int = 2,
+    ):
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._overall: TokenBucket | None = None
+        self._chats: dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._pruned_at = 0.0
+        self.requests = 0
+        self.delayed = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+        self.retry_after = 0
+
+    async def initialize(self) -> None:
+        now = time.monotonic()
+        self._overall = TokenBucket(self.overall_rate, self.overall_rate, now)
+        self._pruned_at = now
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 1, now)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _reserve(self, chat_id) -> float:
+        now = time.monotonic()
+        if now - self._pruned_at > self.PRUNE_INTERVAL:
+            self._pruned_at = now
+            for key in [k for k, b in self._chats.items() if b.full(now)]:
+                del self._chats[key]
+        wait = max(self._paused_until - now, self._overall.reserve(now))
+        if chat_id is not None:
+            wait = max(wait, self._chat_bucket(chat_id, now).reserve(now))
+        return wait
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id) if chat_id is not None else None
+        except (TypeError, ValueError):
+            chat_id = None  # @username канала — считаем только общий лимит
+
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            wait = self._reserve(chat_id)
+            if wait > 0:
+                self.delayed += 1
+                self.waited += wait
+                self.max_wait = max(self.max_wait, wait)
+                await asyncio.sleep(wait)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                self.retry_after += 1
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(
+                    "Telegram просит подождать %s с (%s); исходящие вызовы на паузе",
+                    exc.retry_after, endpoint,
+                )
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + float(exc.retry_after)
+                )
+
+    def tracked(self) -> int:
+        return len(self._chats)
@@ -0,0 +1,118 @@
+"""
+Excel-файлы CRM-Помощника: потоковая сборка выгрузки из журнала
+обращений с кэшированием и отчёты о динамике. Перенос старого
+Excel-лога в журнал — в migrate.py.
+"""
+
+import itertools
+import os
+import threading
+from typing import Callable, Iterable
+
+from openpyxl import Workbook
+
+from metrics import timed_storage
+from storage import TicketStore, atomic_output, atomic_write_text
+
+EXCEL_HEADERS = [
+    "№",
+    "Дата и время",
+    "Telegram ID",
+    "ФИО",
+    "Модуль",
+    "Тип обращения",
+    "Категория ошибки",
+    "Описание",
+    "Вложения",
+]
+
+EXCEL_WIDTHS = [8, 20, 14, 25, 22, 20, 30, 60, 40]
+
+# Сколько обращений за раз дополнять вложениями (одним запросом)
+ATTACHMENTS_BATCH = 500
+
+
+_export_lock = threading.Lock()
+
+
+@timed_storage("build_excel")
+def write_excel(records: Iterable, path: str, store: TicketStore):
+    """Записать обращения (кортежи (id, *TICKET_FIELDS)) в Excel.
+
+    В последней колонке — вложения: имя файла и sha256, под которым он
+    лежит в ATTACHMENTS_DIR/blobs. Книга пишется в режиме write-only
+    построчно, готовый файл подменяет старый атомарно.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Обращения")
+    for i, w in enumerate(EXCEL_WIDTHS, 1):
+        ws.column_dimensions[chr(64 + i)].width = w
+    ws.append(EXCEL_HEADERS)
+    records = iter(records)
+    while batch := list(itertools.islice(records, ATTACHMENTS_BATCH)):
+        files = store.attachment_files([record[0] for record in batch])
+        for record in batch:
+            names = "; ".join(f"{name} ({sha})" for sha, name in files.get(record[0], []))
+            ws.append([*record, names])
+
+    with atomic_output(path) as tmp_path:
+        wb.save(tmp_path)
+
+
+@timed_storage("build_trend_excel")
+def write_trend_excel(trends: dict, rows: list, period, path: str):
+    """Записать отчёт о динамике: сравнение с прошлым периодом и разбивку по дням.
+
+    trends — строки (модуль, категория, тип) -> (текущий, прошлый,
+    повторы) из trends.summarize; rows — дневные сводки обоих периодов.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Сводка")
+    for i, w in enumerate([22, 30, 16, 12, 12, 12, 12], 1):
+        ws.column_dimensions[chr(64 + i)].width = w
+    ws.append([period.title])
+    ws.append(["Модуль", "Категория", "Тип обращения", "Обращений",
+               "Было", "Изменение", "Повторы"])
+    for (module, category, kind), (current, previous, repeats) in sorted(
+        trends.items(), key=lambda x: (x[0][0], -x[1][0], x[0][1])
+    ):
+        ws.append([module, category, kind, current, previous, current - previous, repeats])
+
+    days = wb.create_sheet("По дням")
+    modules = sorted({row[1] for row in rows if row[0] >= period.start})
+    days.append(["День", *modules, "Всего", "Повторы"])
+    by_day: dict[str, list[int]] = {}
+    for day, module, _, _, tickets, repeats in rows:
+        if day < period.start or module not in modules:
+            continue
+        counts = by_day.setdefault(day, [0] * (len(modules) + 2))
+        counts[modules.index(module)] += tickets
+        counts[-2] += tickets
+        counts[-1] += repeats
+    for day in sorted(by_day):
+        days.append([day, *by_day[day]])
+
+    with atomic_output(path) as tmp_path:
+        wb.save(tmp_path)
+
+
+def export_excel(
+    store: TicketStore, path: str, records: Callable[[], Iterable] | None = None
+) -> str:
+    """Вернуть путь к актуальной выгрузке, пересобрав её только при нужде.
+
+    Рядом с файлом хранится номер поколения данных, из которого он
+    собран. Пока новых обращений нет, повторные выгрузки отдают тот же
+    файл без обращения к журналу. records — источник обращений
+    (id, *TICKET_FIELDS); по умолчанию все обращения журнала.
+    """
+    marker = f"{path}.generation"
+    with _export_lock:
+        generation = store.generation()
+        if os.path.exists(path) and os.path.exists(marker):
+            with open(marker, "r", encoding="utf-8") as f:
+                if f.read().strip() == str(generation):
+                    return path
+        write_excel(records() if records is not None else store.iter_records(), path, store)
+        atomic_write_text(marker, str(generation))
+    return path
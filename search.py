@@ -0,0 +1,207 @@
+"""
+Полнотекстовый поиск по описаниям обращений.
+
+Разбор текста на слова и приведение их к основе (стеммер Snowball для
+русского языка). Сам инвертированный индекс — таблица FTS5 в журнале
+обращений (storage.py): в неё пишутся основы слов описания, и поиск
+идёт по тем же основам, поэтому «карточки клиентов» находит
+«карточка клиента».
+"""
+
+import html
+import itertools
+import re
+from functools import lru_cache
+
+_WORD_RE = re.compile(r"[0-9a-zа-яё]+")
+
+# Служебные слова, которые только раздувают индекс. «не» оставлено
+# намеренно: «не открывается» и «открывается» — разные жалобы.
+STOPWORDS = frozenset(
+    "а и в во на с со к ко по о об обо от до за из у но или что как для при же "
+    "бы ли то это the".split()
+)
+
+# Версия разбора на основы: индекс, собранный другой версией stem(),
+# при старте собирается заново
+STEMMER_VERSION = 2
+
+# Отрицания поиску по части слов не помогают: «не» есть в большинстве жалоб
+NEGATIONS = frozenset({"не", "ни", "нет"})
+
+# Слово, которое есть в большей доле обращений, по части слов не ищется;
+# из остальных берутся самые редкие
+COMMON_SHARE = 0.2
+FALLBACK_TERMS = 5
+
+_VOWELS = "аеиоуыэюя"
+
+# Беглая гласная перед -к/-ц: «звонок» — «звонки», «ошибок» — «ошибка»,
+# «конец» — «конца». Короткие основы не трогаем, чтобы не склеить разные слова
+_FLEETING_RE = re.compile(r"([^аеиоуыэюя])[ое]([кц])$")
+
+_PERFECTIVE_GERUND = (("вшись", "вши", "в"), ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв"))
+_REFLEXIVE = ("ся", "сь")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому",
+    "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE = (("ем", "нн", "вш", "ющ", "щ"), ("ивш", "ывш", "ующ"))
+_VERB = (
+    ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н"),
+    (
+        "ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено",
+        "ует", "уют", "ены", "ить", "ыть", "ишь",
+        "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю",
+    ),
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях",
+    "ев", "ов", "ие", "ье", "еи", "ии", "ей", "ой", "ий", "ям", "ем", "ам", "ом",
+    "ах", "ях", "ию", "ью", "ия", "ья",
+    "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _regions(word: str) -> tuple[int, int]:
+    """Начало областей RV и R2 в слове."""
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+
+    def after_vc(start: int) -> int:
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    return rv, after_vc(after_vc(0))
+
+
+def _strip(word: str, rv: int, suffixes, after_a: bool = False) -> str | None:
+    """Отрезать самое длинное подходящее окончание в области RV.
+
+    Списки окончаний упорядочены от длинных к коротким.
+    """
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= rv:
+            stem = word[: -len(suffix)]
+            if after_a and not (stem.endswith("а") or stem.endswith("я")):
+                continue
+            return stem
+    return None
+
+
+def _strip_grouped(word: str, rv: int, groups) -> str | None:
+    """Окончания из двух групп: первой — только после «а»/«я»."""
+    first, second = groups
+    candidates = [s for s in (_strip(word, rv, first, after_a=True),
+                              _strip(word, rv, second)) if s is not None]
+    return min(candidates, key=len) if candidates else None
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Основа русского слова по алгоритму Snowball; прочие слова как есть."""
+    word = word.lower().replace("ё", "е")
+    if not any("а" <= ch <= "я" for ch in word):
+        return word
+    rv, r2 = _regions(word)
+
+    stripped = _strip_grouped(word, rv, _PERFECTIVE_GERUND)
+    if stripped is not None:
+        word = stripped
+    else:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        adjective = _strip(word, rv, _ADJECTIVE)
+        if adjective is not None:
+            word = _strip_grouped(adjective, rv, _PARTICIPLE) or adjective
+        else:
+            word = (
+                _strip_grouped(word, rv, _VERB)
+                or _strip(word, rv, _NOUN)
+                or word
+            )
+
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+    for suffix in _DERIVATIONAL:
+        if word.endswith(suffix) and len(word) - len(suffix) >= r2:
+            word = word[: -len(suffix)]
+            break
+    if word.endswith("нн"):
+        word = word[:-1]
+    else:
+        superlative = _strip(word, rv, _SUPERLATIVE)
+        if superlative is not None:
+            word = superlative[:-1] if superlative.endswith("нн") else superlative
+        elif word.endswith("ь") and len(word) - 1 >= rv:
+            word = word[:-1]
+    if len(word) > 4:
+        word = _FLEETING_RE.sub(r"\1\2", word)
+    return word
+
+
+def terms(text: str) -> list[str]:
+    """Основы значимых слов текста в порядке появления."""
+    return [
+        stem(word)
+        for word in _WORD_RE.findall(text.lower())
+        if word not in STOPWORDS and len(word) > 1
+    ]
+
+
+def index_text(text: str) -> str:
+    """Текст для колонки индекса: основы слов через пробел."""
+    return " ".join(terms(text))
+
+
+def match_all(words: list[str]) -> str:
+    """Выражение FTS5 MATCH: все основы сразу.
+
+    Каждая основа берётся в кавычки, так что операторы FTS5 в запросе
+    пользователя не работают и не ломают разбор.
+    """
+    return " ".join(f'"{w}"' for w in words)
+
+
+def match_at_least(words: list[str], k: int) -> str:
+    """Выражение FTS5 MATCH: хотя бы k основ из words."""
+    return " OR ".join(f"({match_all(c)})" for c in itertools.combinations(words, k))
+
+
+def fallback_terms(words: list[str], doc_freq: dict[str, int], docs: int) -> list[str]:
+    """Основы для поиска по части запроса, самые редкие первыми.
+
+    Отрицания, слова из большой доли обращений (doc_freq — в скольких
+    обращениях из docs есть основа) и слова, которых нет в индексе,
+    отбрасываются: с ними поиск по части слов выдаёт почти весь журнал.
+    """
+    common = max(docs * COMMON_SHARE, 100)
+    rare = [w for w in words if w not in NEGATIONS and 0 < doc_freq.get(w, 0) <= common]
+    return sorted(rare, key=doc_freq.get)[:FALLBACK_TERMS]
+
+
+def highlight(text: str, query: str, limit: int = 200) -> str:
+    """HTML-фрагмент текста с выделенными словами запроса.
+
+    Фрагмент начинается чуть раньше первого совпадения, чтобы в длинных
+    описаниях было видно, за что обращение попало в выдачу.
+    """
+    wanted = set(terms(query))
+    matches = [m for m in _WORD_RE.finditer(text.lower()) if stem(m.group()) in wanted]
+    start = 0
+    if matches and matches[0].start() > limit // 3:
+        start = text.rfind(" ", 0, matches[0].start() - limit // 6) + 1
+    end = min(len(text), start + limit)
+
+    parts, pos = [], start
+    for m in matches:
+        if m.start() < start or m.end() > end:
+            continue
+        parts.append(html.escape(text[pos:m.start()]))
+        parts.append(f"<b>{html.escape(text[m.start():m.end()])}</b>")
+        pos = m.end()
+    parts.append(html.escape(text[pos:end]))
+    return ("…" if start else "") + "".join(parts) + ("…" if end < len(text) else "")
@@ -0,0 +1,224 @@
+"""
+Сторож event loop: замечает, когда бот «замирает».
+
+Event loop один на процесс, и если хендлер синхронно пишет на диск или
+собирает Excel, все остальные сотрудники ждут. Сторож постоянно меряет
+задержку event loop (метрика crm_event_loop_lag_seconds), а когда
+очередной такт опаздывает больше чем на threshold, отдельный поток
+снимает стек потока event loop — тот вызов, который его держит.
+Последние зависания с хендлером, местом в коде бота и стеком хранятся
+в памяти для админки и пишутся в лог.
+"""
+
+import asyncio
+import html
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import types
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = "crm_event_loop_lag_seconds"
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_ASYNCIO_DIR = f"{os.sep}asyncio{os.sep}"
+# Код обёртки хендлера из metrics.instrument_handler: по нему кадр
+# узнаётся на любой версии Python (co_qualname появился только в 3.11)
+_HANDLER_WRAPPER = next(
+    c for c in metrics.instrument_handler.__code__.co_consts if isinstance(c, types.CodeType)
+)
+
+
+class Stall(NamedTuple):
+    """Одно зависание event loop."""
+
+    at: str  # когда началось
+    duration: float
+    handler: str  # хендлер или задача, во время которой случилось
+    site: str  # последний вызов из кода бота
+    call: str  # самый глубокий вызов — то, что блокировало
+    stack: str
+
+
+class _Capture(NamedTuple):
+    handler: str
+    site: str
+    call: str
+    stack: str
+
+
+def _where(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    short = path[len(_PROJECT_DIR):] if path.startswith(_PROJECT_DIR) else os.path.basename(path)
+    return f"{code.co_name} ({short}:{frame.f_lineno})"
+
+
+def _capture(frame) -> _Capture:
+    """Разобрать стек потока event loop: чей хендлер, где в коде бота, что блокирует."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()  # от внешнего к внутреннему
+
+    # Кадры текущей задачи — всё, что глубже последнего кадра самого asyncio
+    # (снаружи от него main() и run_polling, они есть в любом стеке)
+    task = frames
+    for i, f in enumerate(frames):
+        if _ASYNCIO_DIR in f.f_code.co_filename:
+            task = frames[i + 1:]
+    ours = [
+        f for f in task
+        if f.f_code.co_filename.startswith(_PROJECT_DIR)
+        and f.f_code.co_filename not in (__file__, metrics.__file__)
+    ]
+    handler = ""
+    for outer, inner in zip(frames, frames[1:]):
+        if outer.f_code is _HANDLER_WRAPPER:
+            handler = inner.f_code.co_name
+    if not handler and ours:
+        handler = ours[0].f_code.co_name  # задача JobQueue или служебный код бота
+    return _Capture(
+        handler=handler or "—",
+        site=_where(ours[-1]) if ours else "—",
+        call=_where(frames[-1]) if frames else "—",
+        stack="".join(traceback.format_list(traceback.extract_stack(frames[-1], limit=30))),
+    )
+
+
+class LoopWatchdog:
+    """Такт event loop раз в interval секунд и поток, который следит за ним."""
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1, history: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: deque[Stall] = deque(maxlen=history)
+        self.total = 0  # зависаний с запуска, включая вытесненные из stalls
+        self._beat = 0.0
+        self._loop_thread = 0
+        self._pending: tuple[float, _Capture] | None = None
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    async def start(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            beat, self._beat = self._beat, now
+            lag = max(0.0, now - beat - self.interval)
+            metrics.registry.observe(LOOP_LAG_SECONDS, "Задержка event loop", lag)
+            if lag >= self.threshold:
+                self._record(beat, lag)
+
+    def _watch(self):
+        """Поток сторожа: снять стек, пока event loop ещё занят.
+
+        Стек снимается уже на половине порога: к концу зависания вызов,
+        который его устроил, может успеть закончиться.
+        """
+        captured = None
+        while not self._stopping.wait(self.interval):
+            beat = self._beat
+            if beat == captured or time.monotonic() - beat - self.interval < self.threshold / 2:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            try:
+                capture = _capture(frame)
+            finally:
+                del frame
+            with self._lock:
+                self._pending = (beat, capture)
+            captured = beat
+
+    def _record(self, beat: float, lag: float):
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None and pending[0] == beat:
+            capture = pending[1]
+        else:
+            capture = _Capture("—", "—", "—", "стек не снят: зависание закончилось раньше\n")
+        at = (datetime.now() - timedelta(seconds=lag)).strftime("%Y-%m-%d %H:%M:%S")
+        stall = Stall(at, lag, *capture)
+        self.stalls.append(stall)
+        self.total += 1
+        logger.warning(
+            "Event loop заблокирован на %.2f с: %s → %s → %s\n%s",
+            lag, stall.handler, stall.site, stall.call, stall.stack.rstrip(),
+        )
+
+
+def summary_text(watchdog: LoopWatchdog, limit: int = 10) -> str:
+    """Экран админки: задержка event loop, частые и последние зависания."""
+    lag = metrics.registry.series(LOOP_LAG_SECONDS).get(())
+    lines = ["🐢 <b>Зависания event loop</b>"]
+    if lag is not None:
+        lines.append(
+            f"Задержка такта (p50 / p95 / макс., мс): {lag.percentile(50) * 1000:.1f} / "
+            f"{lag.percentile(95) * 1000:.1f} / {max(lag.recent) * 1000:.1f}"
+        )
+    lines.append(f"Зависаний дольше {watchdog.threshold:g} с с запуска: <b>{watchdog.total}</b>")
+    stalls = list(watchdog.stalls)
+    if not stalls:
+        return "\n".join(lines)
+
+    worst = Counter()
+    longest = {}
+    for s in stalls:
+        key = (s.handler, s.site)
+        worst[key] += 1
+        longest[key] = max(longest.get(key, 0.0), s.duration)
+    lines.append("\n<b>Чаще всего</b> (раз · макс., с)")
+    lines += [
+        f"{html.escape(handler)} · {html.escape(site)}: {n} · {longest[handler, site]:.2f}"
+        for (handler, site), n in worst.most_common(5)
+    ]
+    lines.append("\n<b>Последние</b>")
+    lines += [
+        f"{s.at[11:]} · {s.duration:.2f} с · {html.escape(s.handler)}\n   ↳ {html.escape(s.call)}"
+        for s in reversed(stalls[-limit:])
+    ]
+    return "\n".join(lines)
+
+
+def stacks_text(watchdog: LoopWatchdog) -> str:
+    """Все зависания из журнала со стеками — для файла."""
+    return "\n".join(
+        f"{s.at} · {s.duration:.3f} с · {s.handler}\n"
+        f"в коде бота: {s.site}\nблокирует: {s.call}\n{s.stack}"
+        for s in reversed(watchdog.stalls)
+    )
@@ -0,0 +1,1520 @@
+"""
+Хранилище данных CRM-Помощника.
+Реестр пользователей и журнал обращений в SQLite
+и единственный фоновый писатель, через который идут все записи.
+"""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+from incidents import IncidentDetector
+from metrics import storage_timer, timed_storage
+from search import (
+    STEMMER_VERSION, fallback_terms, index_text, match_all, match_at_least, terms,
+)
+
+
+# ── Атомарная запись файлов ────────────────────────────────────────────
+
+@contextmanager
+def atomic_output(path: str):
+    """Отдать временный путь рядом с path и по выходу подменить им path.
+
+    При падении процесса посреди записи на диске остаётся либо старая,
+    либо новая версия файла — но никогда не обрезанная.
+    """
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=target.parent, prefix=f".{target.name}.", suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def atomic_write_text(path: str, text: str):
+    """Записать текстовый файл целиком через atomic_output."""
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# ── Общая база SQLite ──────────────────────────────────────────────────
+
+# Сколько секунд ждать, пока другой процесс закончит запись в базу
+BUSY_TIMEOUT = 30
+
+
+def connect(path: str, durable: bool = False) -> sqlite3.Connection:
+    """Соединение с базой, в которую могут писать несколько процессов.
+
+    WAL: читатели не ждут писателя и видят последнее зафиксированное
+    состояние. Модуль sqlite3 переведён в autocommit — транзакции записи
+    открывает write_transaction().
+
+    durable — каждая фиксация доходит до диска (synchronous=FULL): для
+    данных, о сохранении которых бот сообщает пользователю. Без него
+    (NORMAL) последние транзакции могут пропасть при отключении питания.
+    Писатель фиксирует заявки пачками, так что fsync делится на пачку.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={'FULL' if durable else 'NORMAL'}")
+    return conn
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection, lock: threading.RLock):
+    """Транзакция записи: BEGIN IMMEDIATE ... COMMIT, при ошибке ROLLBACK.
+
+    Блокировка записи берётся в самом начале, а не при первом изменении,
+    поэтому два процесса не сталкиваются посреди транзакции, а просто
+    ждут друг друга (до BUSY_TIMEOUT). Вложенный вызов в том же потоке
+    выполняется внутри уже открытой транзакции.
+    """
+    with lock:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+class ReadersMixin:
+    """Чтение, которое не ждёт писателя.
+
+    Соединение писателя вместе с его блокировкой занято на всю транзакцию
+    BEGIN IMMEDIATE, а она сама может ждать другой процесс до BUSY_TIMEOUT.
+    Поэтому читают через отдельное соединение в каждом потоке: в WAL оно
+    видит последнее зафиксированное состояние и никого не ждёт. Поток,
+    у которого открыта своя транзакция записи, читает её соединением —
+    так видны ещё не зафиксированные изменения.
+
+    Класс задаёт path, _conn и _lock и вызывает _init_readers().
+    """
+
+    def _init_readers(self):
+        self._writer_thread: int | None = None
+        self._local = threading.local()
+        self._readers: list[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция записи; методы, вызванные внутри, пишут и читают в ней же."""
+        with write_transaction(self._conn, self._lock) as conn:
+            outer, self._writer_thread = self._writer_thread, threading.get_ident()
+            try:
+                yield conn
+            finally:
+                self._writer_thread = outer
+
+    @contextmanager
+    def _reading(self):
+        if self._writer_thread == threading.get_ident():
+            yield self._conn
+            return
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        yield conn
+
+    def _close_readers(self):
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        self._local = threading.local()
+
+
+# ── Пользователи ───────────────────────────────────────────────────────
+
+class UserPage(NamedTuple):
+    """Одна страница списка пользователей."""
+
+    items: list[tuple[str, dict]]
+    has_prev: bool
+    has_next: bool
+
+
+# Верхняя граница для поиска по префиксу: больше любой строки с ним
+_PREFIX_END = "\U0010ffff"
+
+
+# ── Отметки о переносе данных ──────────────────────────────────────────
+
+class Checkpoint(NamedTuple):
+    position: int  # сколько записей источника уже обработано
+    fingerprint: str  # размер и время изменения файла-источника
+    finished: bool
+
+
+class CheckpointsMixin:
+    """Отметки о прогрессе переноса данных (migrate.py).
+
+    Хранятся в той же базе и пишутся тем же соединением, что и
+    переносимые данные, поэтому пачка записей и отметка о ней
+    фиксируются одной транзакцией.
+    """
+
+    def _create_checkpoints(self, conn: sqlite3.Connection):
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS migrations (
+                source      TEXT PRIMARY KEY,
+                position    INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                finished    INTEGER NOT NULL,
+                updated_at  TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+
+    def checkpoint(self, source: str) -> Checkpoint | None:
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT position, fingerprint, finished FROM migrations WHERE source = ?",
+                (source,),
+            ).fetchone()
+        return Checkpoint(row[0], row[1], bool(row[2])) if row else None
+
+    def save_checkpoint(self, source: str, position: int, fingerprint: str, finished: bool = False):
+        """Записать отметку; вызывать внутри транзакции вместе с пачкой данных."""
+        with self.transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO migrations "
+                "(source, position, fingerprint, finished, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (source, position, fingerprint, int(finished),
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+            )
+
+
+class UserRegistry(ReadersMixin, CheckpointsMixin):
+    """Реестр пользователей в общей базе SQLite.
+
+    Каждое чтение идёт в базу (поиск по первичному ключу), так что
+    регистрация, сделанная в другом процессе, видна сразу. Записи идут
+    через StorageWriter.
+
+    Для постраничного просмотра есть индексы по ФИО и по модулю:
+    страница находится по курсору в индексе, без сортировки всего списка.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.RLock()
+        self._init_readers()
+
+    @timed_storage("load_users")
+    def load(self):
+        conn = connect(self.path, durable=True)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id       INTEGER PRIMARY KEY,
+                fio           TEXT NOT NULL,
+                module        TEXT NOT NULL,
+                registered_at TEXT NOT NULL,
+                fio_key       TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS users_fio ON users (fio_key, user_id)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS users_module ON users (module, fio_key, user_id)"
+        )
+        self._create_checkpoints(conn)
+        self._conn = conn
+
+    def close(self):
+        self._close_readers()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get(self, user_id: int) -> dict | None:
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT fio, module, registered_at FROM users WHERE user_id = ?",
+                (int(user_id),),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"fio": row[0], "module": row[1], "registered_at": row[2]}
+
+    def set(self, user_id: int, fio: str, module: str) -> dict:
+        """Зарегистрировать (или перерегистрировать) пользователя."""
+        record = {
+            "fio": fio,
+            "module": module,
+            "registered_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with self.transaction():
+            self._conn.execute(
+                "INSERT INTO users (user_id, fio, module, registered_at, fio_key) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+                "fio = excluded.fio, module = excluded.module, "
+                "registered_at = excluded.registered_at, fio_key = excluded.fio_key",
+                (int(user_id), fio, module, record["registered_at"], fio.casefold()),
+            )
+        return record
+
+    def set_many(self, users: Iterable[tuple[int, str, str]]):
+        """Записать много пользователей одной транзакцией."""
+        registered_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction():
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, fio, module, registered_at, fio_key) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(uid, fio, module, registered_at, fio.casefold()) for uid, fio, module in users],
+            )
+
+    def add_many(self, records: Iterable[tuple[int, str, str, str]]) -> int:
+        """Перенести пользователей (user_id, fio, module, registered_at) со старой
+        датой регистрации; уже зарегистрированные в боте не перезаписываются."""
+        with self.transaction():
+            cur = self._conn.executemany(
+                "INSERT OR IGNORE INTO users (user_id, fio, module, registered_at, fio_key) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(uid, fio, module, registered_at, fio.casefold())
+                 for uid, fio, module, registered_at in records],
+            )
+            return cur.rowcount
+
+    def __len__(self) -> int:
+        with self._reading() as conn:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def page(
+        self,
+        order: str = "fio",
+        *,
+        module: str | None = None,
+        prefix: str | None = None,
+        after: str | None = None,
+        before: str | None = None,
+        limit: int = 20,
+    ) -> UserPage:
+        """Страница пользователей по курсору.
+
+        order — "fio" или "module"; module оставляет только один модуль,
+        prefix — поиск по началу ФИО без учёта регистра (в сортировке по
+        модулю без фильтра не применяется). Курсор — ID
+        последнего (after) или первого (before) пользователя соседней
+        страницы.
+
+        Общее число и номер страницы не считаются: COUNT(*) прошёл бы весь
+        список. Есть ли соседние страницы, видно по лишней строке выборки.
+        """
+        where, params = [], []
+        if module is not None:
+            cols = ("fio_key", "user_id")
+            where.append("module = ?")
+            params.append(module)
+        elif order == "module":
+            cols = ("module", "fio_key", "user_id")
+        else:
+            cols = ("fio_key", "user_id")
+        if prefix and (module is not None or order != "module"):
+            p = prefix.casefold()
+            where += ["fio_key >= ?", "fio_key < ?"]
+            params += [p, p + _PREFIX_END]
+        scope = " AND ".join(where) or "1"
+        key = f"({', '.join(cols)})"
+        marks = f"({', '.join('?' * len(cols))})"
+        select = f"SELECT user_id, fio, module, registered_at, {', '.join(cols)} FROM users"
+        asc = ", ".join(cols)
+        desc = ", ".join(f"{c} DESC" for c in cols)
+
+        with self._reading() as conn:
+            cursor = after or before
+            cursor_key = None
+            if cursor is not None and cursor.isdigit():
+                cursor_key = conn.execute(
+                    f"SELECT {', '.join(cols)} FROM users WHERE user_id = ?", (int(cursor),)
+                ).fetchone()
+
+            rows = None
+            if cursor_key is not None and after is not None:
+                rows = conn.execute(
+                    f"{select} WHERE {scope} AND {key} > {marks} ORDER BY {asc} LIMIT ?",
+                    [*params, *cursor_key, limit + 1],
+                ).fetchall()
+                has_prev, has_next = True, len(rows) > limit
+                rows = rows[:limit]
+            elif cursor_key is not None:
+                rows = conn.execute(
+                    f"{select} WHERE {scope} AND {key} < {marks} ORDER BY {desc} LIMIT ?",
+                    [*params, *cursor_key, limit + 1],
+                ).fetchall()
+                has_prev, has_next = len(rows) > limit, True
+                rows = rows[:limit][::-1]
+                if not has_prev:
+                    rows = None  # до начала списка меньше limit строк
+            if rows is None:
+                rows = conn.execute(
+                    f"{select} WHERE {scope} ORDER BY {asc} LIMIT ?", [*params, limit + 1]
+                ).fetchall()
+                has_prev, has_next = False, len(rows) > limit
+                rows = rows[:limit]
+
+        items = [
+            (str(uid), {"fio": fio, "module": mod, "registered_at": registered_at})
+            for uid, fio, mod, registered_at, *_ in rows
+        ]
+        return UserPage(items, has_prev, has_next)
+
+
+# ── Обращения ──────────────────────────────────────────────────────────
+
+# Порядок полей совпадает с колонками Excel-выгрузки
+TICKET_FIELDS = (
+    "created_at",
+    "user_id",
+    "fio",
+    "module",
+    "kind",
+    "category",
+    "description",
+)
+
+
+# Срезы статистики: имя счётчика -> выражение SQL над таблицей tickets
+_COUNTER_COLUMNS = {
+    "kind": "kind",
+    "category": "category",
+    "module": "module",
+    "day": "substr(created_at, 1, 10)",
+}
+
+
+def period_bounds(period: str) -> tuple[str, str]:
+    """Границы месяца "YYYY-MM" для сравнения с created_at: [начало, конец)."""
+    year, month = map(int, period.split("-"))
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{period}-01", f"{year:04d}-{month:02d}-01"
+
+
+def _counter_keys(ticket: dict) -> list[tuple[str, str]]:
+    return [
+        ("total", ""),
+        ("kind", ticket["kind"]),
+        ("category", ticket["category"]),
+        ("module", ticket["module"]),
+        ("day", ticket["created_at"][:10]),
+    ]
+
+
+# Поля, по которым можно отфильтровать выгрузку (кроме периода)
+EXPORT_FILTERS = ("module", "category", "kind")
+
+
+# Поля обращения, которые хранит поисковый индекс для выдачи
+SEARCH_FIELDS = ("created_at", "fio", "module", "kind", "description")
+
+
+class SearchPage(NamedTuple):
+    """Страница результатов поиска: кортежи (id, *SEARCH_FIELDS)."""
+
+    hits: list[tuple]
+    offset: int
+    total: int
+    any_term: bool  # ни одно обращение не содержит всех слов — ищем по части
+
+
+class Incident(NamedTuple):
+    ticket_id: int
+    created_at: str
+    module: str
+    category: str
+    description: str
+    reports: int
+    reporters: int
+    last_at: str
+
+
+class Attachment(NamedTuple):
+    """Файл, приложенный к обращению; содержимое — в BlobStore по sha256."""
+
+    sha256: str
+    file_name: str
+    mime: str
+    size: int
+    preview: bool
+
+
+class TicketStore(ReadersMixin, CheckpointsMixin):
+    """Журнал обращений в SQLite — источник истины для Excel.
+
+    Новое обращение — это одна вставка строки плюс обновление счётчиков
+    статистики, её стоимость не зависит от размера журнала. Excel
+    строится из журнала по требованию.
+
+    В журнале живут только незакрытые месяцы: закрытые переносятся
+    в архив (archive.py) и удаляются отсюда, а их вклад в статистику
+    сохраняется в таблице archived_counters.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.RLock()
+        self._init_readers()
+
+    def open(self):
+        conn = connect(self.path, durable=True)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tickets (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at  TEXT NOT NULL,
+                user_id     INTEGER NOT NULL,
+                fio         TEXT NOT NULL,
+                module      TEXT NOT NULL,
+                kind        TEXT NOT NULL,
+                category    TEXT NOT NULL,
+                description TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS counters (
+                scope TEXT NOT NULL,
+                key   TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                PRIMARY KEY (scope, key)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS archived_counters (
+                scope TEXT NOT NULL,
+                key   TEXT NOT NULL,
+                value INTEGER NOT NULL,
+                PRIMARY KEY (scope, key)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS tickets_created_at ON tickets (created_at)"
+        )
+        # Для выгрузок с фильтром: строки одного модуля, категории или
+        # типа за период читаются по индексу, уже в порядке времени
+        for field in EXPORT_FILTERS:
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS tickets_{field} ON tickets ({field}, created_at)"
+            )
+        # Инциденты: первое обращение и число сообщений о той же проблеме.
+        # Повторные сообщения не становятся строками tickets, а пишутся
+        # сюда и в incident_reports (кто и когда сообщил).
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS incidents (
+                ticket_id   INTEGER PRIMARY KEY,
+                created_at  TEXT NOT NULL,
+                module      TEXT NOT NULL,
+                category    TEXT NOT NULL,
+                description TEXT NOT NULL,
+                reports     INTEGER NOT NULL,
+                last_at     TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS incidents_last_at ON incidents (last_at)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS incident_reports (
+                ticket_id   INTEGER NOT NULL,
+                created_at  TEXT NOT NULL,
+                user_id     INTEGER NOT NULL,
+                fio         TEXT NOT NULL,
+                description TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS incident_reports_ticket "
+            "ON incident_reports (ticket_id)"
+        )
+        # Вложения: содержимое лежит на диске по хэшу (attachments.py),
+        # здесь — что это за файл и к каким обращениям он приложен.
+        # blob_sources запоминает file_unique_id Telegram, чтобы не
+        # скачивать уже сохранённый файл повторно.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha256     TEXT PRIMARY KEY,
+                size       INTEGER NOT NULL,
+                mime       TEXT NOT NULL,
+                preview    INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blob_sources (
+                file_unique_id TEXT PRIMARY KEY,
+                sha256         TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ticket_attachments (
+                ticket_id INTEGER NOT NULL,
+                sha256    TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                PRIMARY KEY (ticket_id, sha256)
+            )
+            """
+        )
+        # Дневные сводки для отчётов о динамике: обращения и повторные
+        # сообщения по дню, модулю, категории и типу. Дни раньше отметки
+        # recompute_from окончательны и больше не пересчитываются.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS daily_rollups (
+                day      TEXT NOT NULL,
+                module   TEXT NOT NULL,
+                category TEXT NOT NULL,
+                kind     TEXT NOT NULL,
+                tickets  INTEGER NOT NULL,
+                repeats  INTEGER NOT NULL,
+                PRIMARY KEY (day, module, category, kind)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                key   TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        # Инвертированный индекс по основам слов описания; rowid — номер
+        # обращения. При архивации строки отсюда не удаляются, так что
+        # поиск охватывает и закрытые месяцы.
+        conn.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS ticket_search USING fts5(
+                terms, {', '.join(f + ' UNINDEXED' for f in SEARCH_FIELDS)}
+            )
+            """
+        )
+        # В скольких обращениях встречается каждая основа — для поиска
+        # по части слов запроса
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS ticket_search_terms "
+            "USING fts5vocab(ticket_search, row)"
+        )
+        # Версия stem(), которой собран индекс
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_state (
+                key   TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM ticket_search)").fetchone()[0]:
+            # Пустой индекс наполняется текущей версией stem()
+            conn.execute(
+                "INSERT OR REPLACE INTO search_state (key, value) VALUES ('stemmer', ?)",
+                (str(STEMMER_VERSION),),
+            )
+        self._create_checkpoints(conn)
+        self._conn = conn
+        if self._counters_drifted():
+            self.rebuild_counters()
+
+    def close(self):
+        self._close_readers()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def append(self, ticket: dict) -> int:
+        """Дописать обращение в журнал, вернуть его номер."""
+        return self.append_many([ticket])[-1]
+
+    @timed_storage("append_tickets")
+    def append_many(self, tickets: list[dict]) -> list[int]:
+        """Дописать несколько обращений одной транзакцией."""
+        sql = (
+            f"INSERT INTO tickets ({', '.join(TICKET_FIELDS)}) "
+            f"VALUES ({', '.join('?' * len(TICKET_FIELDS))})"
+        )
+        ids = []
+        deltas = Counter({("generation", ""): 1})
+        for t in tickets:
+            deltas.update(_counter_keys(t))
+        with self.transaction():
+            for t in tickets:
+                cur = self._conn.execute(sql, [t[f] for f in TICKET_FIELDS])
+                ids.append(cur.lastrowid)
+            self._index(zip(ids, tickets))
+            self._conn.executemany(
+                "INSERT INTO counters (scope, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, key) DO UPDATE SET value = value + excluded.value",
+                [(scope, key, n) for (scope, key), n in deltas.items()],
+            )
+            self._rollup_late(tickets)
+        return ids
+
+    def _rollup_late(self, tickets: list[dict]):
+        """Задним числом (перенос старых данных) — сразу в дневные сводки:
+        дни раньше recompute_from из журнала уже не пересчитываются."""
+        start = self.rollups_start()
+        if start is None or not tickets or min(t["created_at"] for t in tickets)[:10] >= start:
+            return
+        late = Counter(
+            (t["created_at"][:10], t["module"], t["category"], t["kind"])
+            for t in tickets if t["created_at"][:10] < start
+        )
+        self._conn.executemany(
+            "INSERT INTO daily_rollups (day, module, category, kind, tickets, repeats) "
+            "VALUES (?, ?, ?, ?, ?, 0) ON CONFLICT (day, module, category, kind) "
+            "DO UPDATE SET tickets = tickets + excluded.tickets",
+            [(*key, n) for key, n in late.items()],
+        )
+
+    def count(self) -> int:
+        return self.counters("total").get("", 0)
+
+    def _index(self, tickets):
+        """Добавить в поисковый индекс пары (id, обращение)."""
+        self._conn.executemany(
+            f"INSERT INTO ticket_search (rowid, terms, {', '.join(SEARCH_FIELDS)}) "
+            f"VALUES (?, ?, {', '.join('?' * len(SEARCH_FIELDS))})",
+            [
+                (ticket_id, index_text(t["description"]), *(t[f] for f in SEARCH_FIELDS))
+                for ticket_id, t in tickets
+            ],
+        )
+
+    @timed_storage("attach_reports")
+    def attach_reports(self, reports: list[tuple[int, dict, dict]]) -> list[int]:
+        """Прибавить повторные сообщения к инцидентам одной транзакцией.
+
+        reports — тройки (номер первого обращения, первое обращение,
+        повторное). Возвращает число сообщений в инциденте после каждой
+        прибавки (первое обращение тоже считается).
+        """
+        counts = []
+        with self.transaction():
+            for ticket_id, first, ticket in reports:
+                (reports_now,) = self._conn.execute(
+                    "INSERT INTO incidents (ticket_id, created_at, module, category, "
+                    "description, reports, last_at) VALUES (?, ?, ?, ?, ?, 2, ?) "
+                    "ON CONFLICT (ticket_id) DO UPDATE SET "
+                    "reports = reports + 1, last_at = excluded.last_at RETURNING reports",
+                    (ticket_id, first["created_at"], first["module"], first["category"],
+                     first["description"], ticket["created_at"]),
+                ).fetchone()
+                self._conn.execute(
+                    "INSERT INTO incident_reports (ticket_id, created_at, user_id, fio, description) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (ticket_id, ticket["created_at"], ticket["user_id"], ticket["fio"],
+                     ticket["description"]),
+                )
+                counts.append(reports_now)
+        return counts
+
+    def recent_errors(self, since: str) -> list[tuple[int, dict, str]]:
+        """Обращения-ошибки, живые после since: (id, обращение, последнее сообщение).
+
+        Нужны детектору инцидентов при старте: недавние обращения и
+        инциденты, по которым ещё приходят сообщения.
+        """
+        with self._reading() as conn:
+            rows = conn.execute(
+                "SELECT t.id, t.created_at, t.module, t.category, t.description, "
+                "COALESCE(i.last_at, t.created_at) FROM tickets t "
+                "LEFT JOIN incidents i ON i.ticket_id = t.id "
+                "WHERE t.kind = 'Ошибка' AND (t.created_at >= ? OR t.id IN "
+                "(SELECT ticket_id FROM incidents WHERE last_at >= ?)) ORDER BY t.id",
+                (since, since),
+            ).fetchall()
+        return [
+            (ticket_id, {"created_at": created_at, "module": module,
+                         "category": category, "description": description}, last_at)
+            for ticket_id, created_at, module, category, description, last_at in rows
+        ]
+
+    def errors_after(self, last_id: int, since: str) -> list[tuple[int, dict, str]]:
+        """Обращения-ошибки с номером больше last_id, созданные не раньше
+        since, — в том числе записанные другими процессами. Более старые
+        (перенос, задним числом) в окно детектора всё равно не попадут.
+        Формат как у recent_errors()."""
+        with self._reading() as conn:
+            rows = conn.execute(
+                "SELECT id, created_at, module, category, description FROM tickets "
+                "WHERE id > ? AND kind = 'Ошибка' AND created_at >= ? ORDER BY id",
+                (last_id, since),
+            ).fetchall()
+        return [
+            (ticket_id, {"created_at": created_at, "module": module,
+                         "category": category, "description": description}, created_at)
+            for ticket_id, created_at, module, category, description in rows
+        ]
+
+    def incidents(self, since: str, limit: int = 10) -> list[Incident]:
+        """Инциденты с сообщениями после since, самые массовые первыми."""
+        with self._reading() as conn:
+            rows = conn.execute(
+                "SELECT i.ticket_id, i.created_at, i.module, i.category, i.description, "
+                "i.reports, (SELECT COUNT(DISTINCT r.user_id) FROM incident_reports r "
+                "WHERE r.ticket_id = i.ticket_id) + 1, i.last_at "
+                "FROM incidents i WHERE i.last_at >= ? "
+                "ORDER BY i.reports DESC, i.last_at DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        return [Incident(*row) for row in rows]
+
+    def duplicates(self) -> int:
+        """Сколько всего повторных сообщений склеено в инциденты."""
+        with self._reading() as conn:
+            (n,) = conn.execute(
+                "SELECT COALESCE(SUM(reports - 1), 0) FROM incidents"
+            ).fetchone()
+        return n
+
+    def blob_for_source(self, file_unique_id: str) -> str | None:
+        """Хэш уже сохранённого файла Telegram, если он скачивался раньше."""
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT sha256 FROM blob_sources WHERE file_unique_id = ?", (file_unique_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_blob(self, sha256: str, size: int, mime: str, preview: bool, file_unique_id: str):
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction():
+            self._conn.execute(
+                "INSERT INTO blobs (sha256, size, mime, preview, created_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (sha256) DO UPDATE "
+                "SET preview = MAX(preview, excluded.preview)",
+                (sha256, size, mime, int(preview), created_at),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blob_sources (file_unique_id, sha256) VALUES (?, ?)",
+                (file_unique_id, sha256),
+            )
+
+    def attach_files(self, rows: Iterable[tuple[int, str, str]]):
+        """Привязать файлы к обращениям: кортежи (ticket_id, sha256, имя файла)."""
+        with self.transaction():
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO ticket_attachments (ticket_id, sha256, file_name) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            # Вложения есть в выгрузке Excel: кэш выгрузки устарел
+            self._conn.execute(
+                "INSERT INTO counters (scope, key, value) VALUES ('generation', '', 1) "
+                "ON CONFLICT (scope, key) DO UPDATE SET value = value + 1"
+            )
+
+    def attachments(self, ticket_id: int) -> list[Attachment]:
+        with self._reading() as conn:
+            rows = conn.execute(
+                "SELECT a.sha256, a.file_name, b.mime, b.size, b.preview "
+                "FROM ticket_attachments a JOIN blobs b USING (sha256) "
+                "WHERE a.ticket_id = ? ORDER BY a.rowid",
+                (ticket_id,),
+            ).fetchall()
+        return [Attachment(sha, name, mime, size, bool(preview))
+                for sha, name, mime, size, preview in rows]
+
+    def attachment_files(self, ticket_ids: list[int]) -> dict[int, list[tuple[str, str]]]:
+        """Вложения нескольких обращений для выгрузки: id -> [(sha256, имя файла)]."""
+        files: dict[int, list[tuple[str, str]]] = {}
+        if not ticket_ids:
+            return files
+        with self._reading() as conn:
+            rows = conn.execute(
+                "SELECT ticket_id, sha256, file_name FROM ticket_attachments "
+                f"WHERE ticket_id IN ({', '.join('?' * len(ticket_ids))}) ORDER BY rowid",
+                ticket_ids,
+            ).fetchall()
+        for ticket_id, sha, name in rows:
+            files.setdefault(ticket_id, []).append((sha, name))
+        return files
+
+    def search_index_stale(self) -> bool:
+        """В индексе не все обращения (база из версии без поиска) или он
+        собран другой версией разбора на основы."""
+        with self._reading() as conn:
+            (indexed,) = conn.execute("SELECT COUNT(*) FROM ticket_search").fetchone()
+            version = conn.execute(
+                "SELECT value FROM search_state WHERE key = 'stemmer'"
+            ).fetchone()
+        if indexed and version != (str(STEMMER_VERSION),):
+            return True
+        return indexed != self.count()
+
+    @timed_storage("rebuild_search")
+    def rebuild_search(self, records: Iterable[tuple], chunk_size: int = 1000):
+        """Собрать индекс заново из кортежей (id, *TICKET_FIELDS).
+
+        Журнал знает только незакрытые месяцы, поэтому записи архива
+        передаёт вызывающий.
+        """
+        with self.transaction():
+            self._conn.execute("DELETE FROM ticket_search")
+        batch = []
+        for record in records:
+            batch.append((record[0], dict(zip(TICKET_FIELDS, record[1:]))))
+            if len(batch) >= chunk_size:
+                with self.transaction():
+                    self._index(batch)
+                batch = []
+        with self.transaction():
+            self._index(batch)
+            self._conn.execute(
+                "INSERT INTO ticket_search (ticket_search) VALUES ('optimize')"
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_state (key, value) VALUES ('stemmer', ?)",
+                (str(STEMMER_VERSION),),
+            )
+
+    @timed_storage("search")
+    def search(self, query: str, limit: int = 10, offset: int = 0) -> SearchPage:
+        """Обращения, в описании которых есть все слова запроса, по релевантности.
+
+        Если таких нет, ищутся обращения со всеми значимыми словами, затем —
+        со всеми, кроме одного (search.fallback_terms). Порядок — bm25
+        с учётом длины описания, при равенстве новые выше.
+        """
+        words = list(dict.fromkeys(terms(query)))
+        if not words:
+            return SearchPage([], offset, 0, False)
+        with self._reading() as conn:
+            page = self._search_page(conn, match_all(words), limit, offset, False)
+            if page.total:
+                return page
+            doc_freq = dict(conn.execute(
+                "SELECT term, doc FROM ticket_search_terms "
+                f"WHERE term IN ({', '.join('?' * len(words))})",
+                words,
+            ))
+            rare = fallback_terms(words, doc_freq, self.count())
+            for k in sorted({len(rare), max(len(rare) - 1, 1)}, reverse=True) if rare else ():
+                page = self._search_page(conn, match_at_least(rare, k), limit, offset, True)
+                if page.total:
+                    return page
+        return SearchPage([], offset, 0, False)
+
+    @staticmethod
+    def _search_page(conn, match: str, limit: int, offset: int, any_term: bool) -> SearchPage:
+        (total,) = conn.execute(
+            "SELECT COUNT(*) FROM ticket_search WHERE ticket_search MATCH ?", (match,),
+        ).fetchone()
+        hits = []
+        if total:
+            hits = conn.execute(
+                f"SELECT rowid, {', '.join(SEARCH_FIELDS)} FROM ticket_search "
+                "WHERE ticket_search MATCH ? ORDER BY rank, rowid DESC "
+                "LIMIT ? OFFSET ?",
+                (match, limit, offset),
+            ).fetchall()
+        return SearchPage(hits, offset, total, any_term)
+
+    def counters(self, scope: str, since: str | None = None) -> dict[str, int]:
+        """Счётчики одного среза: total, kind, category, module или day.
+
+        Счётчики обновляются в той же транзакции, что и вставка
+        обращения, поэтому чтение не зависит от размера журнала.
+        """
+        sql = "SELECT key, value FROM counters WHERE scope = ?"
+        params = [scope]
+        if since is not None:
+            sql += " AND key >= ?"
+            params.append(since)
+        with self._reading() as conn:
+            rows = conn.execute(sql + " ORDER BY key", params).fetchall()
+        return dict(rows)
+
+    def last_id(self) -> int:
+        """Номер последнего записанного обращения (0, если их не было)."""
+        with self._reading() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM tickets").fetchone()[0]
+
+    def generation(self) -> int:
+        """Номер поколения данных: растёт при каждой записи в журнал."""
+        return self.counters("generation").get("", 0)
+
+    @timed_storage("rebuild_counters")
+    def rebuild_counters(self):
+        """Пересчитать все счётчики по журналу и архиву (если они разошлись)."""
+        with self.transaction():
+            self._conn.execute("DELETE FROM counters WHERE scope != 'generation'")
+            self._conn.executemany(
+                "INSERT INTO counters (scope, key, value) VALUES (?, ?, ?)",
+                self._aggregate("1", ()),
+            )
+            self._conn.execute(
+                "INSERT INTO counters SELECT scope, key, value FROM archived_counters "
+                "WHERE 1 ON CONFLICT (scope, key) DO UPDATE SET value = value + excluded.value"
+            )
+
+    def _aggregate(self, where: str, params: tuple) -> list[tuple[str, str, int]]:
+        """Счётчики по строкам журнала, подходящим под условие where."""
+        rows = [("total", "", self._conn.execute(
+            f"SELECT COUNT(*) FROM tickets WHERE {where}", params
+        ).fetchone()[0])]
+        for scope, expr in _COUNTER_COLUMNS.items():
+            rows += [
+                (scope, key, n)
+                for key, n in self._conn.execute(
+                    f"SELECT {expr}, COUNT(*) FROM tickets WHERE {where} GROUP BY {expr}",
+                    params,
+                )
+            ]
+        return rows
+
+    def _counters_drifted(self) -> bool:
+        # В транзакции, чтобы другой процесс не дописал обращение между запросами
+        with self.transaction():
+            (actual,) = self._conn.execute("SELECT COUNT(*) FROM tickets").fetchone()
+            row = self._conn.execute(
+                "SELECT value FROM archived_counters WHERE scope = 'total'"
+            ).fetchone()
+            return self.count() != actual + (row[0] if row else 0)
+
+    def periods(self) -> list[str]:
+        """Месяцы ("YYYY-MM"), обращения за которые ещё лежат в журнале."""
+        with self._reading() as conn:
+            rows = conn.execute(
+                "SELECT DISTINCT substr(created_at, 1, 7) FROM tickets ORDER BY 1"
+            ).fetchall()
+        return [period for (period,) in rows]
+
+    @timed_storage("archive_period")
+    def archive_period(self, period: str, max_id: int):
+        """Удалить из журнала месяц, уже записанный в архив (id <= max_id).
+
+        Вклад удаляемых строк в статистику переносится в archived_counters
+        той же транзакцией, так что пересчёт счётчиков остаётся точным.
+        Дневные сводки сначала досчитываются, чтобы месяц в них остался.
+        """
+        lo, hi = period_bounds(period)
+        where = "created_at >= ? AND created_at < ? AND id <= ?"
+        params = (lo, hi, max_id)
+        with self.transaction():
+            self.update_rollups()
+            self._conn.executemany(
+                "INSERT INTO archived_counters (scope, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, key) DO UPDATE SET value = value + excluded.value",
+                [row for row in self._aggregate(where, params) if row[2]],
+            )
+            self._conn.execute(f"DELETE FROM tickets WHERE {where}", params)
+            self._conn.execute(
+                "INSERT INTO counters (scope, key, value) VALUES ('generation', '', 1) "
+                "ON CONFLICT (scope, key) DO UPDATE SET value = value + 1"
+            )
+
+    # ── Дневные сводки ──
+
+    def rollups_start(self) -> str | None:
+        """С какого дня сводки ещё пересчитываются; None — не строились."""
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT value FROM rollup_state WHERE key = 'recompute_from'"
+            ).fetchone()
+        return row[0] if row else None
+
+    def _rollup_repeats(self, where: str, params: tuple):
+        """Прибавить к сводкам повторные сообщения по инцидентам."""
+        self._conn.execute(
+            "INSERT INTO daily_rollups (day, module, category, kind, tickets, repeats) "
+            "SELECT substr(r.created_at, 1, 10), i.module, i.category, 'Ошибка', 0, COUNT(*) "
+            f"FROM incident_reports r JOIN incidents i USING (ticket_id) WHERE {where} "
+            "GROUP BY 1, 2, 3 "
+            "ON CONFLICT (day, module, category, kind) "
+            "DO UPDATE SET repeats = repeats + excluded.repeats",
+            params,
+        )
+
+    def _set_rollups_start(self, day: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO rollup_state (key, value) VALUES ('recompute_from', ?)",
+            (day,),
+        )
+
+    @timed_storage("update_rollups")
+    def update_rollups(self, today: str | None = None) -> str:
+        """Досчитать дневные сводки по журналу; вернуть первый пересчитанный день.
+
+        Пересчитываются только дни с прошлого запуска (обычно один —
+        сегодняшний): прошедшие дни уже не меняются, так что стоимость
+        не зависит от размера журнала.
+        """
+        today = today or datetime.now().strftime("%Y-%m-%d")
+        with self.transaction():
+            start = self.rollups_start() or ""
+            self._conn.execute("DELETE FROM daily_rollups WHERE day >= ?", (start,))
+            self._conn.execute(
+                "INSERT INTO daily_rollups (day, module, category, kind, tickets, repeats) "
+                "SELECT substr(created_at, 1, 10), module, category, kind, COUNT(*), 0 "
+                "FROM tickets WHERE created_at >= ? GROUP BY 1, 2, 3, 4",
+                (start,),
+            )
+            self._rollup_repeats("r.created_at >= ?", (start,))
+            self._set_rollups_start(max(start, today))
+        return start
+
+    @timed_storage("backfill_rollups")
+    def backfill_rollups(self, records: Iterable[tuple], until: str):
+        """Построить сводки по архиву: записи (id, *TICKET_FIELDS) до дня until.
+
+        Нужно один раз при обновлении, когда закрытые месяцы уже
+        перенесены в архив и в журнале их нет.
+        """
+        index = {f: i + 1 for i, f in enumerate(TICKET_FIELDS)}
+        counts = Counter(
+            (r[index["created_at"]][:10], r[index["module"]], r[index["category"]], r[index["kind"]])
+            for r in records
+        )
+        with self.transaction():
+            self._conn.execute("DELETE FROM daily_rollups WHERE day < ?", (until,))
+            self._conn.executemany(
+                "INSERT INTO daily_rollups (day, module, category, kind, tickets, repeats) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                [(*key, n) for key, n in counts.items()],
+            )
+            self._rollup_repeats("r.created_at < ?", (until,))
+            self._set_rollups_start(until)
+
+    def rollups(self, since: str, until: str) -> list[tuple[str, str, str, str, int, int]]:
+        """Сводки за дни [since, until): (day, module, category, kind, tickets, repeats)."""
+        with self._reading() as conn:
+            return conn.execute(
+                "SELECT day, module, category, kind, tickets, repeats FROM daily_rollups "
+                "WHERE day >= ? AND day < ? ORDER BY day",
+                (since, until),
+            ).fetchall()
+
+    @timed_storage("vacuum")
+    def vacuum(self):
+        """Вернуть системе место, освободившееся после переноса в архив."""
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def iter_records(self, period: str | None = None, after_id: int = 0, chunk_size: int = 1000):
+        """Постранично отдать обращения журнала: кортежи (id, *TICKET_FIELDS).
+
+        period ограничивает выборку одним месяцем "YYYY-MM". Память
+        ограничена размером одной пачки, сколько бы строк ни было.
+        """
+        where, params = "id > ?", []
+        if period is not None:
+            where += " AND created_at >= ? AND created_at < ?"
+            params = list(period_bounds(period))
+        sql = (
+            f"SELECT id, {', '.join(TICKET_FIELDS)} FROM tickets "
+            f"WHERE {where} ORDER BY id LIMIT ?"
+        )
+        last_id = after_id
+        while True:
+            with self._reading() as conn:
+                rows = conn.execute(sql, [last_id, *params, chunk_size]).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def iter_filtered(
+        self, since: str, until: str, filters: dict[str, str] | None = None,
+        chunk_size: int = 1000,
+    ):
+        """Обращения журнала за [since, until), подходящие под filters
+        (поле из EXPORT_FILTERS -> значение): кортежи (id, *TICKET_FIELDS)
+        в порядке времени.
+
+        Выборку ведёт индекс (поле, created_at) или created_at: читаются
+        только подходящие строки, сколько бы лет ни было в журнале.
+        """
+        where, params = ["created_at >= ?", "created_at < ?"], [since, until]
+        for field, value in (filters or {}).items():
+            if field not in EXPORT_FILTERS:
+                raise ValueError(f"Нельзя фильтровать по полю {field!r}")
+            where.append(f"{field} = ?")
+            params.append(value)
+        sql = (
+            f"SELECT id, {', '.join(TICKET_FIELDS)} FROM tickets "
+            f"WHERE {' AND '.join(where)} AND (created_at, id) > (?, ?) "
+            "ORDER BY created_at, id LIMIT ?"
+        )
+        cursor = ("", 0)
+        while True:
+            with self._reading() as conn:
+                rows = conn.execute(sql, [*params, *cursor, chunk_size]).fetchall()
+            if not rows:
+                return
+            yield from rows
+            cursor = (rows[-1][1], rows[-1][0])
+
+
+# ── Передача обновлений между процессами ───────────────────────────────
+
+class UpdateInbox:
+    """Очередь обновлений Telegram от принимающего процесса к обработчикам.
+
+    Обновления пользователя всегда уходят в один и тот же процесс
+    (номер — user_id % WORKERS), поэтому они обрабатываются по порядку,
+    а состояние диалога живёт в одном месте. Обновление, забранное
+    обработчиком, из очереди удаляется.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.RLock()
+
+    def open(self):
+        conn = connect(self.path)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS inbox (
+                id      INTEGER PRIMARY KEY AUTOINCREMENT,
+                shard   INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS inbox_shard ON inbox (shard, id)")
+        self._conn = conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def push(self, shard: int, payload: str):
+        with write_transaction(self._conn, self._lock):
+            self._conn.execute(
+                "INSERT INTO inbox (shard, payload) VALUES (?, ?)", (shard, payload)
+            )
+
+    def claim(self, shard: int, limit: int = 100) -> list[str]:
+        """Забрать до limit обновлений своего процесса в порядке поступления."""
+        with self._lock:
+            # Дешёвая проверка без блокировки записи: обычно очередь пуста
+            if not self._conn.execute(
+                "SELECT 1 FROM inbox WHERE shard = ? LIMIT 1", (shard,)
+            ).fetchone():
+                return []
+            with write_transaction(self._conn, self._lock):
+                rows = self._conn.execute(
+                    "SELECT id, payload FROM inbox WHERE shard = ? ORDER BY id LIMIT ?",
+                    (shard, limit),
+                ).fetchall()
+                if rows:
+                    self._conn.execute(
+                        "DELETE FROM inbox WHERE shard = ? AND id <= ?", (shard, rows[-1][0])
+                    )
+        return [payload for _, payload in rows]
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM inbox").fetchone()[0]
+
+
+# ── Фоновая запись ─────────────────────────────────────────────────────
+
+class Receipt(NamedTuple):
+    """Ответ писателя на обращение."""
+
+    ticket_id: int  # номер обращения; для повтора — номер первого в инциденте
+    reports: int  # 1 — новое обращение, больше — столько сообщений в инциденте
+
+
+class StorageWriter:
+    """Единственный писатель процесса: все записи идут через одну очередь.
+
+    Хендлеры кладут заявку в asyncio-очередь и ждут подтверждения, а сама
+    запись выполняется в отдельном потоке и не блокирует event loop.
+    Пока идёт одна запись, новые заявки копятся и уходят следующей
+    пачкой — одной транзакцией. Писатели разных процессов ждут друг
+    друга на блокировке базы (BEGIN IMMEDIATE).
+    """
+
+    def __init__(
+        self,
+        tickets: TicketStore,
+        max_batch: int = 500,
+        incidents: IncidentDetector | None = None,
+    ):
+        self._tickets = tickets
+        self._incidents = incidents
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="storage-writer"
+        )
+        self._task = asyncio.create_task(self._run(), name="storage-writer")
+
+    async def stop(self):
+        """Дописать всё, что осталось в очереди, и остановиться."""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        self._executor.shutdown()
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def append_ticket(self, ticket: dict) -> Receipt:
+        """Записать обращение; ответ приходит после фиксации на диске.
+
+        Ошибка, похожая на недавнее обращение того же модуля и категории,
+        не записывается отдельно, а прибавляется к его инциденту.
+        Необязательный ключ "attachments" — пары (sha256, имя файла):
+        они привязываются к обращению в той же транзакции.
+        """
+        return await self._submit("ticket", ticket)
+
+    async def rebuild_counters(self):
+        """Пересчитать счётчики статистики по журналу."""
+        await self._submit("rebuild_counters", None)
+
+    async def call(self, fn, *args, operation: str = "call"):
+        """Выполнить произвольную запись в потоке писателя, по очереди с остальными.
+
+        operation — метка замера в метриках хранилища.
+        """
+        return await self._submit("call", (operation, partial(fn, *args)))
+
+    async def _submit(self, kind: str, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((kind, payload, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not (stopping and self._queue.empty()):
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if None in batch:
+                stopping = True
+                batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+
+            requests = [(kind, payload) for kind, payload, _ in batch]
+            try:
+                with storage_timer("writer_batch"):
+                    results = await loop.run_in_executor(
+                        self._executor, self._write_batch, requests
+                    )
+            except Exception as exc:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (_, _, future), (error, result) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def _write_batch(self, requests: list[tuple[str, object]]) -> list:
+        """Выполняется в потоке писателя: обращения пачки — одной
+        транзакцией, остальные заявки — каждая своей.
+
+        Возвращает пары (ошибка, результат) по каждой заявке: сбой одной
+        заявки достаётся только ей и не отменяет остальные.
+        """
+        outcomes = iter(self._write_tickets_isolated(
+            [payload for kind, payload in requests if kind == "ticket"]
+        ))
+        rebuilt = (None, None)
+        if any(kind == "rebuild_counters" for kind, _ in requests):
+            try:
+                self._tickets.rebuild_counters()
+            except Exception as exc:
+                rebuilt = (exc, None)
+
+        results = []
+        for kind, payload in requests:
+            if kind == "ticket":
+                results.append(next(outcomes))
+            elif kind == "rebuild_counters":
+                results.append(rebuilt)
+            elif kind == "call":
+                operation, fn = payload
+                try:
+                    with storage_timer(operation):
+                        results.append((None, fn()))
+                except Exception as exc:
+                    results.append((exc, None))
+        return results
+
+    def _write_tickets_isolated(self, tickets: list[dict]) -> list[tuple]:
+        """Записать обращения пачкой; пары (ошибка, квитанция) по каждому.
+
+        Если пачка не записалась (транзакция откатилась целиком), обращения
+        записываются заново по одному: ошибку получает только то, из-за
+        которого сорвалась пачка, остальные сохраняются.
+        """
+        try:
+            return [(None, receipt) for receipt in self._write_tickets(tickets)]
+        except Exception as exc:
+            if len(tickets) == 1:
+                return [(exc, None)]
+        outcomes = []
+        for ticket in tickets:
+            try:
+                outcomes.append((None, self._write_tickets([ticket])[0]))
+            except Exception as exc:
+                outcomes.append((exc, None))
+        return outcomes
+
+    def _write_tickets(self, tickets: list[dict]) -> list[Receipt]:
+        """Разделить пачку на новые обращения и повторы и записать их.
+
+        Всё происходит в одной транзакции: сначала детектор подтягивает
+        ошибки, записанные другими процессами, и пока блокировка записи
+        у нас, никто не добавит похожее обращение параллельно. Подписи
+        новых обращений и основная часть подтягивания считаются до
+        транзакции, чтобы не держать блокировку записи: внутри остаётся
+        только то, что другие процессы успели записать за это время.
+
+        Повтор может относиться к обращению из этой же пачки, у которого
+        ещё нет номера: до записи такие корни живут под временным
+        ключом ("new", позиция в пачке).
+        """
+        if not tickets:
+            return []
+        detector = self._incidents
+        signatures = [None] * len(tickets)
+        if detector is not None:
+            self._sync_incidents()
+            signatures = [
+                detector.signature(t["description"]) if t["kind"] == "Ошибка" else None
+                for t in tickets
+            ]
+        undo = []
+        try:
+            with self._tickets.transaction():
+                return self._classify_and_write(tickets, signatures, undo)
+        except Exception:
+            # Транзакция откатилась (в том числе на COMMIT): окно детектора
+            # возвращается к состоянию до пачки
+            for step in reversed(undo):
+                step()
+            raise
+
+    def _sync_incidents(self):
+        """Подтянуть в окно детектора ошибки, записанные другими процессами."""
+        detector = self._incidents
+        last_id = self._tickets.last_id()
+        detector.load(self._tickets.errors_after(detector.last_id, detector.cutoff()), last_id)
+
+    def _classify_and_write(
+        self, tickets: list[dict], signatures: list, undo: list
+    ) -> list[Receipt]:
+        """Записать пачку внутри транзакции; в undo — шаги, которые
+        откатывают изменения окна детектора, если транзакция не зафиксируется."""
+        detector = self._incidents
+        if detector is not None:
+            self._sync_incidents()
+            undo.append(partial(setattr, detector, "last_id", detector.last_id))
+        plan = []  # ("new", позиция среди новых) или ("dup", корень)
+        new, duplicates = [], []
+        for ticket, signature in zip(tickets, signatures):
+            if detector is not None and ticket["kind"] == "Ошибка":
+                root = detector.match(ticket, signature)
+                if root is not None:
+                    previous = detector.touch(root, ticket["created_at"])
+                    if not isinstance(root, tuple):  # новые корни пачки забываются целиком
+                        undo.append(partial(detector.touch, root, previous))
+                    plan.append(("dup", root))
+                    duplicates.append((root, ticket))
+                    continue
+                undo.append(partial(detector.forget, ("new", len(new))))
+                detector.add(("new", len(new)), ticket, signature)
+            plan.append(("new", len(new)))
+            new.append(ticket)
+
+        ids = self._tickets.append_many(new) if new else []
+        if detector is not None:
+            for i, ticket_id in enumerate(ids):
+                undo.append(partial(detector.forget, ticket_id))
+                detector.rename(("new", i), ticket_id)
+
+        def resolve(root):
+            return ids[root[1]] if isinstance(root, tuple) else root
+
+        counts = iter(self._tickets.attach_reports([
+            (resolve(root), detector.first(resolve(root)), ticket)
+            for root, ticket in duplicates
+        ]) if duplicates else [])
+        receipts = [
+            Receipt(ids[ref], 1) if action == "new"
+            else Receipt(resolve(ref), next(counts))
+            for action, ref in plan
+        ]
+        # Файлы повторного сообщения достаются обращению-инциденту
+        files = [
+            (receipt.ticket_id, sha256, file_name)
+            for receipt, ticket in zip(receipts, tickets)
+            for sha256, file_name in ticket.get("attachments", ())
+        ]
+        if files:
+            self._tickets.attach_files(files)
+        return receipts
@@ -0,0 +1,181 @@
+"""
+Отчёты о динамике обращений: прошедшая неделя и прошедший месяц
+в сравнении с предыдущими, по модулям и категориям.
+
+Отчёт строится из дневных сводок журнала (TicketStore.update_rollups),
+а не из самих обращений, поэтому не зависит от размера журнала. Отчёт
+за закрытый период больше не меняется: он собирается один раз и лежит
+в REPORTS_DIR текстом и Excel-файлом, откуда его берёт админка любого
+процесса.
+"""
+
+import html
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import NamedTuple
+
+from reports import write_trend_excel
+from storage import TicketStore, atomic_write_text
+
+PERIOD_KINDS = ("week", "month")
+
+
+class TrendPeriod(NamedTuple):
+    """Отчётный период [start, end) и такой же период перед ним."""
+
+    kind: str
+    key: str  # "2026-W41" или "2026-09": часть имени файла отчёта
+    title: str
+    start: str
+    end: str
+    prev_start: str
+
+
+def last_period(kind: str, today: date | None = None) -> TrendPeriod:
+    """Последняя закончившаяся неделя (пн–вс) или календарный месяц."""
+    today = today or date.today()
+    if kind == "week":
+        end = today - timedelta(days=today.weekday())
+        start = end - timedelta(days=7)
+        prev_start = start - timedelta(days=7)
+        year, week, _ = start.isocalendar()
+        key = f"{year}-W{week:02d}"
+        title = f"Неделя {start:%d.%m}–{end - timedelta(days=1):%d.%m.%Y}"
+    elif kind == "month":
+        end = today.replace(day=1)
+        start = (end - timedelta(days=1)).replace(day=1)
+        prev_start = (start - timedelta(days=1)).replace(day=1)
+        key = f"{start:%Y-%m}"
+        title = f"Месяц {start:%m.%Y}"
+    else:
+        raise ValueError(f"Неизвестный период: {kind!r}")
+    return TrendPeriod(kind, key, title, start.isoformat(), end.isoformat(), prev_start.isoformat())
+
+
+class Trend(NamedTuple):
+    """Сравнение периода с предыдущим по одной строке отчёта."""
+
+    current: int
+    previous: int
+    repeats: int
+
+
+def summarize(rows, period: TrendPeriod) -> dict[tuple[str, str, str], Trend]:
+    """Свернуть дневные сводки в строки (модуль, категория, тип) -> Trend."""
+    current, previous, repeats = Counter(), Counter(), Counter()
+    for day, module, category, kind, tickets, reps in rows:
+        key = (module, category, kind)
+        if day >= period.start:
+            current[key] += tickets
+            repeats[key] += reps
+        else:
+            previous[key] += tickets
+    return {
+        key: Trend(current[key], previous[key], repeats[key])
+        for key in current.keys() | previous.keys() | repeats.keys()
+    }
+
+
+def _change(current: int, previous: int) -> str:
+    if current == previous:
+        return "без изменений"
+    if not previous:
+        return "▲ новое"
+    percent = (current - previous) * 100 / previous
+    return f"{'▲' if percent > 0 else '▼'} {percent:+.0f}%"
+
+
+def _grouped(trends: dict, index: int, kind: str | None = None) -> dict[str, Trend]:
+    groups = defaultdict(lambda: [0, 0, 0])
+    for key, trend in trends.items():
+        if kind is not None and key[2] != kind:
+            continue
+        group = groups[key[index]]
+        for i, value in enumerate(trend):
+            group[i] += value
+    return {name: Trend(*values) for name, values in groups.items()}
+
+
+def render_text(trends: dict, period: TrendPeriod, emoji=None) -> str:
+    """Текстовая сводка отчёта для админки (HTML)."""
+    emoji = emoji or {}
+    previous_name = "прошлой неделе" if period.kind == "week" else "прошлому месяцу"
+    total = Trend(*(sum(t[i] for t in trends.values()) for i in range(3)))
+    kinds = _grouped(trends, 2)
+    lines = [
+        f"📈 <b>{period.title}</b>",
+        "",
+        f"Обращений: <b>{total.current}</b> ({_change(total.current, total.previous)} "
+        f"к {previous_name}, было {total.previous})",
+    ]
+    lines += [f"• {html.escape(kind)}: {t.current} (было {t.previous})" for kind, t in sorted(kinds.items())]
+    if total.repeats:
+        lines.append(f"Повторных сообщений по инцидентам: {total.repeats}")
+
+    modules = _grouped(trends, 0)
+    if modules:
+        lines += ["", "<b>По модулям:</b>"]
+        lines += [
+            f"{emoji.get(name, '📁')} {html.escape(name)}: {t.current} ({_change(t.current, t.previous)})"
+            for name, t in sorted(modules.items(), key=lambda x: -x[1].current)
+        ]
+
+    categories = _grouped(trends, 1, kind="Ошибка")
+    if categories:
+        lines += ["", "<b>Категории ошибок:</b>"]
+        lines += [
+            f"• {html.escape(name)}: {t.current} ({_change(t.current, t.previous)})"
+            for name, t in sorted(categories.items(), key=lambda x: -x[1].current)[:10]
+        ]
+
+    growing = sorted(
+        ((key, t) for key, t in trends.items() if t.current > t.previous and key[2] == "Ошибка"),
+        key=lambda x: -(x[1].current - x[1].previous),
+    )[:5]
+    if growing:
+        lines += ["", "<b>Сильнее всего выросло:</b>"]
+        lines += [
+            f"• {html.escape(module)} · {html.escape(category)}: {t.current} (было {t.previous})"
+            for (module, category, _), t in growing
+        ]
+    return "\n".join(lines)
+
+
+class TrendReports:
+    """Готовые отчёты за закрытые периоды: trend-<kind>-<key>.txt и .xlsx."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def text_path(self, period: TrendPeriod) -> Path:
+        return self.directory / f"trend-{period.kind}-{period.key}.txt"
+
+    def xlsx_path(self, period: TrendPeriod) -> Path:
+        return self.directory / f"trend-{period.kind}-{period.key}.xlsx"
+
+    def refresh(self, store: TicketStore, today: date | None = None, emoji=None) -> list[str]:
+        """Собрать отчёты за только что закрывшиеся периоды; вернуть их ключи.
+
+        Сводки к этому времени должны быть досчитаны (update_rollups).
+        """
+        built = []
+        for kind in PERIOD_KINDS:
+            period = last_period(kind, today)
+            if self.text_path(period).exists():
+                continue
+            rows = store.rollups(period.prev_start, period.end)
+            trends = summarize(rows, period)
+            write_trend_excel(trends, rows, period, str(self.xlsx_path(period)))
+            atomic_write_text(str(self.text_path(period)), render_text(trends, period, emoji))
+            built.append(f"{kind}:{period.key}")
+        return built
+
+    def latest(self, kind: str, today: date | None = None) -> tuple[str, Path] | None:
+        """Текст и Excel-файл отчёта за последний закрытый период, если он готов."""
+        period = last_period(kind, today)
+        path = self.text_path(period)
+        if not path.exists():
+            return None
+        return path.read_text(encoding="utf-8"), self.xlsx_path(period)
+